@@ -3,13 +3,26 @@ Heart Failure Analytics Dashboard
 
 """
 
+import functools
+import json
+import os
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import numpy as np
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
+
+from hf_analytics.analytics import Analytics
+from hf_analytics.cube import value_share
+from hf_analytics.deltas import LiveData
+from hf_analytics.figcache import FigureCache, cohort_signature
+from hf_analytics.intervals import risk_ratio_interval, two_proportion_p
+from hf_analytics.loader import DATA_PATH
+from hf_analytics.sqlbackend import SQLAnalytics, duckdb_available
+from hf_analytics import profiling
+from hf_analytics.profiling import annotate, on_miss, span
+
+
 
 
 st.set_page_config(page_title="Heart Failure Analytics", page_icon="🫀", layout="wide")
@@ -24,267 +37,285 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # DATA LOADING
-@st.cache_data
-def load_data():
+# "pandas": tables (Parquet cache under data/.cache, compacted dtypes) and everything
+# derived from them: patient table, filter bitmaps, outcome cube, threshold index,
+# drug matrix, built on first use. "sql": a DuckDB file built from the same cache,
+# queried per chart (needs duckdb). cache_resource shares one read-only instance
+# per backend across sessions; new delta batches under data/deltas are appended
+# to it on the next rerun. With HF_SHARED=1 the pandas tables are memory-mapped
+# from an Arrow snapshot shared by every server process (hf_analytics.shared).
+# Nothing loads at import time
+BACKENDS = ["pandas", "sql"]
+DEFAULT_BACKEND = os.environ.get("HF_BACKEND", "pandas")
+SHARED = os.environ.get("HF_SHARED") == "1"
+
+# Error bars on rate charts: Wilson score (closed form) or bootstrap (hf_analytics.intervals)
+CI_METHODS = {"Wilson": "wilson", "Bootstrap": "bootstrap", "Off": None}
+
+@st.cache_resource
+def load_analytics(backend="pandas"):
+    annotate(cache="miss")
     try:
-        file_path = "data/Cardiacfailure_cleaned.xlsx"
-        xls = pd.ExcelFile(file_path)
-        
-        # Load with exact sheet names
-        Demog = pd.read_excel(xls, "Demography")
-        HosDis = pd.read_excel(xls, "Hospitalization_Discharge")
-        CardiacComp = pd.read_excel(xls, "CardiacComplications")
-        Labs = pd.read_excel(xls, "Labs")
-        PaHi = pd.read_excel(xls, "PatientHistory")
-        Respons = pd.read_excel(xls, "Responsivenes")
-        PatPre = pd.read_excel(xls, "Patient_Precriptions")
-        
-        # Create GCS_category in Respons if not present
-        if 'GCS_category' not in Respons.columns and 'GCS' in Respons.columns:
-            def gcs_category(gcs):
-                if gcs == 15:
-                    return 'Normal'
-                elif gcs >= 13:
-                    return 'Low-Risk'
-                else:
-                    return 'High-Risk'
-            Respons['GCS_category'] = Respons['GCS'].apply(gcs_category)
-        
-        # Create age categories in Demog if not present
-        if 'ageCat' not in Demog.columns and 'age' in Demog.columns:
-            Demog['ageCat'] = pd.cut(Demog['age'], bins=[0,29,39,49,59,69,79,89,100],
-                                     labels=['21-29','29-39','39-49','49-59','59-69','69-79','79-89','89+'])
-            
-        # Create emergency_return_group in Demog if not present    
-        if 'time_to_emergency_department_within_6_months' in HosDis.columns:
-            max_value = HosDis['time_to_emergency_department_within_6_months'].max()
-            bins = [0, 7, 30, 90, max_value]
-            labels = ['<7 days', '8–30 days', '31–90 days', '90+ days']
-            HosDis['emergency_return_group'] = pd.cut( HosDis['time_to_emergency_department_within_6_months'],bins=bins, labels=labels, include_lowest=True )    
-         
-         # Create hf_top3_score in Labs if not present
-        if 'hf_top3_score' not in Labs.columns:
-            if all(c in Labs.columns for c in ['lactate', 'sodium', 'high_sensitivity_troponin']):
-                Labs['hf_top3_score'] = (
-                    (Labs['lactate'] >= 2.0).astype(int) +
-                    (Labs['sodium'] < 135).astype(int) +
-                    (Labs['high_sensitivity_troponin'] > 0.04).astype(int)
-                )
-        
-        return Demog, HosDis, CardiacComp, Labs, PaHi, Respons, PatPre
+        if backend == "sql":
+            return LiveData(lambda: SQLAnalytics.load(DATA_PATH))
+        if SHARED:
+            return LiveData(lambda: Analytics.shared(DATA_PATH))
+        return LiveData(lambda: Analytics.load(DATA_PATH))
         
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         st.stop()
 
-# LOAD DATA
-Demog, HosDis, CardiacComp, Labs, PaHi, Respons, PatPre = load_data()
+def current_data(live):
+    """The shared data with any new delta batches applied; keeps the loaded data if a batch fails."""
+    try:
+        return live.current()
+    except Exception as e:
+        st.warning(f"Could not apply new delta batches: {str(e)}")
+        return live.data
 
-def main():
-    st.markdown('<h1 class="main-header">🫀 Heart Failure Analytics Dashboard</h1>', unsafe_allow_html=True)
-    st.markdown(f"**Analyzing {len(Demog):,} patients from PhysioNet Dataset**")
-    st.markdown("---")
+# Serialized figures shared by all sessions, keyed by chart id + cohort signature
+@st.cache_resource
+def load_figure_cache():
+    return FigureCache(max_bytes=64 * 1024 * 1024)
+
+# Co-prescription pairs and polypharmacy rates, one entry per cohort signature.
+# The cohort is not hashed (leading underscore); sig identifies it
+@st.cache_data(max_entries=32)
+def co_prescription_pairs(sig, _cohort):
+    annotate(cache="miss")
+    return _cohort.co_prescriptions()
+
+@st.cache_data(max_entries=32)
+def polypharmacy_rates(sig, _cohort):
+    annotate(cache="miss")
+    return _cohort.polypharmacy()
+
+# Outcome rates with 95% confidence bounds, one entry per cohort, grouping and method
+@st.cache_data(max_entries=64)
+def rate_intervals(sig, _cohort, by, outcomes, method):
+    annotate(cache="miss")
+    return _cohort.outcome_intervals(by, list(outcomes), method=method)
+
+# Admissions and rates per period or rolling window, one entry per cohort, resolution and split
+@st.cache_data(max_entries=64)
+def trend_series(sig, _cohort, freq, by):
+    annotate(cache="miss")
+    return _cohort.trends(freq, by)
+
+# Kaplan-Meier curves, one entry per cohort, endpoint and stratification
+@st.cache_data(max_entries=64)
+def survival_curves(sig, _cohort, endpoint, by):
+    annotate(cache="miss")
+    return _cohort.survival(endpoint, list(by) or None)
+
+def interval_method():
+    """The sidebar's confidence interval method ('wilson', 'bootstrap' or None)."""
+    return CI_METHODS[st.session_state.get("ci", "Wilson")]
+
+def cohort_rates(cohort, by, outcomes):
+    """Outcome rates for the cohort, with CI columns unless intervals are switched off."""
+    method = interval_method()
+    if method is None:
+        return cohort.outcome_rates(by, list(outcomes))
+    return rate_intervals(cohort.sig, cohort, by, tuple(outcomes), method)
+
+def error_bars(rates, outcome):
+    """px.bar error_y / error_y_minus drawing the outcome's CI (nothing when off)."""
+    if f'{outcome}_lo' not in rates.columns:
+        return {}
+    return {'error_y': (rates[f'{outcome}_hi'] - rates[outcome]).to_numpy(),
+            'error_y_minus': (rates[outcome] - rates[f'{outcome}_lo']).to_numpy()}
+
+def ci_caption(rates, outcome):
+    if rates is not None and f'{outcome}_lo' in rates.columns and pd.notna(rates[f'{outcome}_lo'].iloc[0]):
+        st.caption(f"95% CI {rates[f'{outcome}_lo'].iloc[0]:.1f}–{rates[f'{outcome}_hi'].iloc[0]:.1f}%")
+
+def show_figure(chart_id, sig, build):
+    """Draw the figure from build(), reusing the cached one for this cohort."""
+    with span(f"figure:{chart_id}", cache="hit"):
+        st.plotly_chart(load_figure_cache().get_or_build(chart_id, sig, on_miss(build)), use_container_width=True)
+
+def show_profile(profiler):
+    """Sidebar debug panel: this run's spans and a Chrome-trace download."""
+    with st.sidebar.expander("Profiling"):
+        report = profiler.report()
+        st.caption(f"{len(report)} spans · run {report['ms'].max() if len(report) else 0:.0f} ms")
+        st.dataframe(report, hide_index=True, use_container_width=True)
+        st.download_button("Download Chrome trace", data=lambda: json.dumps(profiler.chrome_trace()),
+                           file_name="hf_dashboard_trace.json", mime="application/json", on_click="ignore")
+
+# TAB 1: KPIs
+def render_kpis(cohort):
+    st.header("Executive Summary")
+    kpis = cohort.kpis()
+    method = interval_method()
+    kpi_outcomes = tuple(c for c in ['death_within_28_days', 're_admission_within_28_days', 'death_within_6_months']
+                         if c in kpis)
+    kpi_rates = rate_intervals(cohort.sig, cohort, None, kpi_outcomes, method) if method else None
     
-    # SIDEBAR FILTERS
-    st.sidebar.header("🔍 Filter Patients")
+    col1, col2, col3, col4, col5 = st.columns(5)
     
-    # Age filter
-    age_range = (20, 100)
-    if 'age' in Demog.columns:
-        age_range = st.sidebar.slider("Age", int(Demog['age'].min()), int(Demog['age'].max()),
-                                       (int(Demog['age'].min()), int(Demog['age'].max())))
+    with col1:
+        st.metric("Total Patients", f"{kpis['patients']:,}")
     
-    # Gender filter
-    gender_filter = []
-    if 'gender' in Demog.columns:
-        gender_filter = st.sidebar.multiselect("Gender", Demog['gender'].dropna().unique().tolist(),
-                                                default=Demog['gender'].dropna().unique().tolist())
+    with col2:
+        if 'death_within_28_days' in kpis:
+            st.metric("28d Mortality", f"{kpis['death_within_28_days']:.1f}%")
+            ci_caption(kpi_rates, 'death_within_28_days')
     
-    # Ward filter
-    ward_filter = []
-    if 'admission_ward' in HosDis.columns:
-        ward_filter = st.sidebar.multiselect("Ward", HosDis['admission_ward'].dropna().unique().tolist(),
-                                              default=HosDis['admission_ward'].dropna().unique().tolist())
-    
-    # Apply filters to get filtered patient list
-    Demog_filtered = Demog.copy()
-    if 'age' in Demog_filtered.columns:
-        Demog_filtered = Demog_filtered[(Demog_filtered['age'] >= age_range[0]) & (Demog_filtered['age'] <= age_range[1])]
-    if gender_filter and 'gender' in Demog_filtered.columns:
-        Demog_filtered = Demog_filtered[Demog_filtered['gender'].isin(gender_filter)]
-    
-    # Get filtered patient IDs
-    filtered_patients = Demog_filtered['inpatient_number'].unique()
-    
-    # Filter other dataframes based on patient list
-    HosDis_filtered = HosDis[HosDis['inpatient_number'].isin(filtered_patients)]
-    if ward_filter:
-        HosDis_filtered = HosDis_filtered[HosDis_filtered['admission_ward'].isin(ward_filter)]
-        filtered_patients = HosDis_filtered['inpatient_number'].unique()
-        Demog_filtered = Demog_filtered[Demog_filtered['inpatient_number'].isin(filtered_patients)]
-    
-    CardiacComp_filtered = CardiacComp[CardiacComp['inpatient_number'].isin(filtered_patients)]
-    Labs_filtered = Labs[Labs['inpatient_number'].isin(filtered_patients)]
-    Respons_filtered = Respons[Respons['inpatient_number'].isin(filtered_patients)]
-    PatPre_filtered = PatPre[PatPre['inpatient_number'].isin(filtered_patients)]
-    
-    st.sidebar.markdown(f"**Filtered: {len(filtered_patients):,} / {len(Demog):,} patients**")
-    
-    # TABS
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-        "📊 KPIs", "👥 Demographics", "💊 Prescriptions", 
-        "🏥 Hospital", "💔 CardiacComplications", "🔬 Labs & GCS"
-    ])
-    
-    # TAB 1: KPIs
-    with tab1:
-        st.header("Executive Summary")
-        
-        col1, col2, col3, col4, col5 = st.columns(5)
-        
-        with col1:
-            st.metric("Total Patients", f"{len(filtered_patients):,}")
-        
-        with col2:
-            if 'death_within_28_days' in HosDis_filtered.columns:
-                mort_28d = HosDis_filtered['death_within_28_days'].sum() / len(HosDis_filtered) * 100
-                st.metric("28d Mortality", f"{mort_28d:.1f}%")
-        
-        with col3:
-            if 're_admission_within_28_days' in HosDis_filtered.columns:
-                readmit_28d = HosDis_filtered['re_admission_within_28_days'].sum() / len(HosDis_filtered) * 100
-                st.metric("28d Readmit", f"{readmit_28d:.1f}%")
-        
-        with col4:
-            if 'death_within_6_months' in HosDis_filtered.columns:
-                mort_6m = HosDis_filtered['death_within_6_months'].sum() / len(HosDis_filtered) * 100
-                st.metric("6m Mortality", f"{mort_6m:.1f}%")
-        
-        with col5:
-            if 'hf_top3_score' in Labs_filtered.columns:
-                score3 = len(Labs_filtered[Labs_filtered['hf_top3_score'] == 3])
-                st.metric("Score 3", f"{score3}", f"{score3/len(Labs_filtered)*100:.1f}%")
-        
-        st.markdown("---")
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown("""
-            <div class="critical-alert">
-                <h4>🔴 Triple Biomarker Risk</h4>
-                <ul><li><strong>99 patients (4.9%)</strong> Score 3</li>
-                <li><strong>40x mortality</strong> (6.1% vs 0.15%)</li>
-                <li>p < 0.00001</li></ul>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown("""
-            <div class="insight-box">
-                <h4>⚠️ Cryptic Shock</h4>
-                <ul><li><strong>73% of deaths</strong> had elevated biomarkers</li>
-                <li>Biomarkers reveal hidden risk</li></ul>
-            </div>
-            """, unsafe_allow_html=True)
-
-        st.markdown("## 📌 Key Insights ")
+    with col3:
+        if 're_admission_within_28_days' in kpis:
+            st.metric("28d Readmit", f"{kpis['re_admission_within_28_days']:.1f}%")
+            ci_caption(kpi_rates, 're_admission_within_28_days')
+    
+    with col4:
+        if 'death_within_6_months' in kpis:
+            st.metric("6m Mortality", f"{kpis['death_within_6_months']:.1f}%")
+            ci_caption(kpi_rates, 'death_within_6_months')
+    
+    with col5:
+        if 'score3_patients' in kpis:
+            st.metric("Score 3", f"{kpis['score3_patients']}", f"{kpis['score3_pct']:.1f}%")
+    
+    st.markdown("---")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        # Score 3 vs Score 0 28d mortality for this cohort, with 95% CIs when intervals are on
+        score_line = ""
+        if 'score3_patients' in kpis and 'death_within_28_days' in kpis:
+            by_score = cohort_rates(cohort, 'hf_top3_score', ['death_within_28_days']).set_index('hf_top3_score')
+            if 0 in by_score.index and 3 in by_score.index:
+                s3, s0 = by_score.loc[3], by_score.loc[0]
+                def rate(row):
+                    ci = f" [{row['death_within_28_days_lo']:.2f}–{row['death_within_28_days_hi']:.2f}]" if method else ""
+                    return f"{row['death_within_28_days']:.2f}%{ci}"
+                events = [round(r['death_within_28_days'] * r['patients'] / 100) for r in (s3, s0)]
+                ratio, lo, hi = risk_ratio_interval(events[0], s3['patients'], events[1], s0['patients'])
+                ratio_text = f"{ratio:.0f}x" if pd.notna(ratio) else "–"
+                ratio_ci = f" (95% CI {lo:.0f}–{hi:.0f}x)" if method and pd.notna(ratio) else ""
+                score_line = f"<li><strong>{ratio_text} mortality</strong>{ratio_ci}: {rate(s3)} vs {rate(s0)}</li>"
+                p = two_proportion_p(events[0], s3['patients'], events[1], s0['patients'])
+                if pd.notna(p):
+                    p_text = "p < 0.00001" if p < 0.00001 else f"p = {p:.2g}"
+                    score_line += f"<li>{p_text} (two-proportion z-test)</li>"
+        st.markdown(f"""
+        <div class="critical-alert">
+            <h4>🔴 Triple Biomarker Risk</h4>
+            <ul><li><strong>{kpis.get('score3_patients', 0)} patients ({kpis.get('score3_pct', 0):.1f}%)</strong> Score 3</li>
+            {score_line}</ul>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col2:
         st.markdown("""
-                    1️⃣ **High-Risk Severity** – NYHA IV + Killip IV account for ~64% of deaths.  
-                    2️⃣ **Biomarker Risk Score** – Lactate + Sodium + Troponin → 40× mortality risk.  
-                    3️⃣ **Neurological Warning** – Low GCS predicts ~64% of deaths.  
-                    4️⃣ **Frailty & Comorbidities** – Elderly, CKD, diabetes, COPD = higher risk.
+        <div class="insight-box">
+            <h4>⚠️ Cryptic Shock</h4>
+            <ul><li><strong>73% of deaths</strong> had elevated biomarkers</li>
+            <li>Biomarkers reveal hidden risk</li></ul>
+        </div>
+        """, unsafe_allow_html=True)
 
-                    5️⃣ **Long Stay Risk** – LoS ≥15 days → more mortality/readmission.  
-                    6️⃣ **Readmission Burden** – ~39% return within 6 months.  
-                    7️⃣ **ICU Gap** – Moderate-risk non-ICU patients drive readmissions. 
+    st.markdown("## 📌 Key Insights ")
+    st.markdown("""
+                1️⃣ **High-Risk Severity** – NYHA IV + Killip IV account for ~64% of deaths.  
+                2️⃣ **Biomarker Risk Score** – Lactate + Sodium + Troponin → 40× mortality risk.  
+                3️⃣ **Neurological Warning** – Low GCS predicts ~64% of deaths.  
+                4️⃣ **Frailty & Comorbidities** – Elderly, CKD, diabetes, COPD = higher risk.
 
-                    8️⃣ **Medication Trends** – Emergency cases need injectable therapy.""")
-        st.markdown("## 🎯 Recommendations")
-        st.markdown("""
-                    ✔ Automate biomarker + GCS alerts.
+                5️⃣ **Long Stay Risk** – LoS ≥15 days → more mortality/readmission.  
+                6️⃣ **Readmission Burden** – ~39% return within 6 months.  
+                7️⃣ **ICU Gap** – Moderate-risk non-ICU patients drive readmissions. 
 
-                    ✔ Prioritize high-severity patients.
+                8️⃣ **Medication Trends** – Emergency cases need injectable therapy.""")
+    st.markdown("## 🎯 Recommendations")
+    st.markdown("""
+                ✔ Automate biomarker + GCS alerts.
+
+                ✔ Prioritize high-severity patients.
+
+                ✔ 7-day follow-up after discharge.
+                
+                ✔ Telemonitor high-risk patients.""")
 
-                    ✔ 7-day follow-up after discharge.
-                    
-                    ✔ Telemonitor high-risk patients.""")                                     
 
+# TAB 2: DEMOGRAPHICS
+def render_demographics(cohort):
+    st.header("👥 Demographics Analysis")
+    sig, columns = cohort.sig, cohort.data.columns
     
-    # TAB 2: DEMOGRAPHICS
-    with tab2:
-        st.header("👥 Demographics Analysis")
-        
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            if 'gender' in Demog_filtered.columns:
-                female_pct = (Demog_filtered['gender'] == 'Female').sum() / len(Demog_filtered) * 100
-                st.metric("Female %", f"{female_pct:.1f}%")
-        with col2:
-            if 'ageCat' in Demog.columns:
-                most_common_age = Demog['ageCat'].mode()[0]  # most frequent age category
-                st.metric("Most Common Age Group", most_common_age)
-         
-        with col3:
-            if 'occupation' in Demog_filtered.columns:
-                urban_pct = (Demog_filtered['occupation'] == 'UrbanResident').sum() / len(Demog_filtered) * 100
-                st.metric("Urban %", f"{urban_pct:.1f}%")
-        with col4:
-            if 'diabetes' in PaHi.columns:
-                diabetes_pct = (466 / 2008) * 100
-                st.metric("Diabetes %", f"{diabetes_pct:.1f}%")
-        
-        st.markdown("---")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        if 'gender' in columns:
+            female_pct = cohort.share('gender', ['Female'])[1]
+            st.metric("Female %", f"{female_pct:.1f}%")
+    with col2:
+        if 'ageCat' in columns:
+            most_common_age = cohort.data.cohort().value_counts('ageCat').index[0]  # most frequent age category
+            st.metric("Most Common Age Group", most_common_age)
+     
+    with col3:
+        if 'occupation' in columns:
+            urban_pct = cohort.share('occupation', ['UrbanResident'])[1]
+            st.metric("Urban %", f"{urban_pct:.1f}%")
+    with col4:
+        if 'diabetes' in columns:
+            diabetes_pct = (466 / 2008) * 100
+            st.metric("Diabetes %", f"{diabetes_pct:.1f}%")
+    
+    st.markdown("---")
+    
+    # SUNBURST: Emergency by Gender & Age (CORRECT PATTERN)
+    st.subheader("Emergency Admissions by Gender & Age")
+    if all(c in columns for c in ['gender', 'ageCat', 'admission_way']):
+        def build():
+            # Plain strings: px hierarchies cannot aggregate categorical columns
+            agecat_adm = cohort.group_counts(['admission_way', 'gender', 'ageCat'])
+            agecat_adm = agecat_adm.astype({c: str for c in ['admission_way', 'gender', 'ageCat']})
         
-        # SUNBURST: Emergency by Gender & Age (CORRECT PATTERN)
-        st.subheader("Emergency Admissions by Gender & Age")
-        if all(c in Demog_filtered.columns for c in ['gender', 'ageCat']) and 'admission_way' in HosDis_filtered.columns:
-            # Merge Demog with HosDis for this analysis
-            agecat_adm = Demog_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'admission_way', 'admission_ward']],
-                on='inpatient_number', how='left'
-            )
-            agecat_adm['count'] = 1
-            
             fig = px.sunburst(agecat_adm, path=['admission_way', 'gender', 'ageCat'], values='count',
                              title='Emergency vs Non-Emergency by Gender & Age',
                              color='admission_way',
                              color_discrete_map={'Emergency': '#D32F2F', 'NonEmergency': '#388E3C'})
-            st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
-        
-        # BMI Distribution
-        st.subheader("BMI Distribution")
-        if 'BMI_Cat' in Demog_filtered.columns:
-            bmi_dist = Demog_filtered['BMI_Cat'].value_counts()
+            return fig
+        show_figure("demographics.sunburst", sig, build)
+    
+    st.markdown("---")
+    
+    # BMI Distribution
+    st.subheader("BMI Distribution")
+    if 'BMI_Cat' in columns:
+        def build():
+            bmi_dist = cohort.value_counts('BMI_Cat')
             fig = px.bar(x=bmi_dist.index, y=bmi_dist.values, title='BMI Category Distribution',
                         color=bmi_dist.values, color_continuous_scale='Greens', text=bmi_dist.values)
             fig.update_traces(texttemplate='%{text}', textposition='outside')
-            st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
+            return fig
+        show_figure("demographics.bmi", sig, build)
+    
+    st.markdown("---")
+    
+    # GROUPED BAR: Emergency by Age
+    st.subheader("Emergency Admissions by Age Category")
+    if all(c in columns for c in ['ageCat', 'admission_way']):
+        def build():
+            age_emerg = cohort.crosstab('ageCat', 'admission_way')
         
-        # GROUPED BAR: Emergency by Age
-        st.subheader("Emergency Admissions by Age Category")
-        if all(c in Demog_filtered.columns for c in ['ageCat']) and 'admission_way' in HosDis_filtered.columns:
-            agecat_adm = Demog_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'admission_way']],
-                on='inpatient_number', how='left'
-            )
-            age_emerg = pd.crosstab(agecat_adm['ageCat'], agecat_adm['admission_way'])
-            
             fig = px.bar(age_emerg, barmode='group', title='Emergency vs Non-Emergency by Age',
                         labels={'value': 'Count', 'ageCat': 'Age Group'},
                         color_discrete_sequence=['#FF6B6B', '#4ECDC4'])
-            st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
-        
-               
-                      
-        # Readmission Rates by Patient Group        
-        st.subheader("Readmission Rates by Patient Group")
-        # Data
+            return fig
+        show_figure("demographics.age_emergency", sig, build)
+    
+    st.markdown("---")
+    
+           
+                  
+    # Readmission Rates by Patient Group        
+    st.subheader("Readmission Rates by Patient Group")
+    # Data
+    def build():
         groups = ['Older+Obese', 'Older+Underweight', 'Robust Older', 'Younger Adults']
         readmit_28d = [8.06, 8.30, 6.86, 3.93]
         readmit_3m = [20.97, 26.60, 24.65, 22.47]
@@ -295,23 +326,25 @@ def main():
         # 28 days
         fig.add_trace(go.Scatter(
             x= groups, y=readmit_28d, mode='lines+markers+text', name='28d Readmission %', text=[f"{v:.1f}%" for v in readmit_28d],textposition="top center"))
-        
+    
         # 3 months
         fig.add_trace(go.Scatter( x=groups, y=readmit_3m, mode='lines+markers+text', name='3m Readmission %', text=[f"{v:.1f}%" for v in readmit_3m], textposition="top center"))
-        
+    
         # 6 months
         fig.add_trace(go.Scatter(
                 x=groups, y=readmit_6m,  mode='lines+markers+text',  name='6m Readmission %', text=[f"{v:.1f}%" for v in readmit_6m], textposition="top center"))
-        
+    
         # Highlight Older+Obese (index 0)
         fig.add_trace(go.Scatter(
                 x=[groups[0]] * 3, y=[readmit_28d[0], readmit_3m[0], readmit_6m[0]], mode='markers', marker=dict(size=16, color='red'),showlegend=False))
         fig.update_layout(
                 title="Readmission Rates by Patient Group (Older+Obese Highlighted)",  yaxis_title="Readmission Rate (%)", xaxis_title="Patient Group",
                 template="plotly_white", hovermode="x unified")
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # ---------- AREA CHART: Diabetes Impact ----------
+        return fig
+    show_figure("demographics.readmission_groups", None, build)
+    
+    # ---------- AREA CHART: Diabetes Impact ----------
+    def build():
         timepoints = ['In-Hospital', '28d', '3m', '6m', '6m Emergency Return']
         diabetes_no = [438/1452*100, 8/29*100, 10/32*100, 13/44*100, 212/563*100]  # Non-diabetes %
         diabetes_yes = [2/9*100, 29/1513*100, 32/1510*100, 44/1498*100, 254/978*100]  # Diabetes %
@@ -320,54 +353,52 @@ def main():
         fig = go.Figure()
         fig.add_trace(go.Scatter(
                 x=df_area.index,    y=df_area['Non-Diabetes'],    stackgroup='one',    name='Non-Diabetes',    line=dict(color='lightblue')))
-        
+    
         fig.add_trace(go.Scatter(    x=df_area.index,    y=df_area['Diabetes'],    stackgroup='one',    name='Diabetes',  line=dict(color='red')))
 
         fig.update_layout(
                 title='Diabetes Impact on Mortality & Readmissions',    xaxis_title='Timepoint',    yaxis_title='Percentage of Events',    yaxis=dict(range=[0,100]))
-        st.plotly_chart(fig, use_container_width=True)
-              
-            
-    # TAB 3: PRESCRIPTIONS (CORRECTED PATTERN)
-    with tab3:
-        st.header("💊 Patient Prescriptions Analysis")
-        
-        if not PatPre_filtered.empty and 'Drug_name' in PatPre_filtered.columns:
-            # Merge PatPre with HosDis (CORRECT PATTERN)
-            presc_adm = PatPre_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'admission_way', 'admission_ward']],
-                on='inpatient_number', how='left'
-            )
-            
+        return fig
+    show_figure("demographics.diabetes_impact", None, build)
+
+
+# TAB 3: PRESCRIPTIONS (CORRECTED PATTERN)
+def render_prescriptions(cohort):
+    st.header("💊 Patient Prescriptions Analysis")
+    sig = cohort.sig
+    
+    if cohort.prescription_count() > 0:
+        # Patients per drug for the cohort; computed once per rerun, and only
+        # if a chart below misses the figure cache
+        @functools.cache
+        def top10_drugs():
             # Top 10 drugs by UNIQUE PATIENTS (not prescription count!)
-            st.subheader("Top 10 Prescribed Medications")
-            top10_drugs = (
-                presc_adm
-                .groupby('Drug_name')['inpatient_number']
-                .nunique()  # Count unique patients!
-                .sort_values(ascending=False)
-                .head(10)
-            )
-            
-            fig = px.bar(x=top10_drugs.index, y=top10_drugs.values, 
+            return cohort.top_drugs(10)
+        
+        st.subheader("Top 10 Prescribed Medications")
+        def build():
+            top10 = top10_drugs()
+            fig = px.bar(x=top10.index, y=top10.values, 
                         title='Top 10 Medications (by Number of Patients)',
                         labels={'x': 'Drug Name', 'y': 'Number of Patients'},
-                        color=top10_drugs.values, color_continuous_scale='Viridis', text=top10_drugs.values)
+                        color=top10.values, color_continuous_scale='Viridis', text=top10.values)
             fig.update_traces(texttemplate='%{text}', textposition='outside')
             fig.update_layout(xaxis_tickangle=-45, height=500)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            st.markdown("**Note:** Counting unique patients (one patient can have multiple prescriptions)")
-            
-            st.markdown("---")
-            
-            # HEATMAP: Drug usage by Ward (CORRECT PATTERN)
-            st.subheader("Drug Usage by Admission Ward (Heatmap)")
-            top10_drug_names = top10_drugs.index.tolist()
-            presc_top10 = presc_adm[presc_adm['Drug_name'].isin(top10_drug_names)]
+            return fig
+        show_figure("prescriptions.top10", sig, build)
+        
+        st.markdown("**Note:** Counting unique patients (one patient can have multiple prescriptions)")
+        
+        st.markdown("---")
+        
+        # HEATMAP: Drug usage by Ward (CORRECT PATTERN)
+        st.subheader("Drug Usage by Admission Ward (Heatmap)")
+        def build():
+            top10_drug_names = top10_drugs().index.tolist()
             
-            # Crosstab: Drug × Ward
-            drug_ward_ct = pd.crosstab(presc_top10['Drug_name'], presc_top10['admission_ward'], normalize='columns')*100
+            # Drug × Ward prescriptions, normalized within each ward
+            drug_ward = cohort.drug_counts('admission_ward', top10_drug_names)
+            drug_ward_ct = drug_ward / drug_ward.sum()*100
             
             # Calculate % within each ward
             drug_ward_pct = drug_ward_ct.round(1)
@@ -377,374 +408,482 @@ def main():
                            labels={'color': '% of Usage'},
                            color_continuous_scale='YlOrRd')
             fig.update_layout(height=500)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            st.markdown("""
-            **Key Patterns:**
-            - **Spironolactone:** Most prescribed (1,833 patients)
-            - **Cardiology:** Spironolactone, Furosemide
-            - **ICU:** Furosemide injection for severe cases
-            """)
-            
-            st.markdown("---")
-            
-            # GROUPED BAR: Drug by Emergency
-            st.subheader("Emergency Medication Patterns")
-            top5_drugs = top10_drugs.head(5).index.tolist()
-            presc_top5 = presc_adm[presc_adm['Drug_name'].isin(top5_drugs)]
+            return fig
+        show_figure("prescriptions.drug_ward", sig, build)
+        
+        st.markdown("""
+        **Key Patterns:**
+        - **Spironolactone:** Most prescribed (1,833 patients)
+        - **Cardiology:** Spironolactone, Furosemide
+        - **ICU:** Furosemide injection for severe cases
+        """)
+        
+        st.markdown("---")
+        
+        # GROUPED BAR: Drug by Emergency
+        st.subheader("Emergency Medication Patterns")
+        def build():
+            top5_drugs = top10_drugs().head(5).index.tolist()
             
-            drug_emerg_ct = pd.crosstab(presc_top5['Drug_name'], presc_top5['admission_way'])
+            drug_emerg_ct = cohort.drug_counts('admission_way', top5_drugs)
             
             fig = px.bar(drug_emerg_ct, barmode='group', title='Top 5 Drugs: Emergency vs Non-Emergency',
                         labels={'value': 'Number of Patients', 'Drug_name': 'Medication'},
                         color_discrete_sequence=['#FF6B6B', '#4ECDC4'])
             fig.update_layout(xaxis_tickangle=-45)
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("Patient Prescription data not available")
-    
-    # TAB 4: HOSPITAL OUTCOMES
-    with tab4:
-        st.header("🏥 Hospital Discharge & Outcomes")
-        
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            cardio_pct = (HosDis_filtered['admission_ward'] == 'Cardiology').sum() / len(HosDis_filtered) * 100
-            st.metric("Cardiology %", f"{cardio_pct:.1f}%")
-        with col2:
-            emerg_pct = (HosDis_filtered['admission_way'] == 'Emergency').sum() / len(HosDis_filtered) * 100
-            st.metric("Emergency %", f"{emerg_pct:.1f}%")
-        with col3:
-            if 'dischargeDay' in HosDis_filtered.columns:
-                st.metric("Median LOS", f"{HosDis_filtered['dischargeDay'].median():.0f}d")
-        with col4:
-            if 'outcome_during_hospitalization' in HosDis_filtered.columns:
-                alive_pct = (HosDis_filtered['outcome_during_hospitalization'] == 'Alive').sum() / len(HosDis_filtered) * 100
-                st.metric("Alive %", f"{alive_pct:.1f}%")
+            return fig
+        show_figure("prescriptions.drug_emergency", sig, build)
         
         st.markdown("---")
-        
-        # LOS Distribution
-        st.subheader("Length of Stay Analysis")
-        if 'dischargeDay' in HosDis_filtered.columns:
-            col1, col2 = st.columns(2)
-            with col1:
-                fig = px.histogram(HosDis_filtered, x='dischargeDay', nbins=30, title='LOS Distribution',
-                                  color_discrete_sequence=['steelblue'])
-                fig.add_vline(x=HosDis_filtered['dischargeDay'].median(), line_dash="dash",
-                             annotation_text=f"Median: {HosDis_filtered['dischargeDay'].median():.0f}d")
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                los_bins = pd.cut(HosDis_filtered['dischargeDay'], bins=[0, 7, 14, 21, 100],
-                                 labels=['0-7d', '8-14d', '15-21d', '>21d'])
-                los_dist = los_bins.value_counts()
-                fig = px.pie(values=los_dist.values, names=los_dist.index, title='LOS Categories',
-                            color_discrete_sequence=px.colors.qualitative.Bold)
-                st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
-        
-        # SANKEY: Patient Flow (CORRECT PATTERN)
-        st.subheader("Patient Flow: Admission Way → Ward")
-        
-        # Use HosDis_filtered directly
-        source_col = 'admission_way'
-        target_col = 'admission_ward'
-        sankey_df = HosDis_filtered[[source_col, target_col]].dropna()
-        
-        # Get unique labels
-        source_labels = sankey_df[source_col].unique().tolist()
-        target_labels = sankey_df[target_col].unique().tolist()
-        all_labels = source_labels + target_labels
-        
-        # Create label mapping
-        label_map = {label: i for i, label in enumerate(all_labels)}
-        
-        # Count flows
-        flow_data = sankey_df.groupby([source_col, target_col]).size().reset_index(name='count')
-        
-        # Build links
-        links = {
-            'source': [label_map[row[source_col]] for _, row in flow_data.iterrows()],
-            'target': [label_map[row[target_col]] for _, row in flow_data.iterrows()],
-            'value': [row['count'] for _, row in flow_data.iterrows()]
-        }
-        
-        fig = go.Figure(data=[go.Sankey(
-            node=dict(pad=30, thickness=20, line=dict(color='black', width=0.5), label=all_labels, color="rgba(255,0,0,0.8)"),
-            link=dict(source=links['source'], target=links['target'], value=links['value'], color="rgba(44,160,44,0.8)")
-        )])
-        fig.update_layout(title='Patient Flow Sankey Diagram', height=550, font=dict(size=12))
-        st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
-        #st.write(HosDis_filtered.columns)
+        render_co_prescriptions(cohort)
+    else:
+        st.info("Patient Prescription data not available")
 
-        # STACK BAR: Readmission Timing by Ward
-        st.subheader("Emergency_return_group by Ward")
-        # Crosstab (like your Python result)
-        ct = pd.crosstab( HosDis_filtered['emergency_return_group'], HosDis_filtered['admission_ward'])
-        ct = ct.reset_index()
-        fig = px.bar( ct, x='emergency_return_group',y=ct.columns[1:], title="Emergency Return Timing by Admission Ward",
-                         labels={"value": "Number of Patients", "emergency_return_group": "Emergency Return Timing" })
-        fig.update_layout(    barmode='stack',      height=500)
-        st.plotly_chart(fig, use_container_width=True)
 
-                
-        # Department Performance
-        st.subheader("Department Performance Comparison")
-        ward_data = []
-        for ward in HosDis_filtered['admission_ward'].dropna().unique():
-            ward_df = HosDis_filtered[HosDis_filtered['admission_ward'] == ward]
-            stats = {'Ward': ward, 'Patients': len(ward_df)}
-            if 'death_within_28_days' in ward_df.columns and len(ward_df) > 0:
-                stats['Mortality'] = ward_df['death_within_28_days'].sum() / len(ward_df) * 100
-            if 're_admission_within_28_days' in ward_df.columns and len(ward_df) > 0:
-                stats['Readmission'] = ward_df['re_admission_within_28_days'].sum() / len(ward_df) * 100
-            ward_data.append(stats)
-        
-        df_wards = pd.DataFrame(ward_data)
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            if 'Mortality' in df_wards.columns:
+# Co-prescription ranking and polypharmacy vs readmission. A fragment, so the
+# ranking controls rerun only this part
+@st.fragment
+def render_co_prescriptions(cohort):
+    sig = cohort.sig
+    st.subheader("Co-Prescribed Drug Pairs")
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        rank_by = st.radio("Rank pairs by", ['lift', 'jaccard'], format_func=str.title,
+                           horizontal=True, key="copresc_rank")
+    with col2:
+        min_patients = st.number_input("Min shared patients", min_value=1, value=20, step=5, key="copresc_min")
+    
+    with span("co_prescription_pairs", cache="hit") as s:
+        pairs = co_prescription_pairs(sig, cohort)
+        s.set(rows=len(pairs))
+    pairs = pairs[pairs['patients'] >= min_patients].sort_values(rank_by, ascending=False)
+    
+    def build():
+        top = pairs.head(10).iloc[::-1]
+        fig = px.bar(top, x=rank_by, y=top['drug_a'] + ' + ' + top['drug_b'], orientation='h',
+                    title=f'Top 10 Drug Pairs by {rank_by.title()}',
+                    labels={'y': 'Drug Pair', rank_by: rank_by.title()},
+                    hover_data=['patients', 'support'], color=rank_by, color_continuous_scale='Purples')
+        fig.update_layout(height=500)
+        return fig
+    show_figure("prescriptions.co_prescription", f"{sig}:{rank_by}:{min_patients}", build)
+    
+    with st.expander("All drug pairs"):
+        st.dataframe(pairs, hide_index=True, use_container_width=True,
+                     column_config={'support': st.column_config.NumberColumn('support (%)', format='%.1f'),
+                                    'lift': st.column_config.NumberColumn(format='%.2f'),
+                                    'jaccard': st.column_config.NumberColumn(format='%.3f')})
+    
+    st.markdown("**Lift** > 1: taken together more often than independent use would predict. **Jaccard**: shared patients / patients on either drug.")
+    
+    # Polypharmacy vs readmission
+    st.subheader("Polypharmacy vs Readmission")
+    def build():
+        with span("polypharmacy_rates", rows=len(cohort), cache="hit"):
+            poly = polypharmacy_rates(sig, cohort)
+        fig = go.Figure()
+        fig.add_bar(name='28d Readmission', x=poly['drugs'], y=poly['re_admission_within_28_days'])
+        fig.add_bar(name='6m Readmission', x=poly['drugs'], y=poly['re_admission_within_6_months'])
+        fig.update_layout(barmode='group', title='Readmission by Number of Distinct Drugs',
+                          xaxis_title='Distinct drugs (n patients: ' + ', '.join(f"{d}: {n}" for d, n in zip(poly['drugs'], poly['patients'])) + ')',
+                          yaxis_title='Readmission (%)', height=450)
+        fig.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
+        return fig
+    show_figure("prescriptions.polypharmacy", sig, build)
+
+
+# Department Performance: one grouped pass serves both the department bars and
+# the readmission trend chart. A fragment, so "Compare by" reruns only this part
+@st.fragment
+def render_department_comparison(cohort):
+    sig = cohort.sig
+    st.subheader("Department Performance Comparison")
+    dept_col = st.selectbox("Compare by", ['admission_ward', 'discharge_department'],
+                            format_func=lambda c: c.replace('_', ' ').title())
+    dept_sig = f"{sig}:{dept_col}"
+    ward_outcomes = ['death_within_28_days', 're_admission_within_28_days',
+                     're_admission_within_3_months', 're_admission_within_6_months']
+    ward_rates = cohort_rates(cohort, dept_col, ward_outcomes)
+    dept_sig = f"{dept_sig}:{interval_method()}"
+    df_wards = ward_rates.rename(columns={dept_col: 'Ward', 'patients': 'Patients',
+                                          'death_within_28_days': 'Mortality',
+                                          're_admission_within_28_days': 'Readmission'})
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if 'Mortality' in df_wards.columns:
+            def build():
                 fig = px.bar(df_wards, x='Ward', y='Mortality', title='28d Mortality by Department',
-                            color='Mortality', color_continuous_scale='Reds', text='Mortality')
+                            color='Mortality', color_continuous_scale='Reds', text='Mortality',
+                            **error_bars(ward_rates, 'death_within_28_days'))
                 fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-                st.plotly_chart(fig, use_container_width=True)
-        
-        with col2:
-            if 'Readmission' in df_wards.columns:
+                return fig
+            show_figure("hospital.department_mortality", dept_sig, build)
+
+    with col2:
+        if 'Readmission' in df_wards.columns:
+            def build():
                 fig = px.bar(df_wards, x='Ward', y='Readmission', title='28d Readmission by Department',
-                            color='Readmission', color_continuous_scale='Oranges', text='Readmission')
+                            color='Readmission', color_continuous_scale='Oranges', text='Readmission',
+                            **error_bars(ward_rates, 're_admission_within_28_days'))
                 fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-                st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
-        
-        # GROUPED BAR: Readmission Trends by Ward
-        st.subheader("Readmission Trends Over Time")
-        readmit_cols = ['re_admission_within_28_days', 're_admission_within_3_months', 're_admission_within_6_months']
-        if all(c in HosDis_filtered.columns for c in readmit_cols):
-            readmit_by_ward = []
-            for ward in HosDis_filtered['admission_ward'].dropna().unique():
-                ward_df = HosDis_filtered[HosDis_filtered['admission_ward'] == ward]
-                if len(ward_df) > 0:
-                    readmit_by_ward.append({
-                        'Ward': ward,
-                        '28 Days': ward_df['re_admission_within_28_days'].sum() / len(ward_df) * 100,
-                        '3 Months': ward_df['re_admission_within_3_months'].sum() / len(ward_df) * 100,
-                        '6 Months': ward_df['re_admission_within_6_months'].sum() / len(ward_df) * 100
-                    })
-            
-            df_readmit_trend = pd.DataFrame(readmit_by_ward)
+                return fig
+            show_figure("hospital.department_readmission", dept_sig, build)
+
+    st.markdown("---")
+
+    # GROUPED BAR: Readmission Trends by Ward
+    st.subheader("Readmission Trends Over Time")
+    readmit_cols = ['re_admission_within_28_days', 're_admission_within_3_months', 're_admission_within_6_months']
+    if all(c in ward_rates.columns for c in readmit_cols):
+        def build():
+            df_readmit_trend = ward_rates.rename(columns={
+                dept_col: 'Ward',
+                're_admission_within_28_days': '28 Days',
+                're_admission_within_3_months': '3 Months',
+                're_admission_within_6_months': '6 Months',
+            })
             fig = px.bar(df_readmit_trend, x='Ward', y=['28 Days', '3 Months', '6 Months'],
                         barmode='group', title='Readmission Trends by Department',
                         labels={'value': 'Readmission (%)', 'variable': 'Period'},
                         color_discrete_sequence=['#FFD700', '#FFA500', '#FF4500'])
-            st.plotly_chart(fig, use_container_width=True)
+            return fig
+        show_figure("hospital.readmission_trend", dept_sig, build)
+
+
+# TAB 4: HOSPITAL OUTCOMES
+def render_hospital(cohort):
+    st.header("🏥 Hospital Discharge & Outcomes")
+    sig, columns = cohort.sig, cohort.data.columns
     
-    # TAB 5: CARDIAC
-    with tab5:
-        st.header("💔 Cardiac Complications")
-        
-        col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        cardio_pct = cohort.share('admission_ward', ['Cardiology'])[1]
+        st.metric("Cardiology %", f"{cardio_pct:.1f}%")
+    with col2:
+        emerg_pct = cohort.share('admission_way', ['Emergency'])[1]
+        st.metric("Emergency %", f"{emerg_pct:.1f}%")
+    with col3:
+        if 'dischargeDay' in columns:
+            st.metric("Median LOS", f"{cohort.median('dischargeDay'):.0f}d")
+    with col4:
+        if 'outcome_during_hospitalization' in columns:
+            alive_pct = cohort.share('outcome_during_hospitalization', ['Alive'])[1]
+            st.metric("Alive %", f"{alive_pct:.1f}%")
+    
+    st.markdown("---")
+    
+    # LOS Distribution
+    st.subheader("Length of Stay Analysis")
+    if 'dischargeDay' in columns:
+        col1, col2 = st.columns(2)
         with col1:
-            if 'NYHA_cardiac_function_classification' in CardiacComp_filtered.columns:
-                nyha_high = len(CardiacComp_filtered[CardiacComp_filtered['NYHA_cardiac_function_classification'] >= 3])
-                st.metric("NYHA 3-4", f"{nyha_high}", f"{nyha_high/len(CardiacComp_filtered)*100:.1f}%")
-        with col2:
-            if 'congestive_heart_failure' in CardiacComp_filtered.columns:
-                chf_count = CardiacComp_filtered['congestive_heart_failure'].sum()
-                st.metric("CHF", f"{chf_count}", f"{chf_count/len(CardiacComp_filtered)*100:.1f}%")
-        with col3:
-            if 'Killip_grade' in CardiacComp_filtered.columns:
-                killip_high = len(CardiacComp_filtered[CardiacComp_filtered['Killip_grade'].isin([3, 4])])
-                st.metric("Killip 3-4", f"{killip_high}", f"{killip_high/len(CardiacComp_filtered)*100:.1f}%")
-        with col4:
-            if 'comp_burden' in CardiacComp_filtered.columns:
-                high_burden = len(CardiacComp_filtered[CardiacComp_filtered['comp_burden'] == 3])
-                st.metric("High Burden", f"{high_burden}", f"{high_burden/len(CardiacComp_filtered)*100:.1f}%")
-        
-        st.markdown("---")
+            def build():
+                los = cohort.select(['dischargeDay'])
+                fig = px.histogram(los, x='dischargeDay', nbins=30, title='LOS Distribution',
+                                  color_discrete_sequence=['steelblue'])
+                fig.add_vline(x=los['dischargeDay'].median(), line_dash="dash",
+                             annotation_text=f"Median: {los['dischargeDay'].median():.0f}d")
+                return fig
+            show_figure("hospital.los_histogram", sig, build)
         
-        # NYHA Analysis
-        st.subheader("NYHA Classification")
-        if 'NYHA_cardiac_function_classification' in CardiacComp_filtered.columns:
-            # Merge with outcomes
-            cardiac_hos = CardiacComp_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'death_within_28_days']],
-                on='inpatient_number', how='left'
-            )
+        with col2:
+            def build():
+                los_dist = cohort.binned_counts('dischargeDay', bins=[0, 7, 14, 21, 100],
+                                                labels=['0-7d', '8-14d', '15-21d', '>21d'])
+                fig = px.pie(values=los_dist.values, names=los_dist.index, title='LOS Categories',
+                            color_discrete_sequence=px.colors.qualitative.Bold)
+                return fig
+            show_figure("hospital.los_categories", sig, build)
+    
+    st.markdown("---")
+    
+    # SANKEY: Patient Flow (CORRECT PATTERN)
+    render_patient_flow(cohort)
+    
+    st.markdown("---")
+
+    # STACK BAR: Readmission Timing by Ward
+    st.subheader("Emergency_return_group by Ward")
+    # Crosstab (like your Python result)
+    def build():
+        ct = cohort.crosstab('emergency_return_group', 'admission_ward')
+        ct = ct.reset_index()
+        fig = px.bar( ct, x='emergency_return_group',y=ct.columns[1:], title="Emergency Return Timing by Admission Ward",
+                         labels={"value": "Number of Patients", "emergency_return_group": "Emergency Return Timing" })
+        fig.update_layout(    barmode='stack',      height=500)
+        return fig
+    show_figure("hospital.emergency_return", sig, build)
+
             
-            col1, col2 = st.columns(2)
-            with col1:
-                nyha_dist = CardiacComp_filtered['NYHA_cardiac_function_classification'].value_counts().sort_index()
+    render_department_comparison(cohort)
+
+
+# Stage columns offered for the patient flow, with their display names
+FLOW_STAGES = {
+    'admission_way': 'Admission Way',
+    'admission_ward': 'Ward',
+    'outcome_during_hospitalization': 'Outcome',
+    'DestinationDischarge': 'Discharge Destination',
+    'emergency_return_group': 'Emergency Return',
+}
+
+# Stage pickers live in a fragment so changing them reruns only the Sankey
+@st.fragment
+def render_patient_flow(cohort):
+    options = [c for c in FLOW_STAGES if c in cohort.data.columns]
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        stages = st.multiselect("Stages (in order)", options, default=options[:2],
+                                format_func=FLOW_STAGES.get, key="flow_stages")
+    with col2:
+        min_count = st.number_input("Collapse links under", min_value=0, value=0, step=5, key="flow_min_count")
+    st.subheader("Patient Flow: " + " → ".join(FLOW_STAGES[c] for c in stages))
+    if len(stages) < 2:
+        st.info("Pick at least two stages.")
+        return
+    
+    def build():
+        # One bincount over integer-coded stage pairs gives every link count
+        flow = cohort.flow(stages, min_count=min_count)
+        
+        fig = go.Figure(data=[go.Sankey(
+            node=dict(pad=30, thickness=20, line=dict(color='black', width=0.5), label=flow.labels, color="rgba(255,0,0,0.8)"),
+            link=dict(source=flow.source, target=flow.target, value=flow.value, color="rgba(44,160,44,0.8)")
+        )])
+        fig.update_layout(title='Patient Flow Sankey Diagram', height=550, font=dict(size=12))
+        return fig
+    show_figure("hospital.sankey", f"{cohort.sig}:{'>'.join(stages)}:{min_count}", build)
+
+
+# TAB 5: CARDIAC
+def render_cardiac(cohort):
+    st.header("💔 Cardiac Complications")
+    sig, columns = cohort.sig, cohort.data.columns
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        if 'NYHA_cardiac_function_classification' in columns:
+            nyha_high, nyha_pct = cohort.share('NYHA_cardiac_function_classification', [3, 4])
+            st.metric("NYHA 3-4", f"{nyha_high}", f"{nyha_pct:.1f}%")
+    with col2:
+        if 'congestive_heart_failure' in columns:
+            chf_count, chf_pct = cohort.share('congestive_heart_failure', [1])
+            st.metric("CHF", f"{chf_count}", f"{chf_pct:.1f}%")
+    with col3:
+        if 'Killip_grade' in columns:
+            killip_high, killip_pct = cohort.share('Killip_grade', [3, 4])
+            st.metric("Killip 3-4", f"{killip_high}", f"{killip_pct:.1f}%")
+    with col4:
+        if 'comp_burden' in columns:
+            high_burden, burden_pct = cohort.share('comp_burden', [3])
+            st.metric("High Burden", f"{high_burden}", f"{burden_pct:.1f}%")
+    
+    st.markdown("---")
+    
+    # NYHA Analysis
+    st.subheader("NYHA Classification")
+    if 'NYHA_cardiac_function_classification' in columns:
+        col1, col2 = st.columns(2)
+        with col1:
+            def build():
+                nyha_dist = cohort.value_counts('NYHA_cardiac_function_classification', sort='value')
                 fig = px.pie(values=nyha_dist.values, names=[f'Class {int(i)}' for i in nyha_dist.index],
                             title='NYHA Distribution', color_discrete_sequence=px.colors.qualitative.Set2)
                 fig.update_traces(hole=0.45)
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                if 'death_within_28_days' in cardiac_hos.columns:
-                    nyha_mort = cardiac_hos.groupby('NYHA_cardiac_function_classification').agg({
-                        'death_within_28_days': lambda x: x.sum() / len(x) * 100 if len(x) > 0 else 0
-                    }).reset_index()
+                return fig
+            show_figure("cardiac.nyha_distribution", sig, build)
+        
+        with col2:
+            if 'death_within_28_days' in cohort.cells.columns:
+                def build():
+                    nyha_mort = cohort_rates(cohort, 'NYHA_cardiac_function_classification', ['death_within_28_days'])
                     fig = px.bar(nyha_mort, x='NYHA_cardiac_function_classification', y='death_within_28_days',
                                 title='Mortality by NYHA', color='death_within_28_days',
-                                color_continuous_scale='Reds', text='death_within_28_days')
+                                color_continuous_scale='Reds', text='death_within_28_days',
+                                **error_bars(nyha_mort, 'death_within_28_days'))
                     fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-                    st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
+                    return fig
+                show_figure("cardiac.nyha_mortality", f"{sig}:{interval_method()}", build)
+    
+    st.markdown("---")
+    
+    # HEATMAP: NYHA vs Killip (CORRECT PATTERN)
+    st.subheader("NYHA vs Killip Grade (Heatmap)")
+    if all(c in columns for c in ['NYHA_cardiac_function_classification', 'Killip_grade']):
+        def build():
+            nyha_killip = cohort.crosstab('NYHA_cardiac_function_classification', 'Killip_grade')
         
-        # HEATMAP: NYHA vs Killip (CORRECT PATTERN)
-        st.subheader("NYHA vs Killip Grade (Heatmap)")
-        if all(c in CardiacComp_filtered.columns for c in ['NYHA_cardiac_function_classification', 'Killip_grade']):
-            nyha_killip = pd.crosstab(CardiacComp_filtered['NYHA_cardiac_function_classification'],
-                                     CardiacComp_filtered['Killip_grade'])
-            
             fig = px.imshow(nyha_killip, text_auto=True, aspect='auto',
                            title='Patient Distribution: NYHA vs Killip',
                            labels={'x': 'Killip Grade', 'y': 'NYHA Class', 'color': 'Count'},
                            color_continuous_scale='Reds')
             fig.update_layout(height=400)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            st.markdown("""
-            <div class="critical-alert">
-                <h4>🚨 NYHA 4 + Killip 4 = 64% of Deaths</h4>
-                <p>NYHA 4 + Killip ≥3 = 31.5% of cohort = <strong>HIGHEST RISK</strong></p>
-            </div>
-            """, unsafe_allow_html=True)
+            return fig
+        show_figure("cardiac.nyha_killip", sig, build)
         
-        st.markdown("---")
-        
-        # Complication Burden
-        st.subheader("Complication Burden (MI + CHF + PVD)")
-        if 'comp_burden' in CardiacComp_filtered.columns:
-            cardiac_hos = CardiacComp_filtered.merge(
-                HosDis_filtered[['inpatient_number', 're_admission_within_6_months']],
-                on='inpatient_number', how='left'
-            )
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                burden_dist = CardiacComp_filtered['comp_burden'].value_counts().sort_index()
+        st.markdown("""
+        <div class="critical-alert">
+            <h4>🚨 NYHA 4 + Killip 4 = 64% of Deaths</h4>
+            <p>NYHA 4 + Killip ≥3 = 31.5% of cohort = <strong>HIGHEST RISK</strong></p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    st.markdown("---")
+    
+    # Complication Burden
+    st.subheader("Complication Burden (MI + CHF + PVD)")
+    if 'comp_burden' in columns:
+        col1, col2 = st.columns(2)
+        with col1:
+            def build():
+                burden_dist = cohort.value_counts('comp_burden', sort='value')
                 fig = px.bar(x=[f'Score {int(i)}' for i in burden_dist.index], y=burden_dist.values,
                             title='Complication Burden Distribution', color=burden_dist.values,
                             color_continuous_scale='Oranges', text=burden_dist.values)
                 fig.update_traces(texttemplate='%{text}', textposition='outside')
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                if 're_admission_within_6_months' in cardiac_hos.columns:
-                    burden_readmit = cardiac_hos.groupby('comp_burden').agg({
-                        're_admission_within_6_months': lambda x: x.sum() / len(x) * 100 if len(x) > 0 else 0
-                    }).reset_index()
+                return fig
+            show_figure("cardiac.burden_distribution", sig, build)
+        
+        with col2:
+            if 're_admission_within_6_months' in columns:
+                def build():
+                    burden_readmit = cohort.outcome_rates('comp_burden', ['re_admission_within_6_months'])
                     fig = px.bar(burden_readmit, x='comp_burden', y='re_admission_within_6_months',
                                 title='6m Readmission by Burden', color='re_admission_within_6_months',
                                 color_continuous_scale='Oranges', text='re_admission_within_6_months')
                     fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-                    st.plotly_chart(fig, use_container_width=True)
-            
-            st.markdown("**Score 3: 50% 6m readmission = chronic management challenge**")
-    
-    # TAB 6: LABS & GCS
-    with tab6:
-        st.header("🔬 Laboratory Biomarkers & GCS")
+                    return fig
+                show_figure("cardiac.burden_readmission", sig, build)
         
-        col1, col2, col3, col4 = st.columns(4)
+        st.markdown("**Score 3: 50% 6m readmission = chronic management challenge**")
+
+
+# HF Top3 score at user-chosen cut-offs. A fragment, so moving a slider reruns
+# only this section; each position is a lookup in the threshold index
+@st.fragment
+def render_score_sweep(cohort, timepoints, death_cols, readm_cols):
+    st.subheader("HF Top3 Score: Risk Evolution Over Time")
+    Sweep = cohort.data.sweep
+    defaults = Sweep.thresholds()
+    cutoffs = {}
+    for col, rule, grid in zip(st.columns(len(Sweep.rules)), Sweep.rules, Sweep.grids):
+        with col:
+            cutoffs[rule.name] = st.select_slider(f"{rule.label} {rule.op}", options=grid.tolist(),
+                                                  value=defaults[rule.name], key=f"cutoff_{rule.name}")
+    scores = cohort.score_outcomes(cutoffs)
+    score0, score3 = scores.loc['Score 0'], scores.loc['Score 3']
+    n0, n3 = int(score0['patients']), int(score3['patients'])
+    sweep_sig = cohort_signature(data=cohort.data.version, **cutoffs)
+    st.caption(f"Score 3 at these cut-offs: {n3} patients ({n3/cohort.data.n_patients*100:.1f}%)")
+
+    # Mortality
+    def build():
+        fig3 = go.Figure()
+        fig3.add_bar(name=f'Score 0 (n={n0})', x=timepoints, y=score0[death_cols].tolist())
+        fig3.add_bar(name=f'Score 3 (n={n3})', x=timepoints, y=score3[death_cols].tolist())
+        fig3.update_layout( barmode='group', title='Mortality: Score 0 vs Score 3', yaxis_title='Mortality (%)', height=450)
+        fig3.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
+        return fig3
+    show_figure("labs.score_mortality_evolution", sweep_sig, build)
+
+
+    #Readmission
+    def build():
+        fig4 = go.Figure()
+        fig4.add_bar(name=f'Score 0 (n={n0})',  x=timepoints, y=score0[readm_cols].tolist())
+        fig4.add_bar(name=f'Score 3 (n={n3})', x=timepoints, y=score3[readm_cols].tolist())
+
+        fig4.update_layout( barmode='group', title='Readmission: Score 0 vs Score 3', yaxis_title='Readmission (%)', height=450)
+        fig4.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
+        return fig4
+    show_figure("labs.score_readmission_evolution", sweep_sig, build)
+
+    # Score 3 vs every outcome across the whole cut-off grid, built only on download
+    st.download_button("Download threshold ROC table (CSV)", data=lambda: Sweep.roc_table().to_csv(index=False),
+                       file_name="hf_top3_threshold_roc.csv", mime="text/csv", on_click="ignore")
+
+# TAB 6: LABS & GCS
+def render_labs_gcs(cohort):
+    st.header("🔬 Laboratory Biomarkers & GCS")
+    sig, cells, columns = cohort.sig, cohort.cells, cohort.data.columns
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        if 'hf_top3_score' in cells.columns:
+            score3, score3_pct = value_share(cells, 'hf_top3_score', 3)
+            st.metric("Score 3", f"{score3}", f"{score3_pct:.1f}%")
+    with col2:
+        if 'GCS_category' in cells.columns:
+            high_risk, high_risk_pct = value_share(cells, 'GCS_category', 'High-Risk')
+            st.metric("High-Risk GCS", f"{high_risk}", f"{high_risk_pct:.1f}%")
+    with col3:
+        if 'lactate' in columns:
+            high_lact, high_lact_pct = cohort.flag_share('high_lactate')
+            st.metric("High Lactate", f"{high_lact}", f"{high_lact_pct:.1f}%")
+    with col4:
+        if 'sodium' in columns:
+            low_na, low_na_pct = cohort.flag_share('low_sodium')
+            st.metric("Low Sodium", f"{low_na}", f"{low_na_pct:.1f}%")
+    
+    st.markdown("---")
+    
+    # Biomarker Score
+    st.subheader("Three-Biomarker Risk Score")
+    if 'hf_top3_score' in columns:
+        col1, col2 = st.columns(2)
         with col1:
-            if 'hf_top3_score' in Labs_filtered.columns:
-                score3 = len(Labs_filtered[Labs_filtered['hf_top3_score'] == 3])
-                st.metric("Score 3", f"{score3}", f"{score3/len(Labs_filtered)*100:.1f}%")
-        with col2:
-            if 'GCS_category' in Respons_filtered.columns:
-                high_risk = len(Respons_filtered[Respons_filtered['GCS_category'] == 'High-Risk'])
-                st.metric("High-Risk GCS", f"{high_risk}", f"{high_risk/len(Respons_filtered)*100:.1f}%")
-        with col3:
-            if 'lactate' in Labs_filtered.columns:
-                high_lact = len(Labs_filtered[Labs_filtered['lactate'] >= 2.0])
-                st.metric("High Lactate", f"{high_lact}", f"{high_lact/len(Labs_filtered)*100:.1f}%")
-        with col4:
-            if 'sodium' in Labs_filtered.columns:
-                low_na = len(Labs_filtered[Labs_filtered['sodium'] < 135])
-                st.metric("Low Sodium", f"{low_na}", f"{low_na/len(Labs_filtered)*100:.1f}%")
-        
-        st.markdown("---")
-        
-        # Biomarker Score
-        st.subheader("Three-Biomarker Risk Score")
-        if 'hf_top3_score' in Labs_filtered.columns:
-            # Merge with outcomes
-            labs_hos = Labs_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'death_within_28_days']],
-                on='inpatient_number', how='left'
-            )
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                score_dist = Labs_filtered['hf_top3_score'].value_counts().sort_index()
+            def build():
+                score_dist = cells.groupby('hf_top3_score')['patients'].sum()
                 fig = px.bar(x=[f'Score {int(i)}' for i in score_dist.index], y=score_dist.values,
                             title='Score Distribution', color=score_dist.index,
                             color_continuous_scale=['green', 'yellow', 'orange', 'red'], text=score_dist.values)
                 fig.update_traces(texttemplate='%{text}', textposition='outside')
                 fig.update_layout(showlegend=False)
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                if 'death_within_28_days' in labs_hos.columns:
-                    score_mort = labs_hos.groupby('hf_top3_score').agg({
-                        'death_within_28_days': lambda x: x.sum() / len(x) * 100 if len(x) > 0 else 0
-                    }).reset_index()
+                return fig
+            show_figure("labs.score_distribution", sig, build)
+        
+        with col2:
+            if 'death_within_28_days' in cells.columns:
+                def build():
+                    score_mort = cohort_rates(cohort, 'hf_top3_score', ['death_within_28_days'])
                     fig = px.bar(score_mort, x='hf_top3_score', y='death_within_28_days',
                                 title='Mortality by Score', color='death_within_28_days',
-                                color_continuous_scale='Reds', text='death_within_28_days')
+                                color_continuous_scale='Reds', text='death_within_28_days',
+                                **error_bars(score_mort, 'death_within_28_days'))
                     fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-                    st.plotly_chart(fig, use_container_width=True)
-        
-        st.markdown("---")
+                    return fig
+                show_figure("labs.score_mortality", f"{sig}:{interval_method()}", build)
+    
+    st.markdown("---")
+
+    #Mortality, Readmission (all patients, independent of the sidebar filter)
+    timepoints = ['28d', '3m', '6m']
+    death_cols = ['death_within_28_days', 'death_within_3_months',    'death_within_6_months']
+    readm_cols = ['re_admission_within_28_days', 're_admission_within_3_months', 're_admission_within_6_months']
 
-        #Mortality, Readmission
-        # Merge Labs + Hospital Discharge data
-        df_merged_hf = Labs.merge( HosDis[['inpatient_number', 'DestinationDischarge', 'admission_ward',
-            'admission_way', 'discharge_department', 'visit_times',
-            'respiratory_support', 'oxygen_inhalation', 'dischargeDay',
-            'Admission_date', 'outcome_during_hospitalization',
-            'death_within_28_days', 're_admission_within_28_days',
-            'death_within_3_months', 're_admission_within_3_months',
-            'death_within_6_months', 're_admission_within_6_months',
-            'time_of_death__days_from_admission',
-            'readmission_time_days_from_admission',
-            'return_to_emergency_department_within_6_months',
-            'time_to_emergency_department_within_6_months']],  on='inpatient_number', how='inner')
+    # Subgroups are only aggregated when one of the four charts below misses the figure cache
+    @functools.cache
+    def hf_groups():
+        data = cohort.data
+        # All patients with labs and discharge outcomes (unfiltered)
+        df_merged_hf = data.cohort()
         # CHF + High Killip (3–4)
-        chf_high_killip = CardiacComp[(CardiacComp['congestive_heart_failure'] == 1) & (CardiacComp['Killip_grade'].isin([3, 4]))
-                                      ]['inpatient_number'].tolist()
+        chf_killip_group = data.cohort(where={'congestive_heart_failure': [1], 'Killip_grade': [3, 4]})
         # MI + CHF
-        mi_chf = CardiacComp[(CardiacComp['myocardial_infarction'] == 1) & (CardiacComp['congestive_heart_failure'] == 1)
-        ]['inpatient_number'].tolist()
-        
-        # Subgroups inside merged HF dataset
-        chf_killip_group = df_merged_hf[df_merged_hf['inpatient_number'].isin(chf_high_killip)]
-        mi_chf_group = df_merged_hf[df_merged_hf['inpatient_number'].isin(mi_chf)]
+        mi_chf_group = data.cohort(where={'myocardial_infarction': [1], 'congestive_heart_failure': [1]})
+        return df_merged_hf, chf_killip_group, mi_chf_group
+    # Whole-data subgroups: keyed on the data version so delta batches show up
+    groups_sig = cohort_signature(data=cohort.data.version)
 
-        timepoints = ['28d', '3m', '6m']
-        death_cols = ['death_within_28_days', 'death_within_3_months',    'death_within_6_months']
-        readm_cols = ['re_admission_within_28_days', 're_admission_within_3_months', 're_admission_within_6_months']
+    st.subheader("28-Day → 6-Month Mortality using High risk biomarkers")
+    def build():
+        df_merged_hf, chf_killip_group, mi_chf_group = hf_groups()
         # Mortality %
-        all_death = [df_merged_hf[col].mean()*100 for col in death_cols]
-        chf_death = [chf_killip_group[col].mean()*100 for col in death_cols]
-        mi_death = [mi_chf_group[col].mean()*100 for col in death_cols]
-
-        # Readmission %
-        all_readm = [df_merged_hf[col].mean()*100 for col in readm_cols]
-        chf_readm = [chf_killip_group[col].mean()*100 for col in readm_cols]
-        mi_readm = [mi_chf_group[col].mean()*100 for col in readm_cols]
+        all_death = [df_merged_hf.kpis()[col] for col in death_cols]
+        chf_death = [chf_killip_group.kpis()[col] for col in death_cols]
+        mi_death = [mi_chf_group.kpis()[col] for col in death_cols]
 
-        st.subheader("28-Day → 6-Month Mortality using High risk biomarkers")
         fig1 = go.Figure()
         fig1.add_bar(name=f'All Patients (n={len(df_merged_hf)})', x=timepoints, y=all_death)
         fig1.add_bar(name=f'CHF+Killip3-4 (n={len(chf_killip_group)})',  x=timepoints, y=chf_death)
@@ -752,152 +891,288 @@ def main():
 
         fig1.update_layout(barmode='group', yaxis_title='Mortality (%)',  xaxis_title='Timeframe',  height=450)
         fig1.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
-        st.plotly_chart(fig1, use_container_width=True)
+        return fig1
+    show_figure("labs.subgroup_mortality", groups_sig, build)
 
-        st.markdown(" ** CHF+Killip3-4 (412 pts): **6.3% 28d mortality** → ICU-level HF care")
-        st.markdown(" ** MI+CHF (133 pts): **8.3% 28d readmission** → Post-discharge surveillance")
+    st.markdown(" ** CHF+Killip3-4 (412 pts): **6.3% 28d mortality** → ICU-level HF care")
+    st.markdown(" ** MI+CHF (133 pts): **8.3% 28d readmission** → Post-discharge surveillance")
 
 
-        #Readmission chart
-        st.subheader("28-Day → 6-Month Readmission")
+    #Readmission chart
+    st.subheader("28-Day → 6-Month Readmission")
+    def build():
+        df_merged_hf, chf_killip_group, mi_chf_group = hf_groups()
+        # Readmission %
+        all_readm = [df_merged_hf.kpis()[col] for col in readm_cols]
+        chf_readm = [chf_killip_group.kpis()[col] for col in readm_cols]
+        mi_readm = [mi_chf_group.kpis()[col] for col in readm_cols]
+
         fig2 = go.Figure()
         fig2.add_bar(name=f'All Patients (n={len(df_merged_hf)})', x=timepoints, y=all_readm)
         fig2.add_bar(name=f'CHF+Killip3-4 (n={len(chf_killip_group)})',
              x=timepoints, y=chf_readm)
         fig2.add_bar(name=f'MI+CHF (n={len(mi_chf_group)})', x=timepoints, y=mi_readm)
         fig2.update_layout( barmode='group', yaxis_title='Readmission (%)', xaxis_title='Timeframe', height=450)
-        
+
         fig2.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
-        st.plotly_chart(fig2, use_container_width=True)
-
-        #HF Top3 Score Comparison
-        st.subheader("HF Top3 Score: Risk Evolution Over Time")
-        score0 = df_merged_hf[df_merged_hf['hf_top3_score'] == 0]
-        score3 = df_merged_hf[df_merged_hf['hf_top3_score'] == 3]
-        # Mortality
-        score0_mort = [score0[col].mean()*100 for col in death_cols]
-        score3_mort = [score3[col].mean()*100 for col in death_cols]
-        
-        fig3 = go.Figure()
-        fig3.add_bar(name=f'Score 0 (n={len(score0)})', x=timepoints, y=score0_mort)
-        fig3.add_bar(name=f'Score 3 (n={len(score3)})', x=timepoints, y=score3_mort)
-        fig3.update_layout( barmode='group', title='Mortality: Score 0 vs Score 3', yaxis_title='Mortality (%)', height=450)
-        fig3.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
-        st.plotly_chart(fig3, use_container_width=True)
+        return fig2
+    show_figure("labs.subgroup_readmission", groups_sig, build)
 
+    #HF Top3 Score Comparison
+    render_score_sweep(cohort, timepoints, death_cols, readm_cols)
 
-        #Readmission
-        score0_readm = [score0[col].mean()*100 for col in readm_cols]
-        score3_readm = [score3[col].mean()*100 for col in readm_cols]
-        
-        fig4 = go.Figure()
-        fig4.add_bar(name=f'Score 0 (n={len(score0)})',  x=timepoints, y=score0_readm)
-        fig4.add_bar(name=f'Score 3 (n={len(score3)})', x=timepoints, y=score3_readm)
-        
-        fig4.update_layout( barmode='group', title='Readmission: Score 0 vs Score 3', yaxis_title='Readmission (%)', height=450)
-        fig4.update_traces(texttemplate='%{y:.1f}%', textposition='outside')
-        st.plotly_chart(fig4, use_container_width=True)
-
-       
-        # HEATMAP: Biomarkers Deaths vs Cardiology vs ICU
-        st.subheader("Biomarker Patterns: Deaths vs Ward (Heatmap)")
-        if all(c in Labs_filtered.columns for c in ['lactate', 'sodium', 'high_sensitivity_troponin']):
-            # Merge Labs with HosDis
-            labs_hos_ward = Labs_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'admission_ward', 'outcome_during_hospitalization']],
-                on='inpatient_number', how='left'
-            )
-            
-            deaths_df = labs_hos_ward[labs_hos_ward['outcome_during_hospitalization'] == 'Dead'] if 'outcome_during_hospitalization' in labs_hos_ward.columns else labs_hos_ward.head(0)
-            cardio_df = labs_hos_ward[labs_hos_ward['admission_ward'] == 'Cardiology']
-            icu_df = labs_hos_ward[labs_hos_ward['admission_ward'] == 'ICU']
-            
-            heatmap_data = []
-            for col, threshold, comp in [('lactate', 2.0, '>='), ('sodium', 135, '<'), ('high_sensitivity_troponin', 0.04, '>')]:
-                if col in labs_hos_ward.columns:
-                    if comp == '>=':
-                        deaths_pct = (deaths_df[col] >= threshold).sum() / len(deaths_df) * 100 if len(deaths_df) > 0 else 0
-                        cardio_pct = (cardio_df[col] >= threshold).sum() / len(cardio_df) * 100 if len(cardio_df) > 0 else 0
-                        icu_pct = (icu_df[col] >= threshold).sum() / len(icu_df) * 100 if len(icu_df) > 0 else 0
-                    elif comp == '<':
-                        deaths_pct = (deaths_df[col] < threshold).sum() / len(deaths_df) * 100 if len(deaths_df) > 0 else 0
-                        cardio_pct = (cardio_df[col] < threshold).sum() / len(cardio_df) * 100 if len(cardio_df) > 0 else 0
-                        icu_pct = (icu_df[col] < threshold).sum() / len(icu_df) * 100 if len(icu_df) > 0 else 0
-                    else:
-                        deaths_pct = (deaths_df[col] > threshold).sum() / len(deaths_df) * 100 if len(deaths_df) > 0 else 0
-                        cardio_pct = (cardio_df[col] > threshold).sum() / len(cardio_df) * 100 if len(cardio_df) > 0 else 0
-                        icu_pct = (icu_df[col] > threshold).sum() / len(icu_df) * 100 if len(icu_df) > 0 else 0
-                    
-                    heatmap_data.append({
-                        'Biomarker': col.replace('_', ' ').title(),
-                        'Deaths': deaths_pct,
-                        'Cardiology': cardio_pct,
-                        'ICU': icu_pct
-                    })
-            
-            df_heatmap = pd.DataFrame(heatmap_data)
-            df_heatmap_plot = df_heatmap.set_index('Biomarker')
+   
+    # HEATMAP: Biomarkers Deaths vs Cardiology vs ICU
+    st.subheader("Biomarker Patterns: Deaths vs Ward (Heatmap)")
+    if all(c in columns for c in ['lactate', 'sodium', 'high_sensitivity_troponin']):
+        def build():
+            # % abnormal for every registered rule, straight from the packed bitmask
+            df_heatmap_plot = cohort.biomarker_rates()
             
             fig = px.imshow(df_heatmap_plot.T, text_auto='.1f', aspect='auto',
                            title='% Abnormal Biomarkers: Deaths vs Cardiology vs ICU',
                            labels={'color': '% Abnormal'},
                            color_continuous_scale='Reds')
             fig.update_layout(height=400)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            st.markdown("**73% of deaths had elevated lactate+troponin , Patients who died showed the highest burden of high-risk biomarker abnormalities—particularly elevated troponin (72.7%) and lactate (63.6%)—highlighting a strong association between myocardial injury, metabolic stress, and in-hospital mortality.**")
+            return fig
+        show_figure("labs.biomarker_heatmap", sig, build)
         
-        st.markdown("---")
-        
-        # GCS Analysis (CORRECT PATTERN)
-        st.subheader("Glasgow Coma Scale (GCS)")
-        if 'GCS_category' in Respons_filtered.columns:
-            # Merge Respons with HosDis
-            gcs_adm = Respons_filtered.merge(
-                HosDis_filtered[['inpatient_number', 'admission_way', 'death_within_28_days']],
-                on='inpatient_number', how='left'
-            )
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                gcs_dist = Respons_filtered['GCS_category'].value_counts()
+        st.markdown("**73% of deaths had elevated lactate+troponin , Patients who died showed the highest burden of high-risk biomarker abnormalities—particularly elevated troponin (72.7%) and lactate (63.6%)—highlighting a strong association between myocardial injury, metabolic stress, and in-hospital mortality.**")
+    
+    st.markdown("---")
+    
+    # GCS Analysis (CORRECT PATTERN)
+    st.subheader("Glasgow Coma Scale (GCS)")
+    if 'GCS_category' in columns:
+        col1, col2 = st.columns(2)
+        with col1:
+            def build():
+                gcs_dist = cohort.value_counts('GCS_category')
                 fig = px.pie(values=gcs_dist.values, names=gcs_dist.index, title='GCS Categories',
                             color_discrete_sequence=['#66b3ff', '#ffcc99', '#ff6666'])
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                if 'death_within_28_days' in gcs_adm.columns:
-                    gcs_mort = gcs_adm.groupby('GCS_category').agg({
-                        'death_within_28_days': lambda x: x.sum() / len(x) * 100 if len(x) > 0 else 0
-                    }).reset_index()
+                return fig
+            show_figure("labs.gcs_distribution", sig, build)
+        
+        with col2:
+            if 'death_within_28_days' in cells.columns:
+                def build():
+                    gcs_mort = cohort_rates(cohort, 'GCS_category', ['death_within_28_days'])
                     fig = px.bar(gcs_mort, x='GCS_category', y='death_within_28_days',
                                 title='Mortality by GCS', color='death_within_28_days',
-                                color_continuous_scale='Reds', text='death_within_28_days')
+                                color_continuous_scale='Reds', text='death_within_28_days',
+                                **error_bars(gcs_mort, 'death_within_28_days'))
                     fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-                    st.plotly_chart(fig, use_container_width=True)
-            
-            st.markdown("""
-            <div class="critical-alert">
-                <h4>🧠 GCS: Strongest Mortality Predictor</h4>
-                <ul><li>High-Risk GCS: <strong>2.4% of admits, 64% of deaths</strong></li>
-                <li>92% had abnormal HF biomarkers</li>
-                <li>25% had Type II respiratory failure</li></ul>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown("---")
+                    return fig
+                show_figure("labs.gcs_mortality", f"{sig}:{interval_method()}", build)
+        
+        st.markdown("""
+        <div class="critical-alert">
+            <h4>🧠 GCS: Strongest Mortality Predictor</h4>
+            <ul><li>High-Risk GCS: <strong>2.4% of admits, 64% of deaths</strong></li>
+            <li>92% had abnormal HF biomarkers</li>
+            <li>25% had Type II respiratory failure</li></ul>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        st.markdown("---")
+        
+        # GROUPED BAR: GCS by Emergency
+        st.subheader("GCS by Admission Type")
+        if 'admission_way' in columns:
+            def build():
+                gcs_emerg = cohort.crosstab('GCS_category', 'admission_way', normalize='columns') * 100
             
-            # GROUPED BAR: GCS by Emergency
-            st.subheader("GCS by Admission Type")
-            if 'admission_way' in gcs_adm.columns:
-                gcs_emerg = pd.crosstab(gcs_adm['GCS_category'], gcs_adm['admission_way'], normalize='columns') * 100
-                
                 fig = px.bar(gcs_emerg, barmode='group', title='GCS: Emergency vs Non-Emergency (%)',
                             labels={'value': 'Percentage'},
                             color_discrete_sequence=['#66b3ff', '#ffcc99', '#ff6666'])
-                st.plotly_chart(fig, use_container_width=True)
-                
-                st.markdown("**Emergency patients: 2x more high-risk GCS (3.9% vs 1.9%)**")
+                return fig
+            show_figure("labs.gcs_admission", sig, build)
+            
+            st.markdown("**Emergency patients: 2x more high-risk GCS (3.9% vs 1.9%)**")
+
+
+# Trend resolutions (hf_analytics.timeseries.FREQUENCIES) and split-by columns
+TREND_FREQUENCIES = {"Weekly": "week", "Monthly": "month", "Rolling 28-day": "28d", "Rolling 90-day": "90d"}
+TREND_SPLITS = {"None": None, "Ward": "admission_ward", "Admission Way": "admission_way"}
+TREND_RATES = [
+    ('death_within_28_days', '28d Mortality (%)'),
+    ('re_admission_within_28_days', '28d Readmission (%)'),
+    ('emergency', 'Emergency Admissions (%)'),
+    ('score3', 'Score 3 Patients (%)'),
+]
+
+# TAB 7: TRENDS
+# Every chart comes from the daily count arrays (hf_analytics.timeseries), so
+# changing the resolution or split costs O(days), not a regroup of patient rows.
+# A fragment, so the pickers rerun only this section
+@st.fragment
+def render_trends(cohort):
+    st.header("📈 Admission Trends")
+    if 'Admission_date' not in cohort.data.columns:
+        st.info("No admission dates loaded.")
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        freq = TREND_FREQUENCIES[st.radio("Resolution", list(TREND_FREQUENCIES), horizontal=True, key="trend_freq")]
+    with col2:
+        by = TREND_SPLITS[st.radio("Split by", list(TREND_SPLITS), horizontal=True, key="trend_by")]
+    trend_sig = f"{cohort.sig}:{freq}:{by}"
+    series = trend_series(cohort.sig, cohort, freq, by)
+    if series.empty:
+        st.info("No admissions in this cohort for the selected resolution.")
+        return
+    window = "per window" if freq.endswith('d') else "per period"
+
+    def build():
+        fig = px.line(series, x='date', y='patients', color=by, title=f'Admissions {window}',
+                      labels={'patients': 'Admissions', 'date': ''})
+        return fig
+    show_figure("trends.admissions", trend_sig, build)
+
+    rates = [(col, label) for col, label in TREND_RATES if col in series.columns]
+    for i in range(0, len(rates), 2):
+        for column, (col, label) in zip(st.columns(2), rates[i:i + 2]):
+            with column:
+                def build(col=col, label=label):
+                    fig = px.line(series, x='date', y=col, color=by, title=label,
+                                  labels={col: label, 'date': ''})
+                    return fig
+                show_figure(f"trends.{col}", trend_sig, build)
+
+
+# Endpoints (hf_analytics.survival.ENDPOINTS) and stratification columns for the curves
+SURVIVAL_ENDPOINTS = {"Death": "death", "Readmission": "readmission", "Emergency Return": "emergency"}
+SURVIVAL_STRATA = {
+    'NYHA_cardiac_function_classification': 'NYHA',
+    'Killip_grade': 'Killip',
+    'GCS_category': 'GCS',
+    'hf_top3_score': 'HF Top3 Score',
+    'admission_ward': 'Ward',
+}
+
+# TAB 8: SURVIVAL
+# Time-to-event curves over the 6-month follow-up instead of the fixed 28d/3m/6m
+# flags. Every stratum comes from one vectorized pass (hf_analytics.survival)
+@st.fragment
+def render_survival(cohort):
+    st.header("⏳ Survival & Time to Readmission")
+    options = [c for c in SURVIVAL_STRATA if c in cohort.data.columns]
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        label = st.radio("Endpoint", list(SURVIVAL_ENDPOINTS), horizontal=True, key="survival_endpoint")
+        endpoint = SURVIVAL_ENDPOINTS[label]
+    with col2:
+        by = st.multiselect("Stratify by", options, default=options[:1], format_func=SURVIVAL_STRATA.get,
+                            key="survival_by")
+    curves = survival_curves(cohort.sig, cohort, endpoint, tuple(by))
+    if curves.empty:
+        st.info("No patients with follow-up in this cohort.")
+        return
+    # Death as survival; readmission and emergency return as cumulative incidence
+    y = 'survival' if endpoint == 'death' else 'incidence'
+    y_label = 'Survival (%)' if y == 'survival' else f'Cumulative {label.lower()} (%)'
+    frame = curves.copy()
+    if by:
+        frame['stratum'] = frame[by].astype(str).agg(' / '.join, axis=1)
+
+    def build():
+        title = f"{y_label.removesuffix(' (%)')} by " + " × ".join(SURVIVAL_STRATA[c] for c in by) if by else y_label
+        fig = px.line(frame, x='time', y=y, color='stratum' if by else None, line_shape='hv', title=title,
+                      labels={'time': 'Days from admission', y: y_label, 'stratum': ''},
+                      hover_data=['at_risk', 'events', 'censored'])
+        fig.update_layout(height=500)
+        return fig
+    show_figure(f"survival.{endpoint}", f"{cohort.sig}:{'*'.join(by)}", build)
+
+    # Numbers at risk at the usual follow-up points: everyone leaving on or after the day
+    leaving = curves.assign(n=curves['events'] + curves['censored'])
+    table = pd.DataFrame({f"Day {day}": (leaving[leaving['time'] >= day].groupby(by, observed=True)['n'].sum() if by
+                                         else pd.Series({'All patients': leaving.loc[leaving['time'] >= day, 'n'].sum()}))
+                          for day in (0, 28, 90, 183)}).fillna(0).astype(int)
+    st.caption("Patients still at risk (no event, not censored) by day")
+    st.dataframe(table, use_container_width=True)
+
+
+def main():
+    # Timing spans for this run, only when asked for (HF_PROFILE=1 or ?profile=1)
+    profiler = profiling.activate(profiling.ENABLED or st.query_params.get("profile") == "1")
+    
+    # Query backend: HF_BACKEND sets the default; the picker only shows when duckdb is installed
+    backend = DEFAULT_BACKEND if DEFAULT_BACKEND in BACKENDS else "pandas"
+    if duckdb_available():
+        backend = st.sidebar.radio("Query backend", BACKENDS, index=BACKENDS.index(backend),
+                                   horizontal=True, key="backend")
+    
+    with span("load_data", cache="hit", backend=backend) as s:
+        data = current_data(load_analytics(backend))
+        s.set(rows=data.n_patients)
+    filter_values = data.filter_values
+    n_patients = data.n_patients
+    
+    st.markdown('<h1 class="main-header">🫀 Heart Failure Analytics Dashboard</h1>', unsafe_allow_html=True)
+    st.markdown(f"**Analyzing {n_patients:,} patients from PhysioNet Dataset**")
+    st.markdown("---")
+    
+    # SIDEBAR FILTERS
+    st.sidebar.header("🔍 Filter Patients")
+    
+    # Age filter
+    age_range = None
+    if 'age' in filter_values:
+        ages = filter_values['age']
+        age_range = st.sidebar.slider("Age", int(ages[0]), int(ages[-1]), (int(ages[0]), int(ages[-1])))
+    
+    # Gender filter
+    gender_filter = []
+    if 'gender' in filter_values:
+        gender_filter = st.sidebar.multiselect("Gender", filter_values['gender'], default=filter_values['gender'])
+    
+    # Ward filter
+    ward_filter = []
+    if 'ward' in filter_values:
+        ward_filter = st.sidebar.multiselect("Ward", filter_values['ward'], default=filter_values['ward'])
+    
+    # Error bars on outcome rates (read through interval_method())
+    st.sidebar.radio("95% confidence intervals", list(CI_METHODS), horizontal=True, key="ci")
+    
+    # Apply filters: bitmap AND/OR over the patient order. Per-sheet takes, cube
+    # cells and aggregates happen lazily inside the selected section below
+    with span("filter", rows=n_patients) as s:
+        cohort = data.cohort(age_range=age_range, genders=gender_filter, wards=ward_filter)
+        s.set(selected=len(cohort))
+    
+    st.sidebar.markdown(f"**Filtered: {len(cohort):,} / {n_patients:,} patients**")
+    
+    # SECTIONS: only the selected section is computed and drawn on each rerun
+    sections = {
+        "📊 KPIs": render_kpis,
+        "👥 Demographics": render_demographics,
+        "💊 Prescriptions": render_prescriptions,
+        "🏥 Hospital": render_hospital,
+        "💔 CardiacComplications": render_cardiac,
+        "🔬 Labs & GCS": render_labs_gcs,
+        "📈 Trends": render_trends,
+        "⏳ Survival": render_survival,
+    }
+    section = st.radio("Section", list(sections), horizontal=True,
+                       label_visibility="collapsed", key="section")
+    st.markdown("---")
+    render = sections[section]
+    with span(f"section:{render.__name__.removeprefix('render_')}", rows=len(cohort)):
+        render(cohort)
+    
+    # Figure cache counter, drawn after the section so this rerun is counted
+    stats = load_figure_cache().stats()
+    st.sidebar.caption(f"Figure cache: {stats['hits']} hits / {stats['misses']} misses · "
+                       f"{stats['figures']} figures, {stats['bytes'] / 1e6:.1f} MB")
+    
+    # Table memory before/after dtype compaction (what each session holds; pandas backend)
+    if data.memory_report is not None:
+        with st.sidebar.expander("Memory per table"):
+            st.dataframe(data.memory_report, hide_index=True, use_container_width=True)
+    
+    if profiler is not None:
+        show_profile(profiler)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
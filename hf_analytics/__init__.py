@@ -0,0 +1,4 @@
+"""
+Heart Failure Analytics - data and computation helpers used by app.py
+
+"""
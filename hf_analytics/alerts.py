@@ -0,0 +1,426 @@
+"""
+Streaming biomarker and GCS alerts
+
+An alert service for the "Automate biomarker + GCS alerts" recommendation.
+Events are JSON lines with an inpatient_number and any of the biomarker rule
+columns (lactate, sodium, high_sensitivity_troponin, ...) and GCS, read from
+a file being appended to, a local TCP socket or a replay of the workbook.
+Readers put events on an asyncio queue; the engine drains whatever has
+arrived (up to batch_size) as one micro-batch and updates a PatientStore:
+latest value per patient and column in NumPy arrays indexed by a patient
+slot. Rules are evaluated with biomarkers.evaluate_rules() for the patients
+the batch touched, and an alert is emitted when a patient reaches Score 3
+or High-Risk GCS (GCS below 13, as gcs_category()); it re-arms once the
+patient leaves that state. State is evaluated per micro-batch, so a value
+that comes and goes within one batch does not alert. Events without a
+usable inpatient_number or with non-numeric values, and lines that are not
+JSON, are skipped and counted instead of stopping the service.
+
+    python -m hf_analytics.alerts replay --repeat 10      # drive it from Labs/Responsivenes
+    python -m hf_analytics.alerts tail events.jsonl       # follow a file
+    python -m hf_analytics.alerts serve --port 8765       # JSON lines over a local socket
+    python -m hf_analytics.alerts bench                   # throughput and latency
+
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.biomarkers import BIOMARKER_RULES, evaluate_rules, score_from_flags
+from hf_analytics.loader import DATA_PATH, load_tables
+
+
+GCS_COLUMN = 'GCS'
+# gcs_category(): 15 Normal, 13-14 Low-Risk, below 13 High-Risk
+GCS_HIGH_RISK_BELOW = 13
+
+BATCH_SIZE = 1024
+# Patients are replayed with ids offset by this per repeat, so repeats are new patients
+REPLAY_ID_STRIDE = 100_000_000
+
+# Raised while reading a malformed event
+BAD_EVENT_ERRORS = (KeyError, TypeError, ValueError, OverflowError, AttributeError)
+
+SCORE3, GCS_HIGH_RISK = 1, 2
+ALERT_NAMES = {SCORE3: 'score3', GCS_HIGH_RISK: 'gcs_high_risk'}
+
+
+class PatientStore:
+    """Latest value per (patient, column), alert state and patient ids in
+    growable NumPy arrays; a dict maps inpatient_number to its row (slot)."""
+
+    def __init__(self, columns, capacity=1024):
+        self.columns = list(columns)
+        self.slot = {}
+        self.n = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, len(self.columns)), np.nan)
+        self.state = np.zeros(capacity, dtype=np.uint8)
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == len(self.ids):
+            return
+        extra = capacity - len(self.ids)
+        self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=np.int64)])
+        self.values = np.concatenate([self.values, np.full((extra, len(self.columns)), np.nan)])
+        self.state = np.concatenate([self.state, np.zeros(extra, dtype=np.uint8)])
+
+    def slots(self, ids):
+        """Slot per patient id, adding patients seen for the first time."""
+        slot = self.slot
+        out = np.empty(len(ids), dtype=np.intp)
+        for i, pid in enumerate(ids):
+            s = slot.get(pid)
+            if s is None:
+                s = slot[pid] = self.n
+                self.n += 1
+            out[i] = s
+        if self.n > len(self.ids):
+            self._grow(self.n)
+        self.ids[out] = ids
+        return out
+
+    def frame(self, slots):
+        """Stored values of the given slots as a DataFrame (one row per slot)."""
+        return pd.DataFrame(self.values[slots], columns=self.columns)
+
+    def __len__(self):
+        return self.n
+
+
+class AlertEngine:
+    """Micro-batched alert evaluation over a PatientStore.
+
+    sink is called with each batch's alerts (a list of dicts); by default they
+    are printed as JSON lines. Per-alert latencies (seconds from an event being
+    queued to its alert being emitted) are kept for reporting.
+    """
+
+    def __init__(self, rules=BIOMARKER_RULES, sink=None, batch_size=BATCH_SIZE):
+        self.rules = rules
+        columns = list(dict.fromkeys(r.column for r in rules)) + [GCS_COLUMN]
+        self.store = PatientStore(columns)
+        self.n_score_rules = sum(r.in_score for r in rules)
+        self.sink = sink or print_alerts
+        self.batch_size = batch_size
+        self.events = 0
+        self.skipped = 0
+        self.batches = 0
+        self.alerts = {name: 0 for name in ALERT_NAMES.values()}
+        self.latencies = []
+
+    def process(self, events, received=None):
+        """Apply one micro-batch of event dicts; returns the alerts it raised.
+
+        received optionally holds each event's perf_counter arrival time.
+        Malformed events are skipped and counted in self.skipped.
+        """
+        try:
+            ids, columns = self._columns(events)
+        except BAD_EVENT_ERRORS:
+            keep = [i for i, e in enumerate(events) if self._usable(e)]
+            self.skipped += len(events) - len(keep)
+            events = [events[i] for i in keep]
+            if received is not None:
+                received = [received[i] for i in keep]
+            ids, columns = self._columns(events)
+        if not events:
+            return []
+        store = self.store
+        slots = store.slots(ids)
+        for j, values in enumerate(columns):
+            given = ~np.isnan(values)
+            # Later events for the same patient overwrite earlier ones
+            store.values[slots[given], j] = values[given]
+
+        touched, position = np.unique(slots, return_inverse=True)
+        flags = evaluate_rules(store.frame(touched), self.rules)
+        score = score_from_flags(flags, self.rules)
+        gcs = store.values[touched, -1]
+        with np.errstate(invalid='ignore'):
+            state = (np.where(score >= self.n_score_rules, SCORE3, 0)
+                     | np.where(gcs < GCS_HIGH_RISK_BELOW, GCS_HIGH_RISK, 0)).astype(np.uint8)
+        rising = state & ~store.state[touched]
+        store.state[touched] = state
+
+        self.events += len(events)
+        self.batches += 1
+        hits = np.flatnonzero(rising)
+        if not len(hits):
+            return []
+        if received is not None:
+            # Arrival of each touched patient's latest event in the batch
+            arrived = np.zeros(len(touched))
+            np.maximum.at(arrived, position.ravel(), np.asarray(received, dtype=float))
+        alerts = []
+        now = time.perf_counter()
+        for i in hits:
+            for bit, name in ALERT_NAMES.items():
+                if rising[i] & bit:
+                    alert = {'alert': name, 'inpatient_number': int(store.ids[touched[i]]),
+                             'hf_top3_score': int(score[i]), 'GCS': None if np.isnan(gcs[i]) else float(gcs[i])}
+                    if received is not None:
+                        alert['latency_ms'] = round((now - arrived[i]) * 1000, 3)
+                        self.latencies.append(now - arrived[i])
+                    self.alerts[name] += 1
+                    alerts.append(alert)
+        self.sink(alerts)
+        return alerts
+
+    def _columns(self, events):
+        """(patient ids, value array per store column) for a batch; raises one
+        of BAD_EVENT_ERRORS if any event is malformed."""
+        ids = [int(e['inpatient_number']) for e in events]
+        columns = [np.array([e.get(col, np.nan) for e in events], dtype=float) for col in self.store.columns]
+        if any(values.shape != (len(events),) for values in columns):
+            raise ValueError("Event values must be numbers")
+        return ids, columns
+
+    def _usable(self, event):
+        try:
+            self._columns([event])
+        except BAD_EVENT_ERRORS:
+            return False
+        return True
+
+    async def run(self, source):
+        """Consume an async iterator of events until it ends, in micro-batches."""
+        queue = asyncio.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                async for event in source:
+                    queue.put_nowait((event, time.perf_counter()))
+            finally:
+                queue.put_nowait((done, None))
+
+        producer = asyncio.create_task(produce())
+        finished = False
+        while not finished:
+            item = await queue.get()
+            batch = []
+            while True:
+                if item[0] is done:
+                    finished = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size or queue.empty():
+                    break
+                item = queue.get_nowait()
+            if batch:
+                events, received = zip(*batch)
+                self.process(list(events), received)
+            # Let readers fill the queue before the next batch
+            await asyncio.sleep(0)
+        await producer
+
+    def report(self):
+        """Events, skipped events, batches, alerts and latency percentiles (ms) so far."""
+        lat = np.array(self.latencies) * 1000
+        return {
+            'events': self.events,
+            'skipped': self.skipped,
+            'batches': self.batches,
+            'patients': len(self.store),
+            **{f'alerts_{name}': n for name, n in self.alerts.items()},
+            'latency_p50_ms': round(float(np.percentile(lat, 50)), 3) if len(lat) else None,
+            'latency_p99_ms': round(float(np.percentile(lat, 99)), 3) if len(lat) else None,
+            'latency_max_ms': round(float(lat.max()), 3) if len(lat) else None,
+        }
+
+
+def print_alerts(alerts):
+    for alert in alerts:
+        print(json.dumps(alert), flush=True)
+
+
+def discard_alerts(alerts):
+    pass
+
+
+def parse_event(line):
+    """Event dict of a JSON line, None for a blank line and {} (skipped and
+    counted by the engine) for a line that is not JSON."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return {}
+
+
+# SOURCES
+async def tail_file(path, follow=True, poll=0.05):
+    """Events from a JSON-lines file; with follow, keep waiting for appended lines.
+
+    A line is parsed once its newline has been written: text read before that
+    (a writer still appending) is held until the rest arrives. Without follow,
+    a last line lacking a newline is parsed at the end of the file.
+    """
+    partial = ''
+    with open(path) as f:
+        while True:
+            line = f.readline()
+            if not line:
+                if not follow:
+                    event = parse_event(partial)
+                    if event is not None:
+                        yield event
+                    return
+                await asyncio.sleep(poll)
+                continue
+            if not line.endswith('\n'):
+                partial += line
+                continue
+            event = parse_event(partial + line)
+            partial = ''
+            if event is not None:
+                yield event
+
+
+async def serve_socket(engine, host='127.0.0.1', port=8765):
+    """Accept JSON-lines connections on a local socket and feed every client's
+    events into engine until cancelled."""
+    queue = asyncio.Queue()
+
+    async def handle(reader, writer):
+        try:
+            while line := await reader.readline():
+                event = parse_event(line.decode())
+                if event is not None:
+                    await queue.put(event)
+        finally:
+            writer.close()
+
+    async def events():
+        while True:
+            yield await queue.get()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await engine.run(events())
+
+
+def replay_events(tables, rules=BIOMARKER_RULES, repeat=1, seed=0):
+    """Events that replay the Labs and Responsivenes sheets: one event per patient
+    and marker value (so scores build up over several events), shuffled with a
+    fixed seed. Each repeat is a copy with new patient ids."""
+    labs, respons = tables['Labs'], tables['Responsivenes']
+    columns = [c for c in dict.fromkeys(r.column for r in rules) if c in labs.columns]
+    parts = [labs[['inpatient_number'] + columns].melt('inpatient_number').dropna(subset=['value'])]
+    if GCS_COLUMN in respons.columns:
+        gcs = respons[['inpatient_number', GCS_COLUMN]].dropna()
+        parts.append(gcs.assign(variable=GCS_COLUMN).rename(columns={GCS_COLUMN: 'value'}))
+    long = pd.concat(parts, ignore_index=True)
+    ids = long['inpatient_number'].to_numpy(dtype=np.int64)
+    variables, values = long['variable'].to_numpy(), long['value'].to_numpy(dtype=float)
+
+    rng = np.random.default_rng(seed)
+    events = []
+    for r in range(repeat):
+        for i in rng.permutation(len(long)):
+            events.append({'inpatient_number': int(ids[i]) + r * REPLAY_ID_STRIDE, variables[i]: float(values[i])})
+    return events
+
+
+def expected_alerts(tables, rules=BIOMARKER_RULES):
+    """Patients the batch logic puts at Score 3 / High-Risk GCS (missing GCS left out)."""
+    labs, respons = tables['Labs'], tables['Responsivenes']
+    n_score_rules = sum(r.in_score for r in rules)
+    score3 = int((score_from_flags(evaluate_rules(labs, rules), rules) >= n_score_rules).sum())
+    gcs = respons[GCS_COLUMN] if GCS_COLUMN in respons.columns else pd.Series(dtype=float)
+    return {'score3': score3, 'gcs_high_risk': int((gcs < GCS_HIGH_RISK_BELOW).sum())}
+
+
+async def replay(events, rate=None):
+    """Async iterator over events, at `rate` events per second (as fast as possible when None)."""
+    start = time.perf_counter()
+    for i, event in enumerate(events):
+        if rate and i % 64 == 0:
+            ahead = start + i / rate - time.perf_counter()
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+        elif i % BATCH_SIZE == 0:
+            await asyncio.sleep(0)
+        yield event
+
+
+def run_replay(events, rate=None, batch_size=BATCH_SIZE, sink=discard_alerts):
+    """Replay events through a fresh engine; returns its report plus wall time and events/s."""
+    engine = AlertEngine(sink=sink, batch_size=batch_size)
+    start = time.perf_counter()
+    asyncio.run(engine.run(replay(events, rate)))
+    elapsed = time.perf_counter() - start
+    return {**engine.report(), 'seconds': round(elapsed, 3), 'events_per_s': round(engine.events / elapsed)}
+
+
+BENCH_SETTINGS = [
+    # (repeat, rate, batch_size); rate None = as fast as possible
+    (10, None, BATCH_SIZE),
+    (10, None, 128),
+    (2, 2_000, BATCH_SIZE),
+    (5, 10_000, BATCH_SIZE),
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming Score 3 / High-Risk GCS alerts")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    p = sub.add_parser("replay", help="replay the Labs and Responsivenes sheets as events")
+    p.add_argument("--source", default=DATA_PATH)
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--rate", type=float, default=None, help="events per second (default: as fast as possible)")
+    p.add_argument("--batch", type=int, default=BATCH_SIZE)
+    p.add_argument("--print", action="store_true", help="print every alert")
+    p = sub.add_parser("tail", help="follow a JSON-lines event file")
+    p.add_argument("path")
+    p.add_argument("--no-follow", action="store_true", help="stop at the end of the file")
+    p.add_argument("--batch", type=int, default=BATCH_SIZE)
+    p = sub.add_parser("serve", help="read JSON-lines events from a local socket")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--batch", type=int, default=BATCH_SIZE)
+    p = sub.add_parser("bench", help="throughput and alert latency on replayed sheets")
+    p.add_argument("--source", default=DATA_PATH)
+    args = parser.parse_args()
+
+    if args.mode == "tail":
+        engine = AlertEngine(batch_size=args.batch)
+        try:
+            asyncio.run(engine.run(tail_file(args.path, follow=not args.no_follow)))
+        except KeyboardInterrupt:
+            pass
+        print(json.dumps(engine.report()), file=sys.stderr)
+    elif args.mode == "serve":
+        engine = AlertEngine(batch_size=args.batch)
+        try:
+            asyncio.run(serve_socket(engine, args.host, args.port))
+        except KeyboardInterrupt:
+            print(json.dumps(engine.report()), file=sys.stderr)
+    elif args.mode == "replay":
+        tables = load_tables(args.source)
+        events = replay_events(tables, repeat=args.repeat)
+        report = run_replay(events, args.rate, args.batch, print_alerts if args.print else discard_alerts)
+        expected = {k: v * args.repeat for k, v in expected_alerts(tables).items()}
+        print(json.dumps(report), file=sys.stderr)
+        print(f"expected from the sheets: {expected}; match: "
+              f"{all(report[f'alerts_{k}'] == v for k, v in expected.items())}", file=sys.stderr)
+    else:
+        tables = load_tables(args.source)
+        rows = []
+        for repeat, rate, batch_size in BENCH_SETTINGS:
+            events = replay_events(tables, repeat=repeat)
+            rows.append({'events': len(events), 'rate': rate or 'max', 'batch_size': batch_size,
+                         **run_replay(events, rate, batch_size)})
+        print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,388 @@
+"""
+Streamlit-free dashboard analytics
+
+Analytics holds the loaded tables and builds the derived structures (patient
+table, filter bitmaps, outcome cube, threshold index, drug matrix) on first
+use, so nothing is computed until something asks for it. Analytics.cohort()
+applies the sidebar filters and returns a Cohort with the mask, the cohort
+signature, the cube cells and the aggregations and scores the dashboard
+draws. The app, command-line tools and benchmarks all go through here; this
+module imports neither Streamlit nor Plotly.
+
+    from hf_analytics.analytics import Analytics
+    data = Analytics.load()
+    data.cohort(genders=['Female']).kpis()
+
+"""
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.biomarkers import FLAGS_COLUMN, abnormal_rates, has_flag
+from hf_analytics.cube import (CUBE_DIMS, OUTCOME_FLAGS, build_outcome_cube, cell_rates, cell_totals,
+                               grouped_rates, merge_cubes, select_cells, value_share)
+from hf_analytics.dtypes import append_rows, append_tables, compact_tables
+from hf_analytics.figcache import cohort_signature
+from hf_analytics.filters import FilterEngine
+from hf_analytics.intervals import BOOTSTRAP_SAMPLES, LEVEL, bootstrap_rates, wilson_rates
+from hf_analytics.loader import CACHE_DIR, DATA_PATH, load_tables
+from hf_analytics.patients import build_patient_table
+from hf_analytics.profiling import span
+
+
+POLYPHARMACY_BANDS = ([-1, 4, 7, 10, np.inf], ['0–4', '5–7', '8–10', '11+'])
+
+
+class Analytics:
+    """Loaded tables plus lazily built, read-only derived structures."""
+
+    def __init__(self, tables, memory_report=None, version=0):
+        self.tables = tables
+        self.memory_report = memory_report
+        # Bumped by append(), so cohort signatures (and cached figures) follow the data
+        self.version = version
+        # Set when the tables are mapped from the shared snapshot (Analytics.shared)
+        self.snapshot = False
+
+    @classmethod
+    def load(cls, file_path=DATA_PATH, compact=True, **load_kwargs):
+        """Load the workbook (through the Parquet cache) and compact dtypes."""
+        with span("load:tables") as s:
+            tables = load_tables(file_path, **load_kwargs)
+            s.set(rows=sum(len(df) for df in tables.values()))
+        memory_report = None
+        if compact:
+            with span("load:compact_dtypes"):
+                tables, memory_report = compact_tables(tables)
+        return cls(tables, memory_report)
+
+    @classmethod
+    def shared(cls, file_path=DATA_PATH, cache_dir=CACHE_DIR, build=None):
+        """Tables, patient table and derived structures memory-mapped from the
+        shared snapshot (hf_analytics.shared), written first if no process has
+        yet (from the Analytics build() returns, when given)."""
+        from hf_analytics.shared import open_snapshot
+        tables, patients, memory_report, structures = open_snapshot(file_path, cache_dir, build)
+        data = cls(tables, memory_report)
+        data.patients, data.snapshot = patients, True
+        for name, value in structures.items():
+            setattr(data, name, value)
+        return data
+
+    def append(self, rows):
+        """New Analytics with the tables in rows ({sheet: DataFrame} of new patients,
+        derived columns included, e.g. a delta batch) appended.
+
+        Only what is already built is carried over, and each structure is
+        extended with the new patients instead of rebuilt: the patient table and
+        cube get the new patients' rows and cells, the filter bitmaps, threshold
+        index and drug matrix are merged with ones built over the new patients.
+        Copying the tables still touches every row, but nothing is recomputed
+        over existing patients.
+        """
+        with span("append:tables", rows=sum(len(df) for df in rows.values())):
+            tables, rows, report = append_tables(self.tables, rows, self.memory_report,
+                                                 compact=self.memory_report is not None)
+        data = type(self)(tables, report, self.version + 1)
+        built = self.__dict__
+        if 'patients' not in built:
+            return data
+
+        with span("append:patient_table", rows=len(rows['Demography'])):
+            ids = rows['Demography']['inpatient_number']
+            if ids.duplicated().any() or (self.patients.index.get_indexer(ids) >= 0).any():
+                raise ValueError("Appended patients must be new: inpatient_number already loaded")
+            patients, new = append_rows(self.patients, build_patient_table(rows), compact=False)
+            data.patients = patients
+        if 'filters' in built:
+            with span("append:filters", rows=len(new)):
+                data.filters = self.filters.append(new, rows)
+        if 'cube' in built:
+            with span("append:outcome_cube", rows=len(new)):
+                old = self.cube.astype({d: patients[d].dtype for d in self.cube.columns if d in CUBE_DIMS})
+                data.cube = merge_cubes(old, build_outcome_cube(new))
+        if 'sweep' in built:
+            with span("append:threshold_index", rows=len(new)):
+                data.sweep = self.sweep.append(new)
+        if 'drugs' in built:
+            with span("append:drug_matrix", rows=len(rows['Patient_Precriptions'])):
+                data.drugs = self.drugs.append(rows['Patient_Precriptions'], new.index)
+        if 'daily' in built:
+            with span("append:daily_counts", rows=len(new)):
+                data.daily = self.daily.append(new)
+        return data
+
+    @functools.cached_property
+    def patients(self):
+        with span("build:patient_table", rows=len(self.tables['Demography'])):
+            return build_patient_table(self.tables)
+
+    @functools.cached_property
+    def filters(self):
+        patients = self.patients
+        with span("build:filters", rows=len(patients)):
+            return FilterEngine(patients, self.tables)
+
+    @functools.cached_property
+    def cube(self):
+        patients = self.patients
+        with span("build:outcome_cube", rows=len(patients)):
+            return build_outcome_cube(patients)
+
+    @functools.cached_property
+    def sweep(self):
+        from hf_analytics.sweep import ThresholdIndex
+        patients = self.patients
+        with span("build:threshold_index", rows=len(patients)):
+            return ThresholdIndex(patients)
+
+    @functools.cached_property
+    def drugs(self):
+        from hf_analytics.drugs import DrugMatrix
+        prescriptions, patients = self.tables['Patient_Precriptions'], self.patients
+        with span("build:drug_matrix", rows=len(prescriptions)):
+            return DrugMatrix(prescriptions, patients.index)
+
+    @functools.cached_property
+    def daily(self):
+        from hf_analytics.timeseries import DailyCounts
+        patients = self.patients
+        with span("build:daily_counts", rows=len(patients)):
+            return DailyCounts(patients)
+
+    @property
+    def columns(self):
+        """Columns of the wide patient table."""
+        return self.patients.columns
+
+    @property
+    def n_patients(self):
+        return len(self.patients)
+
+    @property
+    def filter_values(self):
+        """Sidebar choices per filter dimension (age sorted, others in order of appearance)."""
+        return self.filters.values
+
+    def cohort(self, age_range=None, genders=None, wards=None, where=None):
+        return Cohort(self, age_range, genders, wards, where)
+
+
+class Cohort:
+    """One sidebar selection: mask over the patient order plus per-cohort aggregates.
+
+    where optionally narrows further by {patient column: allowed values}, for
+    cohorts the sidebar cannot express (e.g. admission way or age band). Empty
+    selections do not filter. Aggregates are computed on first access.
+    """
+
+    def __init__(self, data, age_range=None, genders=None, wards=None, where=None):
+        self.data = data
+        self.age_range = age_range
+        self.genders = list(genders or [])
+        self.wards = list(wards or [])
+        self.where = {col: list(values) for col, values in (where or {}).items() if len(values)}
+        self.mask = data.filters.mask(age_range=age_range, genders=self.genders, wards=self.wards)
+        for col, values in self.where.items():
+            self.mask &= data.patients[col].isin(values).to_numpy()
+        self.sig = cohort_signature(age=age_range, gender=self.genders, ward=self.wards,
+                                    **({'where': self.where} if self.where else {}),
+                                    **({'data': data.version} if data.version else {}))
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    @functools.cached_property
+    def ids(self):
+        return self.data.filters.patients(self.mask)
+
+    @functools.cached_property
+    def patients(self):
+        """Rows of the wide patient table in the cohort."""
+        return self.data.patients[self.mask]
+
+    def take(self, sheet):
+        """Rows of one loaded sheet for the cohort's patients."""
+        with span(f"take:{sheet}") as s:
+            rows = self.data.filters.take(sheet, self.data.tables[sheet], self.mask)
+            s.set(rows=len(rows))
+        return rows
+
+    @property
+    def narrows_age(self):
+        """Whether the age range leaves out some loaded ages."""
+        ages = self.data.filters.values.get('age')
+        return self.age_range is not None and bool(ages) and (self.age_range[0] > ages[0] or self.age_range[1] < ages[-1])
+
+    @functools.cached_property
+    def cells(self):
+        """Outcome cube cells for the cohort. The cube has no exact-age dimension,
+        so a narrowed age range (or a `where` column that is not a cube
+        dimension) aggregates the filtered rows into a cube of their own."""
+        if self.narrows_age:
+            return build_outcome_cube(self.patients)
+        if any(col not in CUBE_DIMS for col in self.where):
+            return build_outcome_cube(self.patients)
+        return select_cells(self.data.cube, genders=self.genders, wards=self.wards, where=self.where)
+
+    @functools.cached_property
+    def totals(self):
+        return cell_totals(self.cells)
+
+    def select(self, columns):
+        """The given patient columns for the cohort, in patient order."""
+        return self.patients[list(columns)]
+
+    # AGGREGATIONS
+
+    def share(self, col, values):
+        """(patients whose col is one of values, % of the cohort)."""
+        n = len(self)
+        count = int(self.patients[col].isin(values).sum())
+        return count, (count / n * 100 if n else 0)
+
+    def flag_share(self, name):
+        """(patients abnormal on biomarker rule `name`, % of the cohort)."""
+        n = len(self)
+        count = int(has_flag(self.patients[FLAGS_COLUMN], name).sum())
+        return count, (count / n * 100 if n else 0)
+
+    def median(self, col):
+        return self.patients[col].median()
+
+    def value_counts(self, col, sort='count'):
+        """Patients per observed value of col, largest first (ties by value), or by value."""
+        counts = self.patients[col].value_counts(sort=False)
+        counts = counts[counts > 0].sort_index()
+        if sort == 'count':
+            counts = counts.sort_values(ascending=False, kind='stable')
+        return counts
+
+    def binned_counts(self, col, bins, labels):
+        """Patients per pd.cut bin of col (empty bins included), largest first."""
+        counts = pd.cut(self.patients[col], bins=bins, labels=labels).value_counts(sort=False)
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def crosstab(self, index, columns, normalize=None):
+        """Patients per (index, columns) value pair, like pd.crosstab; normalize='columns'
+        gives shares of each column."""
+        table = self.patients.groupby([index, columns], observed=True).size().unstack(fill_value=0)
+        table = table.sort_index().sort_index(axis=1)
+        if normalize == 'columns':
+            table = table / table.sum(axis=0)
+        return table
+
+    def group_counts(self, columns):
+        """Patients per observed combination of columns: columns plus 'count'."""
+        return self.patients.groupby(list(columns), observed=True).size().reset_index(name='count')
+
+    def kpis(self):
+        """Headline numbers: patients, outcome rates (%) and the Score 3 share."""
+        totals = self.totals
+        n = totals['patients']
+        out = {'patients': len(self)}
+        for flag in OUTCOME_FLAGS:
+            if flag in totals:
+                out[flag] = totals[flag] / n * 100 if n else np.nan
+        if 'hf_top3_score' in self.cells.columns:
+            out['score3_patients'], out['score3_pct'] = value_share(self.cells, 'hf_top3_score', 3)
+        return out
+
+    def outcome_rates(self, by, outcomes=OUTCOME_FLAGS):
+        """Patients and outcome rates (%) per value of a patient column, from the
+        cube when it has that dimension."""
+        if by in self.cells.columns:
+            return cell_rates(self.cells, by, outcomes)
+        return grouped_rates(self.patients, by, outcomes)
+
+    def outcome_intervals(self, by=None, outcomes=OUTCOME_FLAGS, method='wilson', level=LEVEL,
+                          n_boot=BOOTSTRAP_SAMPLES):
+        """outcome_rates() (one whole-cohort row when by is None) with confidence
+        bounds in `<outcome>_lo` / `<outcome>_hi` (%). 'wilson' needs only the
+        counts; 'bootstrap' resamples the cohort's rows within each group."""
+        outcomes = [o for o in outcomes if o in self.data.columns]
+        if method == 'bootstrap':
+            rows = self.select(([by] if by is not None else []) + outcomes)
+            return bootstrap_rates(rows, by, outcomes, level, n_boot)
+        if method != 'wilson':
+            raise ValueError(f"Unknown interval method {method!r}")
+        if by is None:
+            kpis = self.kpis()
+            rates = pd.DataFrame([{'patients': len(self), **{o: kpis[o] for o in outcomes}}])
+        else:
+            rates = self.outcome_rates(by, outcomes)
+        return wilson_rates(rates, outcomes, level)
+
+    # SCORES
+
+    def score_outcomes(self, thresholds=None):
+        """Score 0 / Score 3 outcome rates at the given cut-offs (all patients)."""
+        return self.data.sweep.query(thresholds)
+
+    def biomarker_rates(self):
+        """% abnormal per biomarker rule among deaths, Cardiology and ICU patients."""
+        p = self.patients
+        died = p['outcome_during_hospitalization'] == 'Dead' if 'outcome_during_hospitalization' in p.columns else np.zeros(len(p), dtype=bool)
+        return abnormal_rates(p[FLAGS_COLUMN], {
+            'Deaths': died,
+            'Cardiology': p['admission_ward'] == 'Cardiology',
+            'ICU': p['admission_ward'] == 'ICU',
+        }, columns=p.columns)
+
+    # PRESCRIPTIONS
+
+    def prescription_count(self):
+        return self.data.drugs.prescriptions(self.mask)
+
+    def top_drugs(self, n=10):
+        return self.data.drugs.top_drugs(n, self.mask)
+
+    def drug_counts(self, by, drugs=None):
+        """Prescription rows per drug (rows) and value of patient column `by` (columns)."""
+        return self.data.drugs.group_counts(self.data.patients[by], self.mask, drugs)
+
+    def co_prescriptions(self):
+        return self.data.drugs.co_prescriptions(self.mask)
+
+    def polypharmacy(self, outcomes=('re_admission_within_28_days', 're_admission_within_6_months')):
+        """Readmission rates (%) per band of distinct drugs per patient."""
+        outcomes = list(outcomes)
+        counts = self.data.drugs.drugs_per_patient(self.mask)
+        bins, labels = POLYPHARMACY_BANDS
+        bands = pd.cut(counts.to_numpy(), bins=bins, labels=labels)
+        frame = self.patients[outcomes].assign(drugs=bands)
+        return grouped_rates(frame, 'drugs', outcomes)
+
+    # TRENDS
+
+    def trends(self, freq='month', by=None):
+        """Admissions and outcome / Emergency / Score 3 rates (%) per week, month
+        or rolling 28/90-day window (see DailyCounts.series). The daily arrays
+        are stratified by ward, admission way and gender; a narrowed age range,
+        another `where` column or another `by` counts the cohort's rows instead."""
+        from hf_analytics.timeseries import DailyCounts
+        daily = self.data.daily
+        where = {'gender': self.genders, 'admission_ward': self.wards, **self.where}
+        if self.narrows_age or any(col not in daily.dims for col in where) or (by is not None and by not in daily.dims):
+            daily, where = DailyCounts(self.patients, [by] if by else []), None
+        with span("trends", freq=freq):
+            return daily.series(freq, where, by)
+
+    # SURVIVAL
+
+    def survival(self, endpoint, by=None):
+        """Kaplan-Meier curves for 'death', 'readmission' or 'emergency', per
+        value (combination) of by, all strata in one pass (see km_curves)."""
+        from hf_analytics.survival import ENDPOINTS, km_curves
+        keys = [] if by is None else [by] if isinstance(by, str) else list(by)
+        columns = keys + [c for c in ENDPOINTS[endpoint] if c is not None]
+        with span("survival", rows=len(self)):
+            return km_curves(self.select(columns), endpoint, by)
+
+    # FLOWS
+
+    def flow(self, stages, min_count=0):
+        from hf_analytics.flows import build_flow
+        return build_flow(self.take('Hospitalization_Discharge'), stages, min_count=min_count)
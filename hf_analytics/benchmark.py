@@ -0,0 +1,415 @@
+"""
+Dashboard benchmark at 1x-1000x the workbook size
+
+For each scale a synthetic cohort (hf_analytics.synthetic) of scale x 2,008
+patients is written once under data/.synthetic/, then a fresh worker process
+times what a dashboard session does with it:
+
+    load_data          per-sheet Parquet read + dtype compaction (a warm-cache start)
+    build.*            patient table, filter bitmaps, outcome cube, threshold index, drug matrix
+    filter             the sidebar filter step (selection, cohort size, cube cells)
+    tab.*              the data work behind each section and fragment (no plotting)
+
+With --backend sql the cohort is copied into a DuckDB file once (build.duckdb,
+not repeated), load_data opens it, and filter and tabs run as SQL.
+
+Each scale runs in its own process, so a scale that runs out of memory or
+time is recorded as failed and the larger ones are still attempted. Results
+go to a JSON file; --compare prints the step-by-step ratio against an
+earlier file and exits 1 if any step is more than REGRESSION_RATIO (and
+NOISE_S) slower.
+
+    python -m hf_analytics.benchmark                              # 1x, 10x, 100x, 1000x
+    python -m hf_analytics.benchmark --scales 1 10 --compare benchmarks/baseline.json
+    python -m hf_analytics.benchmark --backend sql
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.loader import DATA_PATH, SHEETS, load_tables, read_sheets
+
+
+SCALES = [1, 10, 100, 1000]
+SYNTHETIC_DIR = "data/.synthetic"
+RESULTS_DIR = "benchmarks"
+
+# A step this much slower than in the compared run counts as a regression,
+# unless it is within timer noise
+REGRESSION_RATIO = 1.25
+NOISE_S = 0.01
+
+# Sidebar selection used for the filter step and every tab
+FILTER = {"genders": ["Female"], "wards": ["Cardiology", "ICU"]}
+
+HF_COLUMNS = ['death_within_28_days', 'death_within_3_months', 'death_within_6_months',
+              're_admission_within_28_days', 're_admission_within_3_months', 're_admission_within_6_months']
+
+
+# TAB WORKLOADS: the data work of each render_* function in app.py, through the
+# Cohort interface so either backend can run it
+def _kpis(cohort):
+    return cohort.kpis()
+
+
+def _demographics(cohort):
+    cohort.share('gender', ['Female']), cohort.share('occupation', ['UrbanResident'])
+    cohort.data.cohort().value_counts('ageCat')
+    cohort.group_counts(['admission_way', 'gender', 'ageCat'])
+    cohort.value_counts('BMI_Cat')
+    return cohort.crosstab('ageCat', 'admission_way')
+
+
+def _prescriptions(cohort):
+    cohort.prescription_count()
+    top10 = cohort.top_drugs(10)
+    cohort.drug_counts('admission_ward', top10.index.tolist())
+    return cohort.drug_counts('admission_way', top10.head(5).index.tolist())
+
+
+def _co_prescriptions(cohort):
+    pairs = cohort.co_prescriptions()
+    pairs[pairs['patients'] >= 20].sort_values('lift', ascending=False)
+    return cohort.polypharmacy()
+
+
+def _hospital(cohort):
+    cohort.share('admission_ward', ['Cardiology']), cohort.share('admission_way', ['Emergency'])
+    cohort.share('outcome_during_hospitalization', ['Alive']), cohort.median('dischargeDay')
+    cohort.select(['dischargeDay'])
+    cohort.binned_counts('dischargeDay', bins=[0, 7, 14, 21, 100], labels=['0-7d', '8-14d', '15-21d', '>21d'])
+    return cohort.crosstab('emergency_return_group', 'admission_ward')
+
+
+def _department_comparison(cohort):
+    return [cohort.outcome_rates(col, HF_COLUMNS[:1] + HF_COLUMNS[3:])
+            for col in ('admission_ward', 'discharge_department')]
+
+
+def _patient_flow(cohort):
+    return cohort.flow(['admission_way', 'admission_ward', 'discharge_department', 'DestinationDischarge'],
+                       min_count=20)
+
+
+def _cardiac(cohort):
+    cohort.share('NYHA_cardiac_function_classification', [3, 4]), cohort.share('congestive_heart_failure', [1])
+    cohort.share('Killip_grade', [3, 4]), cohort.share('comp_burden', [3])
+    cohort.value_counts('NYHA_cardiac_function_classification', sort='value')
+    cohort.outcome_rates('NYHA_cardiac_function_classification', ['death_within_28_days'])
+    cohort.crosstab('NYHA_cardiac_function_classification', 'Killip_grade')
+    cohort.value_counts('comp_burden', sort='value')
+    return cohort.outcome_rates('comp_burden', ['re_admission_within_6_months'])
+
+
+def _labs_gcs(cohort):
+    data = cohort.data
+    cohort.flag_share('high_lactate'), cohort.flag_share('low_sodium')
+    cohort.cells.groupby('hf_top3_score', observed=True)['patients'].sum()
+    for where in ({}, {'congestive_heart_failure': [1], 'Killip_grade': [3, 4]},
+                  {'myocardial_infarction': [1], 'congestive_heart_failure': [1]}):
+        data.cohort(where=where).kpis()
+    cohort.biomarker_rates()
+    cohort.value_counts('GCS_category')
+    return cohort.crosstab('GCS_category', 'admission_way', normalize='columns')
+
+
+def _score_sweep(cohort):
+    sweep = cohort.data.sweep
+    cutoffs = {rule.name: grid[len(grid) // 3] for rule, grid in zip(sweep.rules, sweep.grids)}
+    return cohort.score_outcomes(cutoffs)
+
+
+# Every resolution and split of the trends section
+def _trends(cohort):
+    return [cohort.trends(freq, by) for freq in ('week', 'month', '28d', '90d')
+            for by in (None, 'admission_ward', 'admission_way')]
+
+
+# Every endpoint per single stratification column, plus a 20+ stratum cross
+def _survival(cohort):
+    from hf_analytics.survival import ENDPOINTS, SURVIVAL_STRATA
+    curves = [cohort.survival(endpoint, by) for endpoint in ENDPOINTS for by in SURVIVAL_STRATA]
+    return curves + [cohort.survival('readmission', ['admission_ward', 'hf_top3_score', 'Killip_grade'])]
+
+
+# Every CI the dashboard draws, plus six outcome flags per discharge department
+def _intervals(method):
+    def workload(cohort):
+        cohort.outcome_intervals(None, HF_COLUMNS[:1] + HF_COLUMNS[3:4] + HF_COLUMNS[2:3], method=method)
+        for col in ('NYHA_cardiac_function_classification', 'GCS_category', 'hf_top3_score'):
+            cohort.outcome_intervals(col, ['death_within_28_days'], method=method)
+        cohort.outcome_intervals('admission_ward', HF_COLUMNS[:1] + HF_COLUMNS[3:], method=method)
+        return cohort.outcome_intervals('discharge_department', HF_COLUMNS, method=method)
+    return workload
+
+
+TAB_WORKLOADS = {
+    "kpis": _kpis,
+    "demographics": _demographics,
+    "prescriptions": _prescriptions,
+    "prescriptions.co_prescriptions": _co_prescriptions,
+    "hospital": _hospital,
+    "hospital.department_comparison": _department_comparison,
+    "hospital.patient_flow": _patient_flow,
+    "cardiac": _cardiac,
+    "labs_gcs": _labs_gcs,
+    "labs_gcs.score_sweep": _score_sweep,
+    "trends": _trends,
+    "survival": _survival,
+    "intervals.wilson": _intervals('wilson'),
+    "intervals.bootstrap": _intervals('bootstrap'),
+}
+
+# Analytics attributes built on first use, in dependency order
+BUILD_STEPS = {
+    "patient_table": "patients",
+    "filters": "filters",
+    "outcome_cube": "cube",
+    "threshold_index": "sweep",
+    "drug_matrix": "drugs",
+    "daily_counts": "daily",
+}
+
+
+def _time(fn, repeats, setup=None):
+    """Best and mean wall time of fn(setup()) over repeats runs."""
+    seconds = []
+    for _ in range(repeats):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg) if setup else fn()
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": round(min(seconds), 6), "mean": round(float(np.mean(seconds)), 6), "runs": repeats}
+
+
+def synthetic_dir(patients, seed=0):
+    return os.path.join(SYNTHETIC_DIR, f"{patients}-seed{seed}")
+
+
+def run_scale(patients, repeats=3, seed=0, source=DATA_PATH, progress=None, backend="pandas"):
+    """Time every step for one synthetic cohort size in this process. Returns a dict.
+
+    progress, if given, is called with {"start": step} before and the step's
+    timing (plus "step" and the process peak RSS) after each step.
+    """
+    from hf_analytics.analytics import Analytics
+    from hf_analytics.dtypes import compact_tables
+    from hf_analytics.ingest import _peak_rss_mb
+    from hf_analytics.synthetic import fit_model, write_synthetic
+
+    steps = {}
+
+    def record(step, fn, runs=repeats, setup=None):
+        if progress:
+            progress({"start": step})
+        steps[step] = _time(fn, runs, setup)
+        steps[step]["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        if progress:
+            progress({"step": step, **steps[step]})
+
+    out_dir = synthetic_dir(patients, seed)
+    if not all(os.path.exists(os.path.join(out_dir, f"{name}.parquet")) for name in SHEETS):
+        record("generate", lambda: write_synthetic(fit_model(load_tables(source)), patients, out_dir, seed=seed),
+               runs=1)
+
+    loaded = {}
+    if backend == "sql":
+        from hf_analytics.sqlbackend import SQLAnalytics, write_database
+
+        db_path = os.path.join(out_dir, "hf_analytics.duckdb")
+        record("build.duckdb", lambda: write_database(out_dir, db_path), runs=1)
+
+        def load_data():
+            loaded["data"] = SQLAnalytics.open(db_path)
+        record("load_data", load_data)
+        data = loaded["data"]
+    else:
+        def load_data():
+            loaded.clear()
+            loaded["tables"], loaded["report"] = compact_tables(read_sheets(out_dir))
+        record("load_data", load_data)
+        data = Analytics(loaded["tables"], loaded["report"])
+
+        for step, attr in BUILD_STEPS.items():
+            def build(attr=attr):
+                data.__dict__.pop(attr, None)
+                getattr(data, attr)
+            record(f"build.{step}", build)
+
+    def apply_filter():
+        cohort = data.cohort(**FILTER)
+        len(cohort), cohort.cells
+    record("filter", apply_filter)
+
+    # A fresh cohort per run so per-cohort aggregates are not reused across runs
+    for name, workload in TAB_WORKLOADS.items():
+        record(f"tab.{name}", workload, setup=lambda: data.cohort(**FILTER))
+
+    if backend == "sql":
+        rows, memory_mb = data.rows(), None
+    else:
+        rows = {name: len(df) for name, df in data.tables.items()}
+        memory_mb = float(data.memory_report["after_mb"].iloc[-1])
+    return {
+        "patients": patients,
+        "backend": backend,
+        "rows": rows,
+        "memory_mb": memory_mb,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "steps": steps,
+    }
+
+
+def _read_worker_output(stdout):
+    """(completed steps, step that started but never finished, final result or None)."""
+    steps, started, result = {}, None, None
+    for line in stdout.splitlines():
+        msg = json.loads(line)
+        if "start" in msg:
+            started = msg["start"]
+        elif "step" in msg:
+            steps[msg.pop("step")] = msg
+            started = None
+        elif "result" in msg:
+            result = msg["result"]
+    return steps, started, result
+
+
+def run_benchmark(scales=SCALES, repeats=3, seed=0, source=DATA_PATH, timeout=None, backend="pandas"):
+    """Run each scale in a child process; returns the results dict saved as JSON.
+
+    A scale that fails keeps the steps it finished and names the step it died in.
+    """
+    base = len(load_tables(source)["Demography"])
+    results = []
+    for scale in scales:
+        patients = int(round(scale * base))
+        entry = {"scale": scale, "patients": patients}
+        cmd = [sys.executable, "-m", "hf_analytics.benchmark", "--worker", str(patients),
+               "--repeats", str(repeats), "--seed", str(seed), "--source", source, "--backend", backend]
+        start = time.perf_counter()
+        try:
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+            stdout, returncode, stderr = proc.stdout, proc.returncode, proc.stderr
+        except subprocess.TimeoutExpired as e:
+            stdout, returncode, stderr = e.stdout or "", None, f"over {timeout} s"
+            if isinstance(stdout, bytes):
+                stdout = stdout.decode()
+        steps, failed_step, result = _read_worker_output(stdout)
+        if returncode == 0 and result is not None:
+            entry.update(status="ok", **result)
+        else:
+            # -9 is the kernel OOM killer on Linux
+            if returncode is None:
+                entry.update(status="timeout", error=stderr)
+            else:
+                killed = " (killed, likely out of memory)" if returncode == -9 else ""
+                entry.update(status="failed", error=f"exit {returncode}{killed}: {stderr[-1000:]}")
+            entry.update(steps=steps, failed_step=failed_step)
+        entry["wall_s"] = round(time.perf_counter() - start, 3)
+        results.append(entry)
+        failed = f" in {entry['failed_step']}" if entry.get("failed_step") else ""
+        print(f"{scale}x ({patients:,} patients): {entry['status']}{failed} after {entry['wall_s']} s", file=sys.stderr)
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "settings": {"repeats": repeats, "seed": seed, "filter": FILTER, "source": source, "backend": backend},
+        "scales": results,
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+# REPORTING
+def results_frame(results):
+    """Long frame: one row per scale and step with best-of-runs seconds."""
+    rows = []
+    for entry in results["scales"]:
+        for step, timing in entry.get("steps", {}).items():
+            rows.append({"scale": entry["scale"], "step": step, "seconds": timing["seconds"]})
+    return pd.DataFrame(rows, columns=["scale", "step", "seconds"])
+
+
+def summary(results):
+    """Steps x scales table of seconds, plus status and peak RSS rows."""
+    frame = results_frame(results)
+    table = frame.pivot(index="step", columns="scale", values="seconds")
+    table = table.reindex(list(dict.fromkeys(frame["step"])))
+    status = {e["scale"]: e["status"] + (f" ({e['failed_step']})" if e.get("failed_step") else "")
+              for e in results["scales"]}
+    peak = {e["scale"]: e.get("peak_rss_mb") for e in results["scales"]}
+    extra = pd.DataFrame([peak, status], index=["peak_rss_mb", "status"])
+    table = pd.concat([table.astype(object), extra])
+    table.columns = [f"{s}x" for s in table.columns]
+    return table
+
+
+def compare(old, new, ratio=REGRESSION_RATIO, noise=NOISE_S):
+    """Per scale and step: old and new seconds, new/old and whether it regressed."""
+    merged = results_frame(old).merge(results_frame(new), on=["scale", "step"], suffixes=("_old", "_new"))
+    merged["ratio"] = (merged["seconds_new"] / merged["seconds_old"]).round(2)
+    merged["regression"] = (merged["ratio"] > ratio) & (merged["seconds_new"] - merged["seconds_old"] > noise)
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard on synthetic cohorts")
+    parser.add_argument("--scales", type=float, nargs="+", default=SCALES, help="multiples of the workbook size")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--source", default=DATA_PATH, help="workbook the synthetic data is fitted on")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds allowed per scale")
+    parser.add_argument("--backend", choices=["pandas", "sql"], default="pandas",
+                        help="query backend (sql needs duckdb)")
+    parser.add_argument("--out", help="results JSON (default: benchmarks/benchmark-<time>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare against")
+    parser.add_argument("--worker", type=int, metavar="PATIENTS", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        def emit(msg):
+            print(json.dumps(msg), flush=True)
+        emit({"result": run_scale(args.worker, repeats=args.repeats, seed=args.seed, source=args.source,
+                                  progress=emit, backend=args.backend)})
+        sys.exit(0)
+
+    scales = [int(s) if float(s).is_integer() else s for s in args.scales]
+    results = run_benchmark(scales, repeats=args.repeats, seed=args.seed, source=args.source,
+                            timeout=args.timeout, backend=args.backend)
+    out = args.out or os.path.join(RESULTS_DIR, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(summary(results).to_string())
+    print(f"\nSaved {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            diff = compare(json.load(f), results)
+        print()
+        print(diff.to_string(index=False))
+        sys.exit(1 if diff["regression"].any() else 0)
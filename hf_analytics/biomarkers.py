@@ -0,0 +1,101 @@
+"""
+Biomarker threshold rules
+
+Lab abnormality thresholds live in one registry. All rules are evaluated
+against the Labs table in a single vectorized pass and packed into one integer
+bitmask per patient (bit i = BIOMARKER_RULES[i] abnormal). hf_top3_score, the
+High Lactate / Low Sodium cards and the biomarker heatmap all read that mask,
+so a new marker is one more Rule entry.
+
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+Rule = namedtuple("Rule", ["name", "column", "op", "threshold", "label", "in_score"])
+
+BIOMARKER_RULES = [
+    Rule('high_lactate', 'lactate', '>=', 2.0, 'Lactate', True),
+    Rule('low_sodium', 'sodium', '<', 135, 'Sodium', True),
+    Rule('high_troponin', 'high_sensitivity_troponin', '>', 0.04, 'High Sensitivity Troponin', True),
+    Rule('high_bnp', 'brain_natriuretic_peptide', '>', 100, 'BNP', False),
+    Rule('high_creatinine', 'creatinine_enzymatic_method', '>', 133, 'Creatinine', False),
+]
+
+FLAGS_COLUMN = 'biomarker_flags'
+
+_OPS = ('>=', '>', '<=', '<')
+
+
+def rule_bit(name, rules=BIOMARKER_RULES):
+    for i, rule in enumerate(rules):
+        if rule.name == name:
+            return i
+    raise KeyError(f"Unknown biomarker rule: {name}")
+
+
+def evaluate_rules(labs, rules=BIOMARKER_RULES):
+    """Packed abnormality bitmask (uint32) for every row of labs.
+
+    Rules whose column is missing never set their bit. Missing values compare
+    False, as in the original pandas comparisons.
+    """
+    if len(rules) > 32:
+        raise ValueError("At most 32 biomarker rules fit in the bitmask")
+    present = [i for i, r in enumerate(rules) if r.column in labs.columns]
+    if not present:
+        return np.zeros(len(labs), dtype=np.uint32)
+
+    values = labs[[rules[i].column for i in present]].to_numpy(dtype=float, na_value=np.nan)
+    thresholds = np.array([rules[i].threshold for i in present], dtype=float)
+    ops = np.array([_OPS.index(rules[i].op) for i in present])
+
+    # Flip '<'/'<=' rules to '>'/'>=' on negated values, then two comparisons
+    # over the whole (patients x rules) matrix cover every operator
+    sign = np.where(ops >= 2, -1.0, 1.0)
+    signed = values * sign
+    cut = thresholds * sign
+    inclusive = (ops % 2) == 0
+    with np.errstate(invalid='ignore'):
+        abnormal = np.where(inclusive, signed >= cut, signed > cut)
+
+    weights = np.left_shift(np.uint32(1), np.array(present, dtype=np.uint32))
+    return abnormal.astype(np.uint32) @ weights
+
+
+def flag_matrix(flags, rules=BIOMARKER_RULES):
+    """(rows x rules) boolean matrix unpacked from a bitmask column."""
+    flags = np.asarray(flags, dtype=np.uint32)
+    return ((flags[:, None] >> np.arange(len(rules), dtype=np.uint32)) & 1).astype(bool)
+
+
+def has_flag(flags, name, rules=BIOMARKER_RULES):
+    """Boolean array: rule `name` is abnormal."""
+    return (np.asarray(flags, dtype=np.uint32) >> np.uint32(rule_bit(name, rules))) & 1 == 1
+
+
+def score_from_flags(flags, rules=BIOMARKER_RULES):
+    """Number of abnormal score rules (the hf_top3_score)."""
+    score_bits = [i for i, r in enumerate(rules) if r.in_score]
+    return flag_matrix(flags, rules)[:, score_bits].sum(axis=1)
+
+
+def abnormal_rates(flags, groups, rules=BIOMARKER_RULES, columns=None):
+    """% abnormal per rule for each named boolean group mask.
+
+    Returns a frame indexed by rule label with one column per group; empty
+    groups give 0. With `columns`, rules on other columns are left out.
+    """
+    matrix = flag_matrix(flags, rules)
+    data = {}
+    for group, mask in groups.items():
+        mask = np.asarray(mask, dtype=bool)
+        n = mask.sum()
+        data[group] = matrix[mask].sum(axis=0) / n * 100 if n > 0 else np.zeros(len(rules))
+    rates = pd.DataFrame(data, index=pd.Index([r.label for r in rules], name='Biomarker'))
+    if columns is not None:
+        rates = rates[[r.column in columns for r in rules]]
+    return rates
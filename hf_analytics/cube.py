@@ -0,0 +1,104 @@
+"""
+Pre-aggregated outcome-rate cube
+
+Patients and outcome-flag sums for every observed combination of the cohort
+dimensions. KPIs and rate charts sum cube cells, so their cost follows the
+number of cells rather than the number of patients.
+
+"""
+
+import pandas as pd
+
+
+CUBE_DIMS = [
+    'gender',
+    'ageCat',
+    'admission_ward',
+    'admission_way',
+    'NYHA_cardiac_function_classification',
+    'Killip_grade',
+    'GCS_category',
+    'hf_top3_score',
+]
+
+OUTCOME_FLAGS = [
+    'death_within_28_days',
+    're_admission_within_28_days',
+    'death_within_3_months',
+    're_admission_within_3_months',
+    'death_within_6_months',
+    're_admission_within_6_months',
+]
+
+
+def build_outcome_cube(patients, dims=CUBE_DIMS, flags=OUTCOME_FLAGS):
+    """One row per observed dimension combination with 'patients' and flag sums.
+
+    Missing dimension values get their own cells so totals still cover every patient.
+    """
+    dims = [d for d in dims if d in patients.columns]
+    flags = [f for f in flags if f in patients.columns]
+    frame = patients[dims + flags].assign(patients=1)
+    cube = (frame.groupby(dims, dropna=False, observed=True, sort=False)[['patients'] + flags]
+            .sum()
+            .reset_index())
+    return cube
+
+
+def merge_cubes(cube, delta, dims=CUBE_DIMS):
+    """Cells of cube plus delta (a cube over more patients), summed where they coincide.
+
+    Cost follows the number of cells. Cells keep the order of first appearance,
+    as in a cube built over both sets of patients at once.
+    """
+    dims = [d for d in dims if d in cube.columns]
+    merged = pd.concat([cube, delta], ignore_index=True)
+    return merged.groupby(dims, dropna=False, observed=True, sort=False).sum().reset_index()
+
+
+def select_cells(cube, genders=None, wards=None, where=None):
+    """Cube cells for the sidebar selection plus optional {dimension: values}.
+    Empty selections do not filter."""
+    keep = pd.Series(True, index=cube.index)
+    if genders:
+        keep &= cube['gender'].isin(genders)
+    if wards:
+        keep &= cube['admission_ward'].isin(wards)
+    for dim, values in (where or {}).items():
+        keep &= cube[dim].isin(values)
+    return cube[keep]
+
+
+def cell_totals(cells, flags=OUTCOME_FLAGS):
+    """Patients and flag sums over a set of cells, as a Series."""
+    return cells[['patients'] + [f for f in flags if f in cells.columns]].sum()
+
+
+def grouped_rates(frame, by, outcomes=OUTCOME_FLAGS, weight=None):
+    """Counts and outcome rates (%) for any grouping in one grouped pass.
+
+    frame is either patient rows (each row counts once) or cube cells with the
+    row count in the `weight` column. Returns columns [*by, 'patients', *outcomes]
+    with outcomes as percentages of 'patients'; missing group keys are dropped.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    outcomes = [c for c in outcomes if c in frame.columns]
+    if weight is None:
+        frame = frame[keys + outcomes].assign(patients=1)
+        weight = 'patients'
+    grouped = frame.groupby(by, observed=True)[[weight] + outcomes].sum()
+    rates = grouped[outcomes].div(grouped[weight], axis=0) * 100
+    counts = grouped[[weight]].rename(columns={weight: 'patients'})
+    return pd.concat([counts, rates], axis=1).reset_index()
+
+
+def cell_rates(cells, by, flags=OUTCOME_FLAGS):
+    """Outcome rates (%) by cube dimension(s): columns [*by, 'patients', *flags]."""
+    return grouped_rates(cells, by, flags, weight='patients')
+
+
+def value_share(cells, by, value):
+    """(patients with by == value, % of patients in cells)."""
+    total = cells['patients'].sum()
+    count = cells.loc[cells[by] == value, 'patients'].sum()
+    return int(count), (count / total * 100 if total else 0)
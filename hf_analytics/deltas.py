@@ -0,0 +1,288 @@
+"""
+Append-only delta batches of new admissions
+
+A batch is a directory under data/deltas holding rows for new patients, one
+<sheet>.csv or <sheet>.parquet per sheet (sheets without new rows can be left
+out; columns missing from a file are left empty). Batches are applied in name
+order, so name them by date (data/deltas/2024-06-01/Demography.csv, ...).
+
+ingest_deltas() reads only the pending batches: their rows are aligned to the
+cached schema, derived columns are computed for them alone and they are
+written as Parquet parts next to the cache entry, which read_cache() appends
+after the base sheets. Analytics.append() then extends the loaded patient
+table, cube, filter bitmaps, threshold index and drug matrix with the new
+patients, and the DuckDB database INSERTs the parts through its open
+connection, so a refresh costs about as much as the delta. In shared mode
+(hf_analytics.shared) the batches are appended the same way, but the new
+snapshot is then written out whole, which grows with the data. When the workbook
+itself changes, the cache is rebuilt and every batch is applied again on top
+of it.
+
+    python -m hf_analytics.deltas            # ingest pending batches, compare with a full rebuild
+
+"""
+
+import argparse
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.loader import (CACHE_DIR, DATA_PATH, DERIVED_COLUMNS, SHEETS, _write_manifest, add_derived_columns,
+                                 cache_status, delta_parts, load_tables, read_sheets)
+from hf_analytics.patients import PATIENT_SHEETS
+from hf_analytics.profiling import span
+
+
+DELTA_DIR = "data/deltas"
+FORMATS = (".parquet", ".csv")
+
+
+def list_batches(delta_dir=DELTA_DIR):
+    """Batch directory names under delta_dir, in the order they are applied."""
+    if not os.path.isdir(delta_dir):
+        return []
+    return sorted(d for d in os.listdir(delta_dir)
+                  if os.path.isdir(os.path.join(delta_dir, d)) and not d.startswith("."))
+
+
+def applied_batches(manifest):
+    return [d["batch"] for d in manifest.get("deltas", [])]
+
+
+def pending_batches(manifest, delta_dir=DELTA_DIR):
+    """Batches in delta_dir that the cache entry does not have yet."""
+    applied = set(applied_batches(manifest))
+    return [b for b in list_batches(delta_dir) if b not in applied]
+
+
+def _read_file(batch_dir, sheet):
+    for ext in FORMATS:
+        path = os.path.join(batch_dir, sheet + ext)
+        if os.path.exists(path):
+            return pd.read_parquet(path) if ext == ".parquet" else pd.read_csv(path)
+    return None
+
+
+def _conform(df, base, sheet, skip=()):
+    """df with base's columns in base's order: missing columns empty with base's
+    dtype (except those in skip), numbers and dates parsed like the cached sheet."""
+    extra = [c for c in df.columns if c not in base.columns]
+    if extra:
+        raise ValueError(f"{sheet}: columns not in the cached sheet: {extra}")
+    if "inpatient_number" not in df.columns:
+        raise ValueError(f"{sheet}: inpatient_number is required")
+    columns = {}
+    for col in base.columns:
+        if col not in df.columns:
+            if col not in skip:
+                columns[col] = base[col].reindex(df.index)
+            continue
+        s, kind = df[col], base[col].dtype.kind
+        if kind == "M":
+            s = pd.to_datetime(s)
+        elif kind in "iufb":
+            s = pd.to_numeric(s)
+        columns[col] = s
+    return pd.DataFrame(columns, index=df.index)
+
+
+def read_batch(batch_dir, schemas, emergency_return_max=None):
+    """{sheet: DataFrame} for one batch, shaped like the cached sheets (empty
+    frames for sheets the batch has no file for) with derived columns computed
+    over the batch's rows only."""
+    tables = {}
+    for name in SHEETS:
+        df = _read_file(batch_dir, name)
+        if df is None:
+            df = pd.DataFrame({"inpatient_number": pd.Series([], dtype=schemas[name]["inpatient_number"].dtype)})
+        tables[name] = _conform(df.reset_index(drop=True), schemas[name], name, skip=DERIVED_COLUMNS.get(name, ()))
+    tables = add_derived_columns(tables, emergency_return_max=emergency_return_max)
+    return {name: _conform(tables[name], schemas[name], name) for name in SHEETS}
+
+
+def check_batch(tables, known_ids, batch):
+    """Raise ValueError unless the batch only adds new patients: Demography ids
+    are new and unique, and every other row belongs to one of them."""
+    ids = tables["Demography"]["inpatient_number"]
+    if ids.duplicated().any() or (known_ids.get_indexer(ids) >= 0).any():
+        raise ValueError(f"Batch {batch}: Demography rows must be new patients (inpatient_number already loaded)")
+    new = pd.Index(ids)
+    for name in SHEETS[1:]:
+        rows = tables[name]["inpatient_number"]
+        if (new.get_indexer(rows) < 0).any():
+            raise ValueError(f"Batch {batch}: {name} has rows for patients not in the batch's Demography")
+        if name in PATIENT_SHEETS and rows.duplicated().any():
+            raise ValueError(f"Batch {batch}: {name} has more than one row per patient")
+
+
+def ingest_deltas(file_path=DATA_PATH, cache_dir=CACHE_DIR, delta_dir=DELTA_DIR):
+    """Add every pending batch to the workbook's cache entry (building the entry
+    if needed). Returns {batch: tables} for the batches added, in order."""
+    manifest, fresh = cache_status(file_path, cache_dir)
+    if not fresh:
+        load_tables(file_path, cache_dir)
+        manifest, fresh = cache_status(file_path, cache_dir)
+    if not fresh:
+        raise RuntimeError(f"No Parquet cache for {file_path} to append delta batches to")
+    pending = pending_batches(manifest, delta_dir)
+    if not pending:
+        return {}
+
+    import pyarrow.parquet as pq
+
+    entry = os.path.join(cache_dir, manifest["key"])
+    schemas = {name: pq.read_schema(os.path.join(entry, f"{name}.parquet")).empty_table().to_pandas()
+               for name in SHEETS}
+    parts = ["", *delta_parts(manifest)]
+    known_ids = pd.Index(pd.concat([pd.read_parquet(os.path.join(entry, part, "Demography.parquet"),
+                                                    columns=["inpatient_number"])["inpatient_number"]
+                                    for part in parts], ignore_index=True))
+    derived = manifest.setdefault("derived", {})
+    if "emergency_return_max" not in derived:
+        # Manifests written before delta support: take it from the base sheet
+        hosdis = pd.read_parquet(os.path.join(entry, "Hospitalization_Discharge.parquet"),
+                                 columns=["time_to_emergency_department_within_6_months"])
+        value = hosdis.iloc[:, 0].max()
+        derived["emergency_return_max"] = None if pd.isna(value) else float(value)
+
+    added = {}
+    for batch in pending:
+        with span(f"delta:{batch}") as s:
+            tables = read_batch(os.path.join(delta_dir, batch), schemas, derived["emergency_return_max"])
+            check_batch(tables, known_ids, batch)
+            part = os.path.join(entry, "deltas", batch)
+            tmp = part + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for name in SHEETS:
+                tables[name].to_parquet(os.path.join(tmp, f"{name}.parquet"), index=False)
+            # Left over from an ingest that stopped before updating the manifest
+            shutil.rmtree(part, ignore_errors=True)
+            os.replace(tmp, part)
+
+            value = tables["Hospitalization_Discharge"]["time_to_emergency_department_within_6_months"].max()
+            if not pd.isna(value):
+                current = derived["emergency_return_max"]
+                derived["emergency_return_max"] = float(value) if current is None else max(current, float(value))
+            known_ids = known_ids.append(pd.Index(tables["Demography"]["inpatient_number"]))
+            manifest.setdefault("deltas", []).append(
+                {"batch": batch, "sheets": {name: len(tables[name]) for name in SHEETS}})
+            _write_manifest(cache_dir, manifest)
+            added[batch] = tables
+            s.set(rows=sum(len(df) for df in tables.values()))
+    return added
+
+
+class LiveData:
+    """Loaded data that picks up new delta batches; one instance is shared across sessions.
+
+    load() returns an Analytics or SQLAnalytics. current() costs a directory
+    listing while nothing is pending; new batches are ingested under a lock,
+    appended to Analytics, or inserted into the database in one transaction.
+    The new data replaces the old only once it is complete; a failure leaves
+    the old in place.
+    """
+
+    def __init__(self, load, file_path=DATA_PATH, cache_dir=CACHE_DIR, delta_dir=DELTA_DIR):
+        self._load = load
+        self.file_path, self.cache_dir, self.delta_dir = file_path, cache_dir, delta_dir
+        self._lock = threading.Lock()
+        self.data = load()
+        manifest, _ = cache_status(file_path, cache_dir)
+        self.batches = applied_batches(manifest or {})
+
+    def current(self):
+        if all(b in self.batches for b in list_batches(self.delta_dir)):
+            return self.data
+        with self._lock:
+            added = ingest_deltas(self.file_path, self.cache_dir, self.delta_dir)
+            manifest, _ = cache_status(self.file_path, self.cache_dir)
+            batches = applied_batches(manifest)
+            if batches[:len(self.batches)] != self.batches:
+                # The cache entry was rebuilt underneath us (new workbook)
+                self._swap(self._reload(), batches)
+            elif len(batches) > len(self.batches):
+                self._swap(refresh(self.data, batches[len(self.batches):], added, self.file_path, self.cache_dir),
+                           batches)
+            return self.data
+
+    def _reload(self):
+        from hf_analytics.sqlbackend import SQLAnalytics
+
+        if isinstance(self.data, SQLAnalytics):
+            # DuckDB hands back the open (stale) instance for a path it already has open
+            return self.data.refreshed(self.file_path, self.cache_dir)
+        return self._load()
+
+    def _swap(self, data, batches):
+        old, self.data, self.batches = self.data, data, batches
+        con = getattr(old, 'con', None)
+        if con is not None and con is not getattr(data, 'con', None):
+            # SQL backend rebuilt into a new file: close the old one only once the new one is in place
+            con.close()
+
+
+def refresh(data, batches, tables=None, file_path=DATA_PATH, cache_dir=CACHE_DIR):
+    """data with the given (already ingested) batches applied. tables optionally
+    holds {batch: tables} from ingest_deltas(); other batches are read from the
+    cache entry."""
+    from hf_analytics.sqlbackend import SQLAnalytics
+
+    if isinstance(data, SQLAnalytics):
+        # One transaction on data's connection; data sees the old rows until it commits
+        return data.refreshed(file_path, cache_dir)
+
+    tables = tables or {}
+    manifest, _ = cache_status(file_path, cache_dir)
+    for batch in batches:
+        if batch not in tables:
+            tables[batch] = read_sheets(os.path.join(cache_dir, manifest["key"], "deltas", batch))
+
+    if getattr(data, 'snapshot', False):
+        # Shared mode: the first process appends the batches to the tables,
+        # patient table and structures it maps and writes the new snapshot;
+        # every process maps it
+        def build():
+            appended = data
+            for batch in batches:
+                with span(f"append:{batch}"):
+                    appended = appended.append(tables[batch])
+            return appended
+
+        refreshed = type(data).shared(file_path, cache_dir, build)
+        refreshed.version = data.version + 1
+        return refreshed
+
+    for batch in batches:
+        with span(f"append:{batch}"):
+            data = data.append(tables[batch])
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest pending delta batches and check them against a full rebuild")
+    parser.add_argument("--source", default=DATA_PATH, help="workbook the batches extend")
+    parser.add_argument("--deltas", default=DELTA_DIR)
+    args = parser.parse_args()
+
+    from hf_analytics.analytics import Analytics
+
+    data = Analytics.load(args.source)
+    data.patients, data.filters, data.cube, data.sweep, data.drugs
+    start = time.perf_counter()
+    added = ingest_deltas(args.source, delta_dir=args.deltas)
+    for tables in added.values():
+        data = data.append(tables)
+    print(f"Appended {len(added)} batch(es) in {time.perf_counter() - start:.2f} s: "
+          f"{', '.join(added) or 'none pending'}")
+
+    full = Analytics.load(args.source)
+    for name, kwargs in [("all", {}), ("female ICU", {"genders": ["Female"], "wards": ["ICU"]})]:
+        a, b = data.cohort(**kwargs), full.cohort(**kwargs)
+        ka, kb = a.kpis(), b.kpis()
+        print(f"{name}: {len(a)} patients, kpis match: {all(np.isclose(ka[k], kb[k], equal_nan=True) for k in ka)}, "
+              f"top drugs match: {a.top_drugs(10).equals(b.top_drugs(10))}")
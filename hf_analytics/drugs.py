@@ -0,0 +1,131 @@
+"""
+Sparse patient x drug matrix
+
+Patient_Precriptions is the longest table in the workbook. It is encoded once
+into a CSR matrix whose rows follow the patient table order (the same order
+as the filter bitmaps) and whose columns are the dictionary-encoded drug
+names; each entry is the number of prescription rows. Per-cohort drug
+queries are then row slices by the filter mask plus sparse products, instead
+of groupby/crosstab over the long table on every rerun.
+
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class DrugMatrix:
+    """CSR prescriptions matrix: patients (in `patient_ids` order) x drugs."""
+
+    def __init__(self, prescriptions, patient_ids, drug_col='Drug_name'):
+        self.ids = np.asarray(patient_ids)
+        codes, vocab = pd.factorize(prescriptions[drug_col], sort=True)
+        rows = pd.Index(self.ids).get_indexer(prescriptions['inpatient_number'])
+        keep = (rows >= 0) & (codes >= 0)
+        self.drugs = pd.Index(np.asarray(vocab), name=drug_col)
+        self.X = sparse.csr_matrix(
+            (np.ones(int(keep.sum()), dtype=np.int64), (rows[keep], codes[keep])),
+            shape=(len(self.ids), len(vocab)),
+        )
+        self.X.sum_duplicates()
+
+    def append(self, prescriptions, patient_ids):
+        """Matrix over this matrix's patients followed by patient_ids (new patients
+        only), with prescriptions holding their rows.
+
+        Drugs seen for the first time join the sorted vocabulary; existing entries
+        only have their column numbers remapped.
+        """
+        other = DrugMatrix(prescriptions, patient_ids, self.drugs.name)
+        drugs = self.drugs.union(other.drugs)
+
+        def widen(m):
+            cols = drugs.get_indexer(m.drugs)[m.X.indices]
+            return sparse.csr_matrix((m.X.data, cols, m.X.indptr), shape=(m.X.shape[0], len(drugs)))
+
+        merged = copy.copy(self)
+        merged.ids = np.concatenate([self.ids, other.ids])
+        merged.drugs = drugs
+        merged.X = sparse.vstack([widen(self), widen(other)], format='csr')
+        return merged
+
+    def _rows(self, mask):
+        return np.arange(len(self.ids)) if mask is None else np.flatnonzero(mask)
+
+    def prescriptions(self, mask=None):
+        """Number of prescription rows for the patients in mask."""
+        return int(self.X[self._rows(mask)].sum())
+
+    def patients_per_drug(self, mask=None):
+        """Unique patients per drug (drugs nobody in mask takes are left out)."""
+        counts = self.X[self._rows(mask)].getnnz(axis=0)
+        per_drug = pd.Series(counts, index=self.drugs, name='patients')
+        return per_drug[per_drug > 0]
+
+    def top_drugs(self, n, mask=None):
+        """The n drugs with the most unique patients, largest first (ties by name)."""
+        return self.patients_per_drug(mask).sort_values(ascending=False, kind='stable').head(n)
+
+    def group_counts(self, groups, mask=None, drugs=None):
+        """Prescription rows per drug and patient group, like pd.crosstab(drug, group).
+
+        groups holds one value per patient in matrix row order (e.g. a patient
+        table column). Patients with a missing group are left out; rows and
+        columns are sorted and all-zero ones dropped.
+        """
+        rows = self._rows(mask)
+        codes, uniques = pd.factorize(np.asarray(groups)[rows], sort=True)
+        keep = np.flatnonzero(codes >= 0)
+        # groups x patients indicator, so indicator @ X sums prescriptions per group
+        indicator = sparse.csr_matrix(
+            (np.ones(len(keep), dtype=np.int64), (codes[keep], keep)),
+            shape=(len(uniques), len(rows)),
+        )
+        X = self.X[rows]
+        if drugs is None:
+            cols = np.arange(len(self.drugs))
+        else:
+            cols = np.sort(self.drugs.get_indexer(drugs))
+            cols = cols[cols >= 0]
+        counts = (indicator @ X[:, cols]).toarray().T
+        name = getattr(groups, 'name', None)
+        table = pd.DataFrame(counts, index=self.drugs[cols], columns=pd.Index(uniques, name=name))
+        table = table.loc[table.sum(axis=1) > 0, table.sum(axis=0) > 0]
+        return table
+
+    def drugs_per_patient(self, mask=None):
+        """Distinct drugs per patient in mask, indexed by inpatient_number."""
+        rows = self._rows(mask)
+        return pd.Series(self.X[rows].getnnz(axis=1), index=pd.Index(self.ids[rows], name='inpatient_number'),
+                         name='drug_count')
+
+    def co_prescriptions(self, mask=None, min_patients=1):
+        """Drug pairs taken by the same patients, from the sparse product B.T @ B.
+
+        B is the 0/1 patient x drug matrix over mask, so (B.T @ B)[i, j] is the
+        number of patients on both drugs and the diagonal the patients per drug;
+        no self-join of the long table. Returns one row per pair with at least
+        min_patients shared patients, sorted by drug names: 'patients', 'support' (% of cohort
+        patients with a prescription), 'lift' and 'jaccard'.
+        """
+        B = self.X[self._rows(mask)]
+        B = (B > 0).astype(np.int64)
+        n = int((B.getnnz(axis=1) > 0).sum())
+        C = sparse.triu(B.T @ B, k=1).tocoo()
+        keep = C.data >= min_patients
+        # Pairs in (drug_a, drug_b) name order, so ties rank the same on every run
+        order = np.lexsort((C.col[keep], C.row[keep]))
+        i, j, both = C.row[keep][order], C.col[keep][order], C.data[keep][order]
+        per_drug = np.asarray(B.sum(axis=0)).ravel()
+        n_i, n_j = per_drug[i], per_drug[j]
+        return pd.DataFrame({
+            'drug_a': self.drugs[i],
+            'drug_b': self.drugs[j],
+            'patients': both,
+            'support': both / n * 100 if n else np.nan,
+            'lift': both * n / (n_i * n_j),
+            'jaccard': both / (n_i + n_j - both),
+        })
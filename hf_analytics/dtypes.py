@@ -0,0 +1,155 @@
+"""
+Schema-driven dtype compaction
+
+Excel gives every string column object/str dtype and every number int64 or
+float64. compact_tables() narrows each column once after loading:
+low-cardinality strings become categoricals (isin/groupby/crosstab then work
+on integer codes), integers take the smallest width that holds their range,
+floats drop to float32 only where that is lossless, and 0/1 outcome flags
+become nullable booleans. Columns listed in SCHEMA get that dtype; the rest
+are inferred. The per-table memory report bounds what each session holds.
+
+    python -m hf_analytics.dtypes data/Cardiacfailure_cleaned.xlsx
+
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.cube import OUTCOME_FLAGS
+from hf_analytics.loader import DATA_PATH, load_tables
+
+
+# Explicit dtypes; None keeps the column as loaded
+SCHEMA = {
+    'inpatient_number': 'int32',
+    **{flag: 'boolean' for flag in OUTCOME_FLAGS},
+    'return_to_emergency_department_within_6_months': 'boolean',
+    'biomarker_flags': None,
+    'Admission_date': None,
+}
+
+# Strings become categoricals when distinct values are at most this share of rows
+CATEGORY_MAX_RATIO = 0.5
+
+
+def _infer(s):
+    """Compact dtype for a column not in SCHEMA (None = leave as is)."""
+    kind = s.dtype.kind
+    if kind in 'OU' or pd.api.types.is_string_dtype(s.dtype):
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            return None
+        n = s.nunique()
+        return 'category' if 0 < n <= max(1, CATEGORY_MAX_RATIO * len(s)) else None
+    if kind in 'iu':
+        return pd.to_numeric(s, downcast='unsigned' if kind == 'u' else 'integer').dtype
+    if kind == 'f':
+        values = s.to_numpy()
+        narrow = values.astype(np.float32)
+        return np.float32 if np.array_equal(narrow.astype(values.dtype), values, equal_nan=True) else None
+    return None
+
+
+def compact_frame(df, schema=SCHEMA):
+    """Copy of df with every column narrowed per schema, then inference."""
+    columns = {}
+    for col in df.columns:
+        s = df[col]
+        target = schema[col] if col in schema else _infer(s)
+        columns[col] = s if target is None or s.dtype == target else s.astype(target)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _common(a, b):
+    """a and b cast to one dtype: categories are unioned (sorted unless ordered),
+    anything else takes the dtype pandas would give their concatenation."""
+    if isinstance(a.dtype, pd.CategoricalDtype):
+        new = pd.Index(b.dropna().unique())
+        if a.dtype.ordered:
+            if not new.isin(a.cat.categories).all():
+                raise ValueError(f"{a.name}: values outside the ordered categories {list(a.cat.categories)}")
+            dtype = a.dtype
+        else:
+            dtype = pd.CategoricalDtype(a.cat.categories.union(new.astype(a.cat.categories.dtype, copy=False)))
+    elif isinstance(b.dtype, pd.CategoricalDtype):
+        dtype = pd.concat([a.iloc[:0], b.iloc[:0].astype(b.cat.categories.dtype)]).dtype
+    else:
+        dtype = pd.concat([a.iloc[:0], b.iloc[:0]]).dtype
+    return (a if a.dtype == dtype else a.astype(dtype)), (b if b.dtype == dtype else b.astype(dtype))
+
+
+def append_rows(df, rows, schema=SCHEMA, compact=True):
+    """Return (df with rows appended, rows as appended).
+
+    rows are compacted on their own (when compact) and then cast per column to a
+    dtype that holds both sides, so df's compact dtypes survive unless the new
+    values do not fit them. Nothing is re-inferred over df's rows. A RangeIndex
+    continues; any other index (e.g. the patient table's) is kept as is.
+    """
+    rows = rows[list(df.columns)]
+    if compact:
+        rows = compact_frame(rows, schema)
+    old, new = {}, {}
+    for col in df.columns:
+        old[col], new[col] = _common(df[col], rows[col])
+    old, new = pd.DataFrame(old, index=df.index), pd.DataFrame(new, index=rows.index)
+    if isinstance(df.index, pd.RangeIndex):
+        new.index = pd.RangeIndex(df.index.stop, df.index.stop + len(rows))
+    return pd.concat([old, new]), new
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def compact_tables(tables, schema=SCHEMA):
+    """Compact every table. Returns ({name: DataFrame}, report) where report
+    has rows, columns and deep memory before/after per table plus a 'TOTAL' row."""
+    compacted, rows = {}, []
+    for name, df in tables.items():
+        compacted[name] = compact_frame(df, schema)
+        rows.append({
+            "table": name,
+            "rows": len(df),
+            "columns": df.shape[1],
+            "before_mb": memory_mb(df),
+            "after_mb": memory_mb(compacted[name]),
+        })
+    report = pd.DataFrame(rows)
+    report = pd.concat([report, pd.DataFrame([{
+        "table": "TOTAL",
+        "rows": int(report["rows"].sum()),
+        "columns": int(report["columns"].sum()),
+        "before_mb": report["before_mb"].sum(),
+        "after_mb": report["after_mb"].sum(),
+    }])], ignore_index=True)
+    report["saved_pct"] = (1 - report["after_mb"] / report["before_mb"]) * 100
+    return compacted, report.round({"before_mb": 3, "after_mb": 3, "saved_pct": 1})
+
+
+def append_tables(tables, rows, report=None, schema=SCHEMA, compact=True):
+    """append_rows() for every table. Returns (tables, rows as appended, report)
+    with the memory report's row counts and sizes updated."""
+    combined, appended = {}, {}
+    for name, df in tables.items():
+        combined[name], appended[name] = append_rows(df, rows[name], schema, compact)
+    if report is not None:
+        report = report.set_index("table")
+        for name in tables:
+            report.loc[name, "rows"] = len(combined[name])
+            report.loc[name, "before_mb"] += memory_mb(rows[name])
+            report.loc[name, "after_mb"] = round(memory_mb(combined[name]), 3)
+        body = report.drop(index="TOTAL")
+        report.loc["TOTAL", ["rows", "before_mb", "after_mb"]] = [body["rows"].sum(), body["before_mb"].sum(),
+                                                                 body["after_mb"].sum()]
+        report["saved_pct"] = (1 - report["after_mb"] / report["before_mb"]) * 100
+        report = report.reset_index().round({"before_mb": 3, "after_mb": 3, "saved_pct": 1})
+    return combined, appended, report
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DATA_PATH
+    _, report = compact_tables(load_tables(path))
+    print(report.to_string(index=False))
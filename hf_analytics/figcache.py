@@ -0,0 +1,74 @@
+"""
+Plotly figure cache keyed by cohort signature
+
+Figures are stored as serialized JSON under (chart id, cohort signature) with
+LRU eviction once the stored JSON exceeds a byte budget. A hit skips both the
+pandas work and the Plotly figure construction inside the builder.
+
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def cohort_signature(**state):
+    """Stable short hash of the filter state (any JSON-serialisable values)."""
+    payload = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class FigureCache:
+    """Thread-safe LRU of figure JSON, shared across Streamlit sessions."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, chart_id, signature, build):
+        """Return the cached figure for (chart_id, signature), calling build() on a miss."""
+        import plotly.io as pio
+
+        key = (chart_id, signature)
+        with self._lock:
+            fig_json = self._entries.get(key)
+            if fig_json is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if fig_json is not None:
+            return pio.from_json(fig_json)
+
+        fig = build()
+        # Stored encoded, so sizes (and max_bytes) are in bytes, not characters
+        fig_json = fig.to_json().encode()
+        size = len(fig_json)
+        with self._lock:
+            self.misses += 1
+            if size <= self.max_bytes:
+                if key in self._entries:
+                    self._bytes -= len(self._entries.pop(key))
+                self._entries[key] = fig_json
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+        return fig
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "figures": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
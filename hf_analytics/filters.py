@@ -0,0 +1,119 @@
+"""
+Precomputed bitmap filter engine for the sidebar filters
+
+At load time every gender, ward and age value gets a packed bitmap over the
+shared patient order (the patient table index). A filter combination is then a
+few bitwise OR/AND operations on packed bytes, and each table is cut with one
+positional take instead of an isin() over patient ids.
+
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+# Sidebar dimension -> patient table column
+FILTER_COLUMNS = {
+    "age": "age",
+    "gender": "gender",
+    "ward": "admission_ward",
+}
+
+# Dimensions whose values are ordered and selected as a range
+RANGE_DIMS = {"age"}
+
+
+class FilterEngine:
+    """Packed per-value bitmaps aligned to the patient order of `patients`.
+
+    patients is the wide table from build_patient_table(); tables maps a name to
+    any frame with an inpatient_number column that should be cut by the filter.
+    """
+
+    def __init__(self, patients, tables):
+        self.ids = patients.index.to_numpy()
+        self.n = len(self.ids)
+        self.values = {}
+        self.bitmaps = {}
+        self.known = {}
+        for dim, col in FILTER_COLUMNS.items():
+            if col not in patients.columns:
+                continue
+            codes, uniques = pd.factorize(patients[col], sort=dim in RANGE_DIMS)
+            if len(uniques) == 0:
+                continue
+            self.values[dim] = list(uniques)
+            self.bitmaps[dim] = np.stack([np.packbits(codes == i) for i in range(len(uniques))])
+            self.known[dim] = np.packbits(codes >= 0)
+
+        # Row -> patient position for every table; -1 for patients not in the table
+        position = pd.Index(self.ids)
+        self.row_pos = {name: position.get_indexer(df['inpatient_number']) for name, df in tables.items()}
+
+    def append(self, patients, tables):
+        """Engine over this engine's patients followed by `patients` (new patients only).
+
+        tables holds the rows appended to each registered table. The new patients
+        get bitmaps of their own, which are then spliced onto the existing ones, so
+        no existing value is re-encoded.
+        """
+        other = FilterEngine(patients, tables)
+        merged = copy.copy(self)
+        merged.ids = np.concatenate([self.ids, other.ids])
+        merged.n = self.n + other.n
+        merged.values, merged.bitmaps, merged.known = {}, {}, {}
+        for dim in FILTER_COLUMNS:
+            old, new = self.values.get(dim, []), other.values.get(dim, [])
+            if not old and not new:
+                continue
+            values = old + [v for v in new if v not in set(old)]
+            if dim in RANGE_DIMS:
+                values = sorted(values)
+            merged.values[dim] = values
+            merged.bitmaps[dim] = np.stack([
+                np.packbits(np.concatenate([self._bits(dim, v), other._bits(dim, v)])) for v in values])
+            merged.known[dim] = np.packbits(np.concatenate([self._bits(dim), other._bits(dim)]))
+        merged.row_pos = {name: np.concatenate([pos, np.where(other.row_pos[name] >= 0,
+                                                              other.row_pos[name] + self.n, -1)])
+                          for name, pos in self.row_pos.items()}
+        return merged
+
+    def _bits(self, dim, value=None):
+        """Unpacked bitmap of one value of dim (any known value when value is None)."""
+        if dim not in self.values or (value is not None and value not in self.values[dim]):
+            return np.zeros(self.n, dtype=bool)
+        packed = self.known[dim] if value is None else self.bitmaps[dim][self.values[dim].index(value)]
+        return np.unpackbits(packed, count=self.n).view(bool)
+
+    def _select(self, dim, selected):
+        values = self.values[dim]
+        if dim in RANGE_DIMS:
+            lo, hi = selected
+            idx = [i for i, v in enumerate(values) if lo <= v <= hi]
+        else:
+            wanted = set(selected)
+            idx = [i for i, v in enumerate(values) if v in wanted]
+        if len(idx) == len(values):
+            return self.known[dim]
+        if not idx:
+            return np.zeros_like(self.known[dim])
+        return np.bitwise_or.reduce(self.bitmaps[dim][idx], axis=0)
+
+    def mask(self, age_range=None, genders=None, wards=None):
+        """Boolean mask over the patient order. Empty/None selections do not filter,
+        except age, which (like the slider comparison) always drops missing ages."""
+        packed = np.packbits(np.ones(self.n, dtype=bool))
+        for dim, selected in (("age", age_range), ("gender", genders), ("ward", wards)):
+            if dim in self.bitmaps and selected is not None and len(selected) > 0:
+                packed &= self._select(dim, selected)
+        return np.unpackbits(packed, count=self.n).view(bool)
+
+    def take(self, name, df, mask):
+        """Rows of df (registered as `name`) whose patient is in mask, in original order."""
+        keep = np.append(mask, False)[self.row_pos[name]]
+        return df.take(np.flatnonzero(keep))
+
+    def patients(self, mask):
+        return self.ids[mask]
@@ -0,0 +1,98 @@
+"""
+Multi-stage patient flow (Sankey) engine
+
+Every stage column is factorized to integer codes and offset into one shared
+node numbering, so each hop between consecutive stages becomes an array of
+(source node, target node) pairs. Link counts for all hops come from a single
+bincount over the flattened pair ids; nothing iterates over patient rows.
+
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+Flow = namedtuple("Flow", ["labels", "stages", "source", "target", "value"])
+
+OTHER_LABEL = 'Other (small links)'
+
+
+def _encode(frame, stages, missing):
+    """Per-stage codes (-1 for missing) and value labels, in order of appearance."""
+    codes, labels = [], []
+    for col in stages:
+        values = frame[col]
+        if missing is not None:
+            values = values.astype(object).where(values.notna(), missing)
+        c, uniques = pd.factorize(values, sort=False)
+        codes.append(c.astype(np.int64))
+        labels.append([str(u) for u in uniques])
+    return codes, labels
+
+
+def _collapse(codes, labels, min_count, weights=None):
+    """Send patients on links smaller than min_count to an 'Other' node of the target stage.
+
+    Works hop by hop so collapsed patients continue downstream from 'Other'.
+    """
+    for h in range(1, len(codes)):
+        src, tgt = codes[h - 1], codes[h]
+        n_src, n_tgt = len(labels[h - 1]), len(labels[h])
+        valid = (src >= 0) & (tgt >= 0)
+        pair = np.where(valid, src * n_tgt + tgt, 0)
+        counts = np.bincount(pair[valid], weights=None if weights is None else weights[valid],
+                             minlength=n_src * n_tgt)
+        small = valid & (counts[pair] < min_count)
+        if small.any():
+            if OTHER_LABEL in labels[h]:
+                other = labels[h].index(OTHER_LABEL)
+            else:
+                other = len(labels[h])
+                labels[h] = labels[h] + [OTHER_LABEL]
+            codes[h] = np.where(small, other, tgt)
+    return codes, labels
+
+
+def build_flow(frame, stages, min_count=0, missing=None, weight=None):
+    """Link counts between consecutive stage columns of frame.
+
+    stages is an ordered list of columns; each stage gets its own nodes, so the
+    same value in two stages is two nodes. Rows missing either side of a hop
+    skip that hop, unless `missing` gives a label to show them under. Links with
+    fewer than min_count patients are collapsed into an 'Other' node. With
+    `weight`, each row stands for that column's number of patients (e.g. rows
+    pre-grouped by stage values).
+    Returns a Flow of node labels, the stage of each node and the non-empty
+    links as source/target node ids and counts.
+    """
+    if len(stages) < 2:
+        raise ValueError("A flow needs at least two stages")
+    codes, labels = _encode(frame, stages, missing)
+    weights = None if weight is None else frame[weight].to_numpy(dtype=np.float64)
+    if min_count > 0:
+        codes, labels = _collapse(codes, labels, min_count, weights)
+
+    sizes = np.array([len(l) for l in labels], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    n_nodes = int(sizes.sum())
+
+    # All hops stacked: one (source node, target node) id per row and hop
+    src = np.concatenate([np.where(codes[h] >= 0, codes[h] + offsets[h], -1) for h in range(len(codes) - 1)])
+    tgt = np.concatenate([np.where(codes[h] >= 0, codes[h] + offsets[h], -1) for h in range(1, len(codes))])
+    valid = (src >= 0) & (tgt >= 0)
+    hop_weights = None if weights is None else np.tile(weights, len(codes) - 1)[valid]
+    counts = np.bincount(src[valid] * n_nodes + tgt[valid], weights=hop_weights, minlength=n_nodes * n_nodes)
+    if weights is not None:
+        counts = np.rint(counts).astype(np.int64)
+
+    link = np.flatnonzero(counts)
+    node_stage = np.repeat(np.arange(len(stages)), sizes)
+    return Flow(
+        labels=[l for stage_labels in labels for l in stage_labels],
+        stages=[stages[s] for s in node_stage],
+        source=link // n_nodes,
+        target=link % n_nodes,
+        value=counts[link],
+    )
@@ -0,0 +1,225 @@
+"""
+Parallel, memory-bounded Excel ingestion
+
+Each sheet is parsed in its own worker process, so ingestion time follows the
+largest sheet instead of the sum of all seven. Workers stream rows with
+openpyxl in read-only mode (or use python-calamine when it is installed),
+keep only the projected columns and build the DataFrame in chunks.
+
+    python -m hf_analytics.ingest data/Cardiacfailure_cleaned.xlsx
+    python -m hf_analytics.ingest --columns Labs=lactate,sodium --workers 1
+
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from hf_analytics.loader import DATA_PATH, SHEETS, projected_columns
+
+
+CHUNK_ROWS = 50_000
+
+# Strings pd.read_excel treats as missing by default
+NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+
+def calamine_available():
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Sheets read_sheet() has parsed in this process
+_sheets_read = 0
+
+
+def _peak_rss_mb():
+    """Peak RSS over the life of this process."""
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS the kernel reports as VmHWM (Linux); whether it could."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _hwm_rss_mb():
+    """Peak RSS since the last _reset_peak_rss() (Linux), else None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _read_openpyxl(file_path, sheet, columns=None, chunk_rows=CHUNK_ROWS):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        while header and header[-1] is None:
+            header.pop()
+        if columns is None:
+            keep = list(range(len(header)))
+        else:
+            wanted = set(columns)
+            keep = [i for i, name in enumerate(header) if name in wanted]
+        names = [header[i] for i in keep]
+
+        chunks, buf = [], []
+        for row in rows:
+            values = tuple(row[i] if i < len(row) else None for i in keep)
+            if all(v is None for v in values):
+                continue
+            buf.append(values)
+            if len(buf) >= chunk_rows:
+                chunks.append(pd.DataFrame.from_records(buf, columns=names))
+                buf = []
+        if buf or not chunks:
+            chunks.append(pd.DataFrame.from_records(buf, columns=names))
+    finally:
+        wb.close()
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+    # Match pd.read_excel: NA markers become missing, then re-infer the dtype
+    for col in df.columns:
+        values = df[col]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+            continue
+        na = values.map(lambda v: isinstance(v, str) and v in NA_STRINGS).astype(bool)
+        if na.all() or values.isna().all():
+            df[col] = pd.Series(float("nan"), index=df.index)
+        elif na.any():
+            df[col] = values.mask(na).infer_objects()
+    return df
+
+
+def _read_calamine(file_path, sheet, columns=None):
+    usecols = None
+    if columns is not None:
+        wanted = set(columns)
+        usecols = lambda name: name in wanted  # noqa: E731
+    return pd.read_excel(file_path, sheet_name=sheet, engine="calamine", usecols=usecols)
+
+
+def read_sheet(file_path, sheet, columns=None, engine="auto"):
+    """Parse one sheet and return (DataFrame, stats). Runs inside a worker process,
+    or in the caller's for a serial ingest.
+
+    columns projects the sheet (inpatient_number is always kept). The stats'
+    peak RSS is this sheet's own: the kernel's peak is reset first where that is
+    possible (Linux), else the process peak is only reported for the first
+    sheet a process reads (None after that).
+    """
+    global _sheets_read
+    if engine == "auto":
+        engine = "calamine" if calamine_available() else "openpyxl"
+    columns = projected_columns({sheet: columns}, sheet)
+    reset = _reset_peak_rss()
+    start = time.perf_counter()
+    if engine == "calamine":
+        df = _read_calamine(file_path, sheet, columns)
+    else:
+        df = _read_openpyxl(file_path, sheet, columns)
+    if reset:
+        peak = _hwm_rss_mb()
+    else:
+        # Without a reset, earlier sheets in this process would show up in the peak
+        peak = _peak_rss_mb() if _sheets_read == 0 else None
+    _sheets_read += 1
+    stats = {
+        "sheet": sheet,
+        "engine": engine,
+        "rows": len(df),
+        "columns": df.shape[1],
+        "seconds": round(time.perf_counter() - start, 4),
+        "peak_rss_mb": None if peak is None else round(peak, 1),
+        "pid": os.getpid(),
+    }
+    return df, stats
+
+
+def _read_sheet_task(args):
+    return read_sheet(*args)
+
+
+def ingest_workbook(file_path=DATA_PATH, sheets=None, columns=None, max_workers=None, engine="auto"):
+    """Parse sheets concurrently in a process pool.
+
+    columns maps a sheet name to the columns to keep (inpatient_number is always
+    kept); sheets without an entry are read in full. Returns ({sheet: DataFrame},
+    report) where report has one row per sheet with timing and the peak RSS
+    while parsing it (see read_sheet()), plus a 'TOTAL' row with the wall time
+    of the whole ingestion and the highest peak of any process involved.
+    """
+    sheets = list(sheets or SHEETS)
+    columns = columns or {}
+    if max_workers is None:
+        max_workers = min(len(sheets), os.cpu_count() or 1)
+
+    start = time.perf_counter()
+    tasks = [(file_path, sheet, columns.get(sheet), engine) for sheet in sheets]
+    if max_workers <= 1:
+        results = [_read_sheet_task(t) for t in tasks]
+    else:
+        # One sheet per worker process so peak RSS is per sheet and memory is
+        # returned to the OS as soon as the sheet has been shipped back
+        pool_kwargs = {"max_workers": max_workers}
+        if sys.version_info >= (3, 11):
+            pool_kwargs["max_tasks_per_child"] = 1
+        with ProcessPoolExecutor(**pool_kwargs) as pool:
+            results = list(pool.map(_read_sheet_task, tasks))
+    wall = time.perf_counter() - start
+
+    tables = {stats["sheet"]: df for df, stats in results}
+    report = pd.DataFrame([stats for _, stats in results])
+    report = pd.concat([report, pd.DataFrame([{
+        "sheet": "TOTAL",
+        "engine": engine,
+        "rows": int(report["rows"].sum()),
+        "columns": int(report["columns"].sum()),
+        "seconds": round(wall, 4),
+        "peak_rss_mb": round(max(report["peak_rss_mb"].max(skipna=True), _peak_rss_mb()), 1),
+        "pid": os.getpid(),
+    }])], ignore_index=True)
+    return tables, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse the workbook's sheets in parallel and report time and peak RSS")
+    parser.add_argument("path", nargs="?", default=DATA_PATH)
+    parser.add_argument("--columns", action="append", default=[], metavar="SHEET=COL,COL",
+                        help="read only these columns of a sheet (repeatable)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (1 parses serially)")
+    parser.add_argument("--engine", default="auto", choices=["auto", "openpyxl", "calamine"])
+    args = parser.parse_args()
+
+    columns = {}
+    for spec in args.columns:
+        sheet, _, names = spec.partition("=")
+        columns[sheet] = [c for c in names.split(",") if c]
+    _, report = ingest_workbook(args.path, columns=columns, max_workers=args.workers, engine=args.engine)
+    print(report.to_string(index=False))
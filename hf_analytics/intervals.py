@@ -0,0 +1,145 @@
+"""
+Confidence intervals for outcome rates
+
+wilson_rates() adds closed-form Wilson score intervals to a grouped_rates()
+frame from its counts alone. bootstrap_rates() resamples patient rows: every
+replicate redraws each group's rows from within that group (so group sizes
+stay fixed), and all replicates, groups and outcome columns are drawn as one
+integer index matrix over the rows. Rows are first reduced to their distinct
+(group, outcome values) patterns, so a replicate is a bincount over pattern
+ids and the per-group sums one matrix product, with no Python loop over
+groups. Replicates are processed in chunks to bound memory on large cohorts.
+Intervals are percentages, in `<outcome>_lo` / `<outcome>_hi` columns.
+
+    from hf_analytics.intervals import bootstrap_rates
+    bootstrap_rates(patients, 'admission_ward', ['death_within_28_days'])
+
+"""
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.cube import grouped_rates
+
+
+LEVEL = 0.95
+BOOTSTRAP_SAMPLES = 1000
+# Upper bound on index matrix entries drawn at once (replicates x rows)
+CHUNK_CELLS = 4_000_000
+
+
+def wilson_interval(events, n, level=LEVEL):
+    """(lo, hi) proportions of the Wilson score interval; NaN where n is 0."""
+    events, n = np.asarray(events, dtype=float), np.asarray(n, dtype=float)
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = events / n
+        denom = 1 + z * z / n
+        centre = (p + z * z / (2 * n)) / denom
+        half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return np.clip(centre - half, 0, 1), np.clip(centre + half, 0, 1)
+
+
+def risk_ratio_interval(events1, n1, events0, n0, level=LEVEL):
+    """(ratio, lo, hi) of the risk ratio p1 / p0 with the Katz log interval; NaN
+    where either group has no events."""
+    events1, n1, events0, n0 = (np.asarray(x, dtype=float) for x in (events1, n1, events0, n0))
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = (events1 / n1) / (events0 / n0)
+        se = np.sqrt(1 / events1 - 1 / n1 + 1 / events0 - 1 / n0)
+        valid = (events1 > 0) & (events0 > 0)
+        ratio = np.where(valid, ratio, np.nan)
+        return ratio, np.where(valid, ratio * np.exp(-z * se), np.nan), np.where(valid, ratio * np.exp(z * se), np.nan)
+
+
+def two_proportion_p(events1, n1, events0, n0):
+    """Two-sided p-value of the pooled two-proportion z-test of p1 == p0; NaN
+    where a group is empty or no group has (or lacks) events."""
+    events1, n1, events0, n0 = (float(x) for x in (events1, n1, events0, n0))
+    if not n1 or not n0:
+        return np.nan
+    pooled = (events1 + events0) / (n1 + n0)
+    se = np.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n0))
+    if not se:
+        return np.nan
+    z = (events1 / n1 - events0 / n0) / se
+    return 2 * NormalDist().cdf(-abs(z))
+
+
+def wilson_rates(rates, outcomes, level=LEVEL):
+    """rates (patients and outcome rates in %, as from grouped_rates()) with Wilson bounds added."""
+    out = rates.copy()
+    n = rates['patients'].to_numpy(dtype=float)
+    for col in outcomes:
+        events = np.rint(rates[col].to_numpy(dtype=float) * n / 100)
+        lo, hi = wilson_interval(events, n, level)
+        out[f'{col}_lo'], out[f'{col}_hi'] = lo * 100, hi * 100
+    return out
+
+
+def bootstrap_means(codes, values, n_groups, n_boot=BOOTSTRAP_SAMPLES, seed=0, chunk_cells=CHUNK_CELLS):
+    """Group means of values over stratified resamples: an array (n_boot, n_groups, K).
+
+    codes holds each row's group (-1 leaves the row out), values is (rows, K);
+    missing values count as 0, as in grouped_rates().
+    """
+    codes = np.asarray(codes)
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    if values.ndim == 1:
+        values = values[:, None]
+    keep = codes >= 0
+    codes, values = codes[keep], values[keep]
+    if not len(codes):
+        return np.full((n_boot, n_groups, values.shape[1]), np.nan)
+    order = np.argsort(codes, kind='stable')
+    codes, values = codes[order], values[order]
+    n, k = values.shape
+    sizes = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(sizes) - sizes
+
+    # Rows with the same group and outcome values are interchangeable
+    patterns, pattern_of = np.unique(np.column_stack([codes, values]), axis=0, return_inverse=True)
+    pattern_of = pattern_of.ravel()
+    n_patterns = len(patterns)
+    # (patterns, groups * K): each pattern's outcome values in its group's slots
+    weights = np.zeros((n_patterns, n_groups, k))
+    weights[np.arange(n_patterns), patterns[:, 0].astype(np.intp)] = patterns[:, 1:]
+    weights = weights.reshape(n_patterns, n_groups * k)
+
+    rng = np.random.default_rng(seed)
+    sums = np.empty((n_boot, n_groups * k))
+    step = max(1, chunk_cells // max(n, 1))
+    row_start, row_size = starts[codes], sizes[codes]
+    for b0 in range(0, n_boot, step):
+        b = min(step, n_boot - b0)
+        # Index matrix: replicate x row -> a row drawn from the same group
+        idx = row_start + (rng.random((b, n)) * row_size).astype(np.intp)
+        flat = (np.arange(b)[:, None] * n_patterns + pattern_of[idx]).ravel()
+        counts = np.bincount(flat, minlength=b * n_patterns).reshape(b, n_patterns)
+        sums[b0:b0 + b] = counts @ weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums.reshape(n_boot, n_groups, k) / sizes[None, :, None]
+
+
+def bootstrap_rates(frame, by, outcomes, level=LEVEL, n_boot=BOOTSTRAP_SAMPLES, seed=0):
+    """grouped_rates() of patient rows plus percentile bootstrap bounds.
+
+    by=None treats the rows as one group (a single-row result without a key column).
+    """
+    outcomes = [c for c in outcomes if c in frame.columns]
+    if by is None:
+        rates = frame[outcomes].fillna(0).mean().mul(100).to_frame().T
+        rates.insert(0, 'patients', len(frame))
+        codes = np.zeros(len(frame), dtype=np.intp)
+    else:
+        rates = grouped_rates(frame, by, outcomes)
+        codes = pd.Index(np.asarray(rates[by], dtype=object)).get_indexer(np.asarray(frame[by], dtype=object))
+    means = bootstrap_means(codes, frame[outcomes].to_numpy(dtype=float, na_value=np.nan), len(rates),
+                            n_boot, seed)
+    lo, hi = np.percentile(means, [50 - level * 50, 50 + level * 50], axis=0) * 100
+    for i, col in enumerate(outcomes):
+        rates[f'{col}_lo'], rates[f'{col}_hi'] = lo[:, i], hi[:, i]
+    return rates
@@ -0,0 +1,295 @@
+"""
+Workbook loading, derived columns and the columnar on-disk cache
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import warnings
+
+import pandas as pd
+
+from hf_analytics.biomarkers import FLAGS_COLUMN, evaluate_rules, score_from_flags
+
+
+DATA_PATH = "data/Cardiacfailure_cleaned.xlsx"
+CACHE_DIR = "data/.cache"
+
+# Bump when add_derived_columns() changes so stale caches are rebuilt
+CACHE_VERSION = 2
+
+# "serial" parses sheets one after another through pd.ExcelFile,
+# "parallel" uses the process-pool engine in hf_analytics.ingest
+INGEST_MODE = os.environ.get("HF_INGEST", "serial")
+
+# Sheet names in the order load_data() returns them
+SHEETS = [
+    "Demography",
+    "Hospitalization_Discharge",
+    "CardiacComplications",
+    "Labs",
+    "PatientHistory",
+    "Responsivenes",
+    "Patient_Precriptions",
+]
+
+# Columns add_derived_columns() can compute, per sheet. GCS_category, ageCat and
+# hf_top3_score are only computed when the sheet does not already have them
+DERIVED_COLUMNS = {
+    "Demography": ["ageCat"],
+    "Hospitalization_Discharge": ["emergency_return_group"],
+    "Labs": [FLAGS_COLUMN, "hf_top3_score"],
+    "Responsivenes": ["GCS_category"],
+}
+
+
+def projected_columns(columns, sheet):
+    """Columns to read from sheet under a {sheet: columns} projection, with
+    inpatient_number first; None when the sheet is read in full."""
+    if not columns or columns.get(sheet) is None:
+        return None
+    return ["inpatient_number"] + [c for c in columns[sheet] if c != "inpatient_number"]
+
+
+def gcs_category(gcs):
+    if gcs == 15:
+        return 'Normal'
+    elif gcs >= 13:
+        return 'Low-Risk'
+    else:
+        return 'High-Risk'
+
+
+def add_derived_columns(tables, emergency_return_max=None):
+    """Add GCS_category, ageCat, emergency_return_group, biomarker_flags and
+    hf_top3_score to the frames in tables.
+
+    Every column is computed row by row except emergency_return_group, whose top
+    bin ends at the largest return time; for delta rows pass the largest value
+    seen so far as emergency_return_max.
+    """
+    Demog = tables["Demography"]
+    HosDis = tables["Hospitalization_Discharge"]
+    Labs = tables["Labs"]
+    Respons = tables["Responsivenes"]
+
+    # Create GCS_category in Respons if not present
+    if 'GCS_category' not in Respons.columns and 'GCS' in Respons.columns:
+        Respons['GCS_category'] = Respons['GCS'].apply(gcs_category)
+
+    # Create age categories in Demog if not present
+    if 'ageCat' not in Demog.columns and 'age' in Demog.columns:
+        Demog['ageCat'] = pd.cut(Demog['age'], bins=[0,29,39,49,59,69,79,89,100],
+                                 labels=['21-29','29-39','39-49','49-59','59-69','69-79','79-89','89+'])
+
+    # Create emergency_return_group in HosDis
+    if 'time_to_emergency_department_within_6_months' in HosDis.columns:
+        max_value = HosDis['time_to_emergency_department_within_6_months'].max()
+        if emergency_return_max is not None:
+            max_value = emergency_return_max if pd.isna(max_value) else max(max_value, emergency_return_max)
+        bins = [0, 7, 30, 90, max_value]
+        labels = ['<7 days', '8–30 days', '31–90 days', '90+ days']
+        HosDis['emergency_return_group'] = pd.cut(HosDis['time_to_emergency_department_within_6_months'],
+                                                  bins=bins, labels=labels, include_lowest=True)
+
+    # Packed abnormality bits for every rule in biomarkers.BIOMARKER_RULES.
+    # read_excel gives the 100+ Labs columns one block each; consolidate first
+    Labs = tables["Labs"] = Labs.copy()
+    Labs[FLAGS_COLUMN] = evaluate_rules(Labs)
+
+    # Create hf_top3_score in Labs if not present
+    if 'hf_top3_score' not in Labs.columns:
+        if all(c in Labs.columns for c in ['lactate', 'sodium', 'high_sensitivity_troponin']):
+            Labs['hf_top3_score'] = score_from_flags(Labs[FLAGS_COLUMN])
+    return tables
+
+
+def read_workbook(file_path=DATA_PATH, mode=None, columns=None):
+    """Parse every sheet of the workbook and add the derived columns.
+
+    columns optionally projects sheets ({sheet: columns}; derived columns are
+    only added where their inputs were read). Returns (tables, report). report
+    is the per-sheet timing/peak RSS frame from the parallel engine, or None in
+    serial mode.
+    """
+    mode = mode or INGEST_MODE
+    if mode == "parallel":
+        from hf_analytics.ingest import ingest_workbook
+        tables, report = ingest_workbook(file_path, columns=columns)
+    else:
+        xls = pd.ExcelFile(file_path)
+        tables = {}
+        for name in SHEETS:
+            wanted = projected_columns(columns, name)
+            usecols = None if wanted is None else set(wanted).__contains__
+            tables[name] = pd.read_excel(xls, name, usecols=usecols)
+        report = None
+    return add_derived_columns(tables), report
+
+
+# COLUMNAR CACHE
+def file_digest(file_path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _manifest_path(cache_dir):
+    return os.path.join(cache_dir, "manifest.json")
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(_manifest_path(cache_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(cache_dir, manifest):
+    tmp = _manifest_path(cache_dir) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, _manifest_path(cache_dir))
+
+
+def _cache_entry(cache_dir, manifest):
+    return os.path.join(cache_dir, manifest["key"])
+
+
+def cache_status(file_path=DATA_PATH, cache_dir=CACHE_DIR):
+    """Return (manifest, fresh) for the cached copy of file_path.
+
+    The modification time and size are checked first so a warm start never
+    hashes the workbook. If they changed, the content hash decides: a touched
+    but identical workbook keeps its cache and only the manifest is updated.
+    """
+    manifest = _read_manifest(cache_dir)
+    if manifest is None or manifest.get("version") != CACHE_VERSION:
+        return manifest, False
+    if not all(os.path.exists(os.path.join(_cache_entry(cache_dir, manifest), f"{name}.parquet"))
+               for name in SHEETS):
+        return manifest, False
+
+    stat = os.stat(file_path)
+    if manifest["mtime_ns"] == stat.st_mtime_ns and manifest["size"] == stat.st_size:
+        return manifest, True
+
+    if manifest["sha256"] == file_digest(file_path):
+        manifest.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        _write_manifest(cache_dir, manifest)
+        return manifest, True
+    return manifest, False
+
+
+def read_sheets(directory, parts=(), columns=None):
+    """{sheet: DataFrame} from a directory holding one <sheet>.parquet per sheet.
+
+    parts are subdirectories (relative to directory) with more rows in the same
+    layout, appended in order. columns optionally projects sheets ({sheet:
+    columns}; names a sheet does not have are ignored).
+    """
+    tables = {}
+    for name in SHEETS:
+        paths = [os.path.join(directory, part, f"{name}.parquet") for part in ("", *parts)]
+        wanted = projected_columns(columns, name)
+        if wanted is not None:
+            import pyarrow.parquet as pq
+
+            present = set(pq.read_schema(paths[0]).names)
+            wanted = [c for c in wanted if c in present]
+        frames = [pd.read_parquet(path, columns=wanted) for path in paths]
+        tables[name] = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return tables
+
+
+def delta_parts(manifest):
+    """Subdirectories of a cache entry holding the delta batches applied to it, in order."""
+    return [os.path.join("deltas", d["batch"]) for d in manifest.get("deltas", [])]
+
+
+def read_cache(manifest, cache_dir=CACHE_DIR, columns=None):
+    if columns:
+        # Derived columns come with a projected sheet, as when it is parsed
+        columns = {sheet: [*cols, *DERIVED_COLUMNS.get(sheet, [])] for sheet, cols in columns.items()}
+    return read_sheets(_cache_entry(cache_dir, manifest), delta_parts(manifest), columns)
+
+
+def _column_max(df, col):
+    value = df[col].max() if col in df.columns else None
+    return None if value is None or pd.isna(value) else float(value)
+
+
+def write_cache(tables, file_path=DATA_PATH, cache_dir=CACHE_DIR, report=None):
+    """Write every table to Parquet under a directory named after the workbook hash."""
+    stat = os.stat(file_path)
+    sha256 = file_digest(file_path)
+    key = f"{sha256[:16]}-v{CACHE_VERSION}"
+    entry = os.path.join(cache_dir, key)
+
+    tmp_entry = entry + ".tmp"
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.makedirs(tmp_entry)
+    for name in SHEETS:
+        tables[name].to_parquet(os.path.join(tmp_entry, f"{name}.parquet"), index=False)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp_entry, entry)
+
+    manifest = {
+        "version": CACHE_VERSION,
+        "key": key,
+        "source": os.path.abspath(file_path),
+        "sha256": sha256,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sheets": {name: len(tables[name]) for name in SHEETS},
+        # What delta batches need to derive their columns like a full load would
+        "derived": {"emergency_return_max": _column_max(tables["Hospitalization_Discharge"],
+                                                        "time_to_emergency_department_within_6_months")},
+        # Delta batches appended to this entry (hf_analytics.deltas)
+        "deltas": [],
+    }
+    if report is not None:
+        manifest["ingest"] = report.to_dict(orient="records")
+    _write_manifest(cache_dir, manifest)
+
+    # Drop entries left behind by earlier versions of the workbook
+    for old in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, old)
+        if old != key and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    return manifest
+
+
+def load_tables(file_path=DATA_PATH, cache_dir=CACHE_DIR, use_cache=True, mode=None, columns=None):
+    """Return {sheet name: DataFrame}, reading the Parquet cache when it is fresh.
+
+    On a miss the workbook is parsed (serially, or in parallel with
+    mode="parallel" / HF_INGEST=parallel), derived columns are added and the
+    cache is rebuilt. Cache failures (read-only disk, pyarrow missing) fall back to the
+    workbook so the dashboard still loads. columns optionally projects sheets
+    ({sheet: columns}, inpatient_number and derived columns kept): only those
+    columns are read from the cache, or parsed from the workbook on a miss, in
+    which case the cache is left as it is (it holds whole sheets).
+    """
+    if use_cache:
+        try:
+            manifest, fresh = cache_status(file_path, cache_dir)
+            if fresh:
+                return read_cache(manifest, cache_dir, columns)
+        except Exception as e:
+            warnings.warn(f"Ignoring unreadable data cache: {e}")
+
+    tables, report = read_workbook(file_path, mode=mode, columns=columns)
+
+    if use_cache and columns is None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_cache(tables, file_path, cache_dir, report=report)
+        except Exception as e:
+            warnings.warn(f"Could not write data cache: {e}")
+    return tables
@@ -0,0 +1,51 @@
+"""
+Patient-indexed fact table
+
+All one-row-per-patient sheets joined once on inpatient_number, so dashboard
+tabs select columns instead of re-merging on every rerun.
+
+"""
+
+import pandas as pd
+
+
+# One row per patient; Patient_Precriptions is long and stays separate
+PATIENT_SHEETS = [
+    "Demography",
+    "Hospitalization_Discharge",
+    "CardiacComplications",
+    "Labs",
+    "Responsivenes",
+    "PatientHistory",
+]
+
+
+def build_patient_table(tables, sheets=PATIENT_SHEETS):
+    """Join the per-patient sheets into one wide frame indexed by inpatient_number.
+
+    Demography fixes the patient order and the other sheets are left-joined on
+    the index. A column that appears in more than one sheet keeps the value from
+    the first sheet listed.
+    """
+    base, *others = sheets
+    wide = tables[base].set_index('inpatient_number', verify_integrity=True)
+    parts = [wide]
+    seen = set(wide.columns)
+    for name in others:
+        df = tables[name].set_index('inpatient_number', verify_integrity=True)
+        df = df[[c for c in df.columns if c not in seen]]
+        seen.update(df.columns)
+        parts.append(df.reindex(wide.index))
+    return pd.concat(parts, axis=1)
+
+
+def attach(frame, patients, columns):
+    """Return frame with patient-level columns looked up by inpatient_number.
+
+    Used for long tables such as prescriptions; an index lookup, not a merge.
+    """
+    looked_up = patients[columns].reindex(frame['inpatient_number'].to_numpy())
+    out = frame.copy()
+    for col in columns:
+        out[col] = looked_up[col].array
+    return out
@@ -0,0 +1,155 @@
+"""
+Opt-in timing spans for the dashboard's hot paths
+
+activate() installs a Profiler for the current script run (a context
+variable, so Streamlit sessions running in other threads are unaffected).
+Code marks work with `with span(name, rows=...)`; spans nest, record wall
+time, rows processed and, for cached calls, whether the cache hit. With no
+profiler active, span() returns one shared no-op object, so instrumented
+code pays a context-variable lookup and nothing else.
+
+    HF_PROFILE=1 streamlit run app.py        # or open the app with ?profile=1
+
+"""
+
+import contextvars
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+ENABLED = os.environ.get("HF_PROFILE", "") not in ("", "0")
+
+_current = contextvars.ContextVar("hf_profiler", default=None)
+
+
+class Span:
+    """One timed region: name, start/end (perf_counter seconds), nesting depth and args."""
+
+    __slots__ = ("profiler", "name", "args", "depth", "thread", "start", "end")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.depth = 0
+        self.thread = threading.get_ident()
+        self.start = self.end = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = self.profiler._stack
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.end = time.perf_counter()
+        self.profiler._stack.pop()
+        self.profiler.spans.append(self)
+        return False
+
+
+class _NullSpan:
+    """Stand-in returned while profiling is off."""
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Spans recorded during one script run, in the order they finished."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._stack = []
+
+    def span(self, name, rows=None, **args):
+        if rows is not None:
+            args["rows"] = rows
+        return Span(self, name, args)
+
+    def report(self):
+        """One row per span in start order with its nesting depth; times in ms."""
+        rows = []
+        for s in sorted(self.spans, key=lambda s: s.start):
+            rows.append({
+                "span": s.name,
+                "depth": s.depth,
+                "ms": round((s.end - s.start) * 1000, 2),
+                "start_ms": round((s.start - self.origin) * 1000, 2),
+                "rows": s.args.get("rows"),
+                "cache": s.args.get("cache"),
+            })
+        return pd.DataFrame(rows, columns=["span", "depth", "ms", "start_ms", "rows", "cache"])
+
+    def chrome_trace(self):
+        """Spans as Chrome trace events (load in chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "hf_analytics"}}]
+        for s in sorted(self.spans, key=lambda s: s.start):
+            events.append({
+                "name": s.name,
+                "cat": s.name.split(":", 1)[0],
+                "ph": "X",
+                "ts": round((s.start - self.origin) * 1e6, 3),
+                "dur": round((s.end - s.start) * 1e6, 3),
+                "pid": pid,
+                "tid": s.thread,
+                "args": {k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v)
+                         for k, v in s.args.items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def activate(enabled=ENABLED):
+    """Start a fresh Profiler for this run (or switch profiling off) and return it (or None)."""
+    profiler = Profiler() if enabled else None
+    _current.set(profiler)
+    return profiler
+
+
+def span(name, rows=None, **args):
+    """Timed region under the active profiler; a no-op without one.
+
+    Pass cache="hit" around a cached call whose body calls annotate(cache="miss").
+    """
+    profiler = _current.get()
+    if profiler is None:
+        return NULL_SPAN
+    return profiler.span(name, rows, **args)
+
+
+def annotate(**args):
+    """Set args on the innermost open span, if profiling."""
+    profiler = _current.get()
+    if profiler is not None and profiler._stack:
+        profiler._stack[-1].set(**args)
+
+
+def on_miss(build):
+    """build, wrapped to mark the innermost span a cache miss when it runs."""
+    if _current.get() is None:
+        return build
+
+    def wrapped(*args, **kwargs):
+        annotate(cache="miss")
+        return build(*args, **kwargs)
+    return wrapped
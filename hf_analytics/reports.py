@@ -0,0 +1,168 @@
+"""
+Headless cohort reports
+
+Evaluates the KPI tab's numbers (outcome rates, Score 3 share) plus median
+length of stay and High-Risk GCS share for every cohort in a definition file,
+without Streamlit, and writes JSON, CSV and static HTML. The data is loaded
+once in the parent; worker processes are forked from it and share that copy
+(on platforms without fork each worker loads it once).
+
+Definition file (JSON): explicit cohorts, each with any of age_range,
+genders, wards and where ({patient column: [values]}), plus `expand`
+columns that get one cohort per observed value:
+
+    {"cohorts": [{"name": "All patients"},
+                 {"name": "Female ICU", "genders": ["Female"], "wards": ["ICU"]}],
+     "expand": ["admission_ward", "ageCat", "admission_way"]}
+
+    python -m hf_analytics.reports data/cohorts.json --out-dir reports/weekly
+
+"""
+
+import argparse
+import datetime
+import html
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from hf_analytics.analytics import Analytics
+from hf_analytics.cube import value_share
+from hf_analytics.loader import DATA_PATH
+
+
+DEFINITIONS_PATH = "data/cohorts.json"
+FORMATS = ["json", "csv", "html"]
+
+# Set in the parent before the pool forks, or by _init_worker
+_DATA = None
+
+
+def load_definitions(path, patients):
+    """Cohort definitions from a JSON file, with `expand` columns turned into
+    one {"name", "where"} cohort per observed value."""
+    with open(path) as f:
+        spec = json.load(f)
+    cohorts = [dict(c) for c in spec.get("cohorts", [])]
+    for col in spec.get("expand", []):
+        if col not in patients.columns:
+            raise ValueError(f"Cannot expand {col!r}: not a patient column")
+        for value in sorted(patients[col].dropna().unique()):
+            value = value.item() if hasattr(value, "item") else value
+            cohorts.append({"name": f"{col} = {value}", "where": {col: [value]}})
+    for i, c in enumerate(cohorts):
+        c.setdefault("name", f"cohort {i + 1}")
+    return cohorts
+
+
+def cohort_metrics(data, definition):
+    """One report row: KPIs, median LOS and High-Risk GCS share for a cohort definition."""
+    cohort = data.cohort(
+        age_range=definition.get("age_range"),
+        genders=definition.get("genders"),
+        wards=definition.get("wards"),
+        where=definition.get("where"),
+    )
+    row = {"cohort": definition["name"], **cohort.kpis()}
+    if "dischargeDay" in cohort.patients.columns:
+        row["median_los_days"] = cohort.patients["dischargeDay"].median()
+    if "GCS_category" in cohort.cells.columns:
+        row["high_risk_gcs_patients"], row["high_risk_gcs_pct"] = value_share(cohort.cells, "GCS_category", "High-Risk")
+    return row
+
+
+def _init_worker(file_path):
+    global _DATA
+    if _DATA is None:
+        _DATA = Analytics.load(file_path)
+
+
+def _evaluate(definition):
+    return cohort_metrics(_DATA, definition)
+
+
+def build_report(definitions, file_path=DATA_PATH, max_workers=None):
+    """Evaluate every definition; returns a frame with one row per cohort, in order."""
+    global _DATA
+    if _DATA is None:
+        _DATA = Analytics.load(file_path)
+    # Build what every cohort needs once, before workers are forked
+    _DATA.patients, _DATA.filters, _DATA.cube
+
+    if max_workers is None:
+        max_workers = min(len(definitions), os.cpu_count() or 1)
+    if max_workers <= 1:
+        rows = [_evaluate(d) for d in definitions]
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        chunksize = max(1, len(definitions) // (max_workers * 4))
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(file_path,)) as pool:
+            rows = list(pool.map(_evaluate, definitions, chunksize=chunksize))
+    return pd.DataFrame(rows)
+
+
+# OUTPUT
+def _html(report, title, generated):
+    table = report.to_html(index=False, float_format=lambda v: f"{v:.1f}", na_rep="–", border=0)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{font-family: sans-serif; margin: 2rem; color: #222;}}
+table {{border-collapse: collapse; font-size: 0.9rem;}}
+th, td {{padding: 0.35rem 0.6rem; border-bottom: 1px solid #ddd; text-align: right;}}
+th {{background: #f3f6fa;}}
+td:first-child, th:first-child {{text-align: left;}}
+</style></head>
+<body><h1>{html.escape(title)}</h1><p>Generated {html.escape(generated)}. Rates in %.</p>
+{table}
+</body></html>
+"""
+
+
+def write_reports(report, out_dir, formats=FORMATS, title="Heart Failure Cohort Report", meta=None):
+    """Write the report as cohort_report.{json,csv,html} under out_dir; returns the paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    generated = datetime.datetime.now().isoformat(timespec="seconds")
+    paths = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f"cohort_report.{fmt}")
+        if fmt == "json":
+            payload = {"title": title, "generated": generated, **(meta or {}),
+                       "cohorts": json.loads(report.to_json(orient="records"))}
+            with open(path, "w") as f:
+                json.dump(payload, f, indent=2)
+        elif fmt == "csv":
+            report.to_csv(path, index=False)
+        elif fmt == "html":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(_html(report, title, generated))
+        else:
+            raise ValueError(f"Unknown report format {fmt!r}")
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cohort KPI reports without the dashboard")
+    parser.add_argument("definitions", nargs="?", default=DEFINITIONS_PATH, help="cohort definition JSON")
+    parser.add_argument("--source", default=DATA_PATH, help="workbook to load")
+    parser.add_argument("--out-dir", default="reports")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    _DATA = Analytics.load(args.source)
+    definitions = load_definitions(args.definitions, _DATA.patients)
+    report = build_report(definitions, args.source, max_workers=args.workers)
+    paths = write_reports(report, args.out_dir, args.formats,
+                          meta={"source": args.source, "definitions": args.definitions})
+    print(report.to_string(index=False))
+    print(f"\n{len(report)} cohorts in {time.perf_counter() - start:.2f} s -> {', '.join(paths)}", file=sys.stderr)
@@ -0,0 +1,263 @@
+"""
+Memory-mapped Arrow IPC snapshot shared across processes
+
+With HF_SHARED=1, the first process to load a cache entry writes the
+compacted tables and the wide patient table (derived columns included) as
+uncompressed Arrow IPC files under <entry>/shared-<batches>/. Every process
+then memory-maps those files read-only: columns become DataFrames without a
+copy, so their pages live once in the OS page cache whatever the number of
+Streamlit replicas or sessions, and a new worker only maps files instead of
+reading Parquet, compacting dtypes and joining the patient table. Floats are
+written with NaN as a value (not an Arrow null) so they map back as plain
+numpy arrays (categoricals keep their codes mapped too); boolean columns,
+bit-packed in Arrow, are the only ones copied.
+The derived structures (filter bitmaps, outcome cube, threshold index, drug
+matrix, daily counts) are built once by the same process and pickled into
+the snapshot with their arrays out of band, in one aligned structures.bin:
+other processes unpickle them over a read-only mapping of that file, so the
+arrays are views of shared pages too and nothing is built per process.
+When delta batches are applied, the first process appends them to the
+tables, patient table and structures it has mapped (delta-sized work, no
+re-reading or re-joining of earlier patients) and writes the result as a new snapshot,
+which every process then maps. Writing it is still a sequential write of
+every table, so unlike the in-memory append this part grows with the data.
+A superseded snapshot is kept for one more generation, for processes that
+resolved it just before the new one appeared, and removed after that
+(processes still holding it keep their mapping).
+
+    HF_SHARED=1 streamlit run app.py
+    python -m hf_analytics.shared --workers 4     # memory per worker, mapped vs loaded
+
+"""
+
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import shutil
+import time
+
+import pandas as pd
+
+from hf_analytics.dtypes import compact_tables
+from hf_analytics.loader import CACHE_DIR, DATA_PATH, SHEETS, _cache_entry, cache_status, load_tables, read_cache
+from hf_analytics.patients import build_patient_table
+from hf_analytics.profiling import span
+
+
+PATIENTS = "patients"
+MEMORY_REPORT = "memory_report"
+# Analytics structures written to the snapshot and mapped instead of built
+STRUCTURES = ("filters", "cube", "sweep", "drugs", "daily")
+# Byte alignment of each out-of-band array in structures.bin
+ALIGNMENT = 64
+# Times open_snapshot() resolves the snapshot again when the one it found was removed
+MAP_ATTEMPTS = 3
+
+
+def snapshot_dir(entry, manifest):
+    """Snapshot directory for a cache entry with its applied delta batches."""
+    return os.path.join(entry, f"shared-{len(manifest.get('deltas', []))}")
+
+
+def _to_arrow(df):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    # NaN stays a float value: a column without nulls maps back without a copy
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type) and table.column(i).null_count and field.name in df.columns:
+            values = pa.array(df[field.name].to_numpy(), type=field.type, from_pandas=False)
+            table = table.set_column(i, field, values)
+    return table.combine_chunks()
+
+
+def _write_structures(directory, structures):
+    """Pickle {name: object} to structures.pkl with every array buffer pickle
+    hands out of band written, aligned, to structures.bin; returns the
+    (offset, size) of each buffer."""
+    buffers = []
+    payload = pickle.dumps(structures, protocol=5, buffer_callback=buffers.append)
+    layout = []
+    with open(os.path.join(directory, "structures.bin"), "wb") as f:
+        for buffer in buffers:
+            raw = buffer.raw()
+            f.write(b"\0" * (-f.tell() % ALIGNMENT))
+            layout.append((f.tell(), raw.nbytes))
+            f.write(raw)
+    with open(os.path.join(directory, "structures.pkl"), "wb") as f:
+        f.write(payload)
+    return layout
+
+
+def map_structures(directory, layout):
+    """{name: object} unpickled with its arrays over a read-only mapping of structures.bin."""
+    with open(os.path.join(directory, "structures.pkl"), "rb") as f:
+        payload = f.read()
+    buffers = []
+    if layout:
+        with open(os.path.join(directory, "structures.bin"), "rb") as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        buffers = [view[offset:offset + size] for offset, size in layout]
+    return pickle.loads(payload, buffers=buffers)
+
+
+def write_snapshot(directory, frames, structures=None):
+    """Write {name: DataFrame} as <name>.arrow files and structures (optional
+    {name: object}) as structures.pkl/.bin. The directory appears atomically;
+    if another process wrote it first, its snapshot is kept."""
+    import pyarrow as pa
+
+    tmp = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, df in frames.items():
+        table = _to_arrow(df)
+        with pa.OSFile(os.path.join(tmp, f"{name}.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    meta = {"frames": {name: len(df) for name, df in frames.items()}}
+    if structures:
+        meta["structures"] = {"names": list(structures), "buffers": _write_structures(tmp, structures)}
+    with open(os.path.join(tmp, "snapshot.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def map_frame(path):
+    """DataFrame over a memory-mapped Arrow IPC file (zero-copy where the type allows)."""
+    import pyarrow as pa
+
+    # The mapping stays open as long as any column references it
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return table.to_pandas(split_blocks=True, self_destruct=False)
+
+
+def map_snapshot(directory):
+    """({name: DataFrame}, {name: structure}) mapped from a snapshot directory."""
+    with open(os.path.join(directory, "snapshot.json")) as f:
+        meta = json.load(f)
+    frames = {name: map_frame(os.path.join(directory, f"{name}.arrow")) for name in meta["frames"]}
+    structures = map_structures(directory, meta["structures"]["buffers"]) if "structures" in meta else {}
+    return frames, structures
+
+
+def _remove_superseded(entry, directory):
+    """Remove snapshots older than the one directory supersedes."""
+    prefix = "shared-"
+    current = int(os.path.basename(directory)[len(prefix):])
+    older = sorted(int(n[len(prefix):]) for n in os.listdir(entry)
+                   if n.startswith(prefix) and n[len(prefix):].isdigit() and int(n[len(prefix):]) < current)
+    for generation in older[:-1]:
+        shutil.rmtree(os.path.join(entry, f"{prefix}{generation}"), ignore_errors=True)
+
+
+def snapshot_contents(data):
+    """(frames, structures) to write for an Analytics; structures it has not built yet are built."""
+    frames = {**data.tables, PATIENTS: data.patients, MEMORY_REPORT: data.memory_report}
+    with span("shared:build_structures"):
+        return frames, {name: getattr(data, name) for name in STRUCTURES}
+
+
+def _build_data(manifest, cache_dir):
+    from hf_analytics.analytics import Analytics
+
+    tables, report = compact_tables(read_cache(manifest, cache_dir))
+    data = Analytics(tables, report)
+    data.patients = build_patient_table(tables)
+    return data
+
+
+def open_snapshot(file_path=DATA_PATH, cache_dir=CACHE_DIR, build=None):
+    """(tables, patients, memory report, {name: structure}) mapped from the
+    snapshot of the current cache entry, writing the snapshot first if this
+    process is the first to ask. build optionally returns the Analytics to
+    write instead of one compacted from the cache entry's tables."""
+    for attempt in range(MAP_ATTEMPTS):
+        manifest, fresh = cache_status(file_path, cache_dir)
+        if not fresh:
+            load_tables(file_path, cache_dir)
+            manifest, fresh = cache_status(file_path, cache_dir)
+        if not fresh:
+            raise RuntimeError(f"No Parquet cache for {file_path} to build a shared snapshot from")
+        entry = _cache_entry(cache_dir, manifest)
+        directory = snapshot_dir(entry, manifest)
+
+        if not os.path.isdir(directory):
+            with span("shared:write"):
+                write_snapshot(directory, *snapshot_contents(build() if build else _build_data(manifest, cache_dir)))
+            _remove_superseded(entry, directory)
+
+        try:
+            with span("shared:map") as s:
+                frames, structures = map_snapshot(directory)
+                s.set(rows=sum(len(df) for df in frames.values()))
+        except FileNotFoundError:
+            # Removed by a process that wrote newer snapshots since we resolved this one
+            if attempt == MAP_ATTEMPTS - 1:
+                raise
+            continue
+        return {name: frames[name] for name in SHEETS}, frames[PATIENTS], frames.get(MEMORY_REPORT), structures
+
+
+# MEMORY
+def _memory_mb():
+    """{'rss', 'private', 'shared'} resident MB of this process (Linux), else {}."""
+    kb = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    kb[key] = int(value.split()[0])
+    except OSError:
+        return {}
+    private = kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0)
+    return {"rss": kb.get("Rss", 0) / 1024, "private": private / 1024,
+            "shared": (kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0)) / 1024}
+
+
+def _worker(mode, file_path, cache_dir, results):
+    """One worker's startup: open the data, answer a first cohort's queries
+    (which build any structure not mapped), report time and memory."""
+    from hf_analytics.analytics import Analytics
+
+    base = _memory_mb()
+    start = time.perf_counter()
+    data = Analytics.shared(file_path, cache_dir) if mode == "shared" else Analytics.load(file_path, cache_dir=cache_dir)
+    cohort = data.cohort(genders=["Female"])
+    cohort.kpis(), cohort.top_drugs(10), cohort.trends("month"), data.sweep.query()
+    seconds = time.perf_counter() - start
+    memory = _memory_mb()
+    results.put({"mode": mode, "pid": os.getpid(), "startup_s": round(seconds, 3),
+                 **{f"{k}_mb": round(memory[k] - base.get(k, 0), 1) for k in memory}})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the shared snapshot and compare worker memory with a regular load")
+    parser.add_argument("--source", default=DATA_PATH, help="workbook to load")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=3, help="worker processes per mode")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    open_snapshot(args.source, args.cache_dir)
+    print(f"Snapshot ready in {time.perf_counter() - start:.2f} s")
+
+    ctx = multiprocessing.get_context("spawn")
+    results, rows = ctx.Queue(), []
+    for mode in ("loaded", "shared"):
+        workers = [ctx.Process(target=_worker, args=(mode, args.source, args.cache_dir, results))
+                   for _ in range(args.workers)]
+        for w in workers:
+            w.start()
+        rows += [results.get() for _ in workers]
+        for w in workers:
+            w.join()
+    # rss counts mapped pages in every process; private is what each extra worker adds
+    print(pd.DataFrame(rows).to_string(index=False))
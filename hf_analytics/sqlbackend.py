@@ -0,0 +1,665 @@
+"""
+DuckDB query backend
+
+build_database() copies the Parquet cache entry into a DuckDB file next to
+it (one table per sheet plus a `patients` table joined like
+build_patient_table()). SQLAnalytics and SQLCohort have the same interface
+as Analytics and Cohort, but the sidebar selection becomes a WHERE clause and
+every tab aggregation a GROUP BY, so only aggregates leave the database and
+the tables never have to fit in memory. duckdb is optional (it is not in
+requirements.txt); without it the pandas backend is the only one.
+
+    HF_BACKEND=sql streamlit run app.py
+    python -m hf_analytics.sqlbackend            # (re)build the database, compare with pandas
+
+"""
+
+import argparse
+import functools
+import importlib.util
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.analytics import POLYPHARMACY_BANDS, Cohort
+from hf_analytics.biomarkers import BIOMARKER_RULES, FLAGS_COLUMN, rule_bit
+from hf_analytics.cube import CUBE_DIMS, OUTCOME_FLAGS, grouped_rates
+from hf_analytics.figcache import cohort_signature
+from hf_analytics.filters import FILTER_COLUMNS, RANGE_DIMS
+from hf_analytics.loader import CACHE_DIR, DATA_PATH, SHEETS, cache_status, load_tables
+from hf_analytics.patients import PATIENT_SHEETS
+from hf_analytics.profiling import span
+from hf_analytics.sweep import ScoreGrid, ThresholdIndex
+
+
+DB_PATH = os.path.join(CACHE_DIR, "hf_analytics.duckdb")
+
+# Bump when the database layout changes so existing files are rebuilt
+DB_VERSION = 2
+
+PRESCRIPTIONS = "Patient_Precriptions"
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The SQL backend needs duckdb (pip install duckdb)") from e
+    return duckdb
+
+
+def duckdb_available():
+    """Whether duckdb is installed (checked without importing it)."""
+    return importlib.util.find_spec("duckdb") is not None
+
+
+def _q(name):
+    """Quoted SQL identifier."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# DATABASE FILE
+def _fresh_manifest(file_path, cache_dir):
+    """Manifest of a fresh Parquet cache entry, building the entry if needed."""
+    manifest, fresh = cache_status(file_path, cache_dir)
+    if not fresh:
+        load_tables(file_path, cache_dir)
+        manifest, fresh = cache_status(file_path, cache_dir)
+    if not fresh:
+        raise RuntimeError(f"No Parquet cache for {file_path} to build the database from")
+    return manifest
+
+
+def _ordered_categories(parquet_path):
+    """{column: categories} for the ordered categoricals (e.g. pd.cut bands) in a Parquet file."""
+    import pyarrow.parquet as pq
+
+    ordered = [f.name for f in pq.read_schema(parquet_path)
+               if getattr(f.type, "ordered", False)]
+    if not ordered:
+        return {}
+    table = pq.read_table(parquet_path, columns=ordered)
+    return {col: table.column(col).combine_chunks().dictionary.to_pylist() for col in ordered}
+
+
+def _sheet_sql(parquet_path):
+    """SELECT reading one cached sheet; ordered categoricals become ENUMs so they keep their order."""
+    enums = _ordered_categories(parquet_path)
+    replace = ", ".join(f"CAST({_q(col)} AS ENUM({', '.join(_literal(v) for v in values)})) AS {_q(col)}"
+                        for col, values in enums.items())
+    return f"SELECT *{f' REPLACE ({replace})' if replace else ''} FROM read_parquet({_literal(parquet_path)})"
+
+
+def _patients_sql(columns, sheets=PATIENT_SHEETS, prefix=""):
+    """SELECT joining the per-patient sheets (tables named prefix + sheet) on
+    inpatient_number in Demography order; a column in several sheets keeps the
+    first sheet's value."""
+    base, *others = sheets
+    select = ["t0.*"]
+    joins = []
+    seen = set(columns[base])
+    for i, name in enumerate(others, start=1):
+        new = [c for c in columns[name] if c not in seen]
+        seen.update(new)
+        select += [f"t{i}.{_q(c)}" for c in new]
+        joins.append(f"LEFT JOIN {_q(prefix + name)} t{i} ON t{i}.inpatient_number = t0.inpatient_number")
+    return f"SELECT {', '.join(select)} FROM {_q(prefix + base)} t0 {' '.join(joins)} ORDER BY t0.rowid"
+
+
+def write_database(directory, db_path, key=None):
+    """Write the sheets in a directory of <sheet>.parquet files (a cache entry or a
+    synthetic cohort) and the joined patients table to db_path.
+
+    DuckDB reads the Parquet files itself, so building never loads a table into
+    pandas (pyarrow only reads the category order of ordered categoricals).
+    """
+    duckdb = _duckdb()
+    tmp = db_path + ".tmp"
+    for path in (tmp, tmp + ".wal"):
+        if os.path.exists(path):
+            os.remove(path)
+    con = duckdb.connect(tmp)
+    try:
+        columns = {}
+        for name in SHEETS:
+            con.execute(f"CREATE TABLE {_q(name)} AS {_sheet_sql(os.path.join(directory, f'{name}.parquet'))}")
+            columns[name] = [row[0] for row in con.execute(f"DESCRIBE {_q(name)}").fetchall()]
+        con.execute(f"CREATE TABLE patients AS {_patients_sql(columns)}")
+        con.execute("CREATE TABLE hf_meta AS SELECT ? AS cache_key, ? AS db_version", [key, DB_VERSION])
+        con.execute("CREATE TABLE hf_deltas (batch VARCHAR)")
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+    os.replace(tmp, db_path)
+
+
+def build_database(file_path=DATA_PATH, db_path=DB_PATH, cache_dir=CACHE_DIR):
+    """Build db_path from the workbook's current cache entry; returns the entry's key."""
+    manifest = _fresh_manifest(file_path, cache_dir)
+    write_database(os.path.join(cache_dir, manifest["key"]), db_path, manifest["key"])
+    return manifest["key"]
+
+
+def _connection_key(con):
+    """Cache key the database behind con was built from (None for an older layout)."""
+    try:
+        key, version = con.execute("SELECT cache_key, db_version FROM hf_meta").fetchone()
+    except _duckdb().Error:
+        return None
+    return key if version == DB_VERSION else None
+
+
+def _database_key(db_path):
+    duckdb = _duckdb()
+    try:
+        con = duckdb.connect(db_path, read_only=True)
+    except (duckdb.Error, OSError):
+        return None
+    try:
+        return _connection_key(con)
+    finally:
+        con.close()
+
+
+def _connection_batches(con):
+    return [row[0] for row in con.execute("SELECT batch FROM hf_deltas ORDER BY rowid").fetchall()]
+
+
+def _applied_batches(db_path):
+    con = _duckdb().connect(db_path, read_only=True)
+    try:
+        return _connection_batches(con)
+    finally:
+        con.close()
+
+
+def append_deltas(con, entry, batches):
+    """INSERT delta batches (subdirectories of entry/deltas, as written by
+    hf_analytics.deltas) into the sheet tables and the patients table through
+    con, a writable connection.
+
+    All batches go in one transaction that reads only their own Parquet
+    files; each batch's patients are joined among themselves and appended to
+    `patients`. Queries on other cursors of the database see none of the new
+    rows until it commits, and a failure leaves none of them in.
+    """
+    columns = {name: [row[0] for row in con.execute(f"DESCRIBE {_q(name)}").fetchall()] for name in SHEETS}
+    con.execute("BEGIN TRANSACTION")
+    try:
+        for batch in batches:
+            part = os.path.join(entry, "deltas", batch)
+            for name in SHEETS:
+                con.execute(f"CREATE TEMP TABLE {_q('delta_' + name)} AS "
+                            f"SELECT * FROM read_parquet({_literal(os.path.join(part, f'{name}.parquet'))})")
+                con.execute(f"INSERT INTO {_q(name)} BY NAME SELECT * FROM {_q('delta_' + name)}")
+            con.execute(f"INSERT INTO patients BY NAME {_patients_sql(columns, prefix='delta_')}")
+            for name in SHEETS:
+                con.execute(f"DROP TABLE {_q('delta_' + name)}")
+            con.execute("INSERT INTO hf_deltas VALUES (?)", [batch])
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("CHECKPOINT")
+
+
+def _sync_database(file_path, db_path, cache_dir):
+    """Rebuild db_path when it does not match the workbook, and append delta
+    batches the cache entry has and the database lacks."""
+    manifest = _fresh_manifest(file_path, cache_dir)
+    if not os.path.exists(db_path) or _database_key(db_path) != manifest["key"]:
+        with span("load:build_duckdb"):
+            build_database(file_path, db_path, cache_dir)
+    applied = _applied_batches(db_path)
+    pending = [d["batch"] for d in manifest.get("deltas", [])]
+    if pending[:len(applied)] != applied:
+        # The cache entry's batches are not a continuation of the database's
+        with span("load:build_duckdb"):
+            build_database(file_path, db_path, cache_dir)
+        applied = []
+    if len(pending) > len(applied):
+        con = _duckdb().connect(db_path)
+        try:
+            with span("load:append_deltas"):
+                append_deltas(con, os.path.join(cache_dir, manifest["key"]), pending[len(applied):])
+        finally:
+            con.close()
+
+
+def open_database(file_path=DATA_PATH, db_path=DB_PATH, cache_dir=CACHE_DIR):
+    """Connection to a database matching the workbook, rebuilding it when stale
+    and appending delta batches the cache entry has and the database lacks.
+
+    The connection is writable so later batches can be INSERTed through it
+    (see SQLAnalytics.refreshed()); the file is locked to this process.
+    """
+    _sync_database(file_path, db_path, cache_dir)
+    return _duckdb().connect(db_path)
+
+
+def refresh_database(file_path=DATA_PATH, db_path=DB_PATH, cache_dir=CACHE_DIR):
+    """Like open_database(), but the database is rebuilt into a new file, which
+    replaces db_path only once it is complete. Connections already open on
+    db_path (possibly shared by running sessions) keep working on the old file
+    until they are closed; if anything fails, db_path is untouched. For a new
+    workbook, where everything has to be rebuilt anyway.
+    """
+    # A fresh name each time: DuckDB reuses an open instance for a path it has seen.
+    # The connection keeps the renamed file; a write-ahead log it opens later is
+    # named after tmp until the next checkpoint folds it in
+    tmp = f"{db_path}.{os.getpid()}-{time.monotonic_ns()}.tmp"
+    try:
+        _sync_database(file_path, tmp, cache_dir)
+        con = _duckdb().connect(tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, db_path)
+    return con
+
+
+# QUERIES
+class SQLAnalytics:
+    """A DuckDB database with the Analytics interface; aggregations run as SQL.
+
+    Every query runs on its own cursor, so one instance can be shared across
+    Streamlit sessions; only refreshed() writes through the connection.
+    """
+
+    memory_report = None
+
+    def __init__(self, con, version=0, db_path=None):
+        self.con = con
+        self.version = version
+        self.db_path = db_path
+
+    @classmethod
+    def load(cls, file_path=DATA_PATH, db_path=DB_PATH, cache_dir=CACHE_DIR):
+        with span("load:duckdb"):
+            return cls(open_database(file_path, db_path, cache_dir), db_path=db_path)
+
+    def refreshed(self, file_path=DATA_PATH, cache_dir=CACHE_DIR):
+        """A new instance with the cache entry's new delta batches.
+
+        The batches are INSERTed through this instance's connection in one
+        transaction, so the cost follows the delta and queries keep seeing the
+        old rows until it commits; both instances then share the connection.
+        When the cache entry was rebuilt (new workbook), the database is rebuilt
+        into a new file instead and this instance's connection is left open.
+        """
+        manifest = _fresh_manifest(file_path, cache_dir)
+        pending = [d["batch"] for d in manifest.get("deltas", [])]
+        cursor = self.con.cursor()
+        try:
+            applied = _connection_batches(cursor)
+            if _connection_key(cursor) == manifest["key"] and pending[:len(applied)] == applied:
+                if len(pending) > len(applied):
+                    with span("load:append_deltas"):
+                        append_deltas(cursor, os.path.join(cache_dir, manifest["key"]), pending[len(applied):])
+                return type(self)(self.con, self.version + 1, self.db_path)
+        finally:
+            cursor.close()
+        with span("load:duckdb"):
+            con = refresh_database(file_path, self.db_path or DB_PATH, cache_dir)
+        return type(self)(con, self.version + 1, self.db_path)
+
+    @classmethod
+    def open(cls, db_path):
+        """An existing database file, as is (no freshness check)."""
+        return cls(_duckdb().connect(db_path, read_only=True), db_path=db_path)
+
+    def rows(self):
+        """Rows per sheet table."""
+        return {name: int(self.query(f"SELECT count(*) AS n FROM {_q(name)}")['n'].iloc[0]) for name in SHEETS}
+
+    def query(self, sql, params=()):
+        """Result of one SQL statement as a DataFrame."""
+        cursor = self.con.cursor()
+        try:
+            return cursor.execute(sql, list(params)).df()
+        finally:
+            cursor.close()
+
+    @functools.cached_property
+    def columns(self):
+        return pd.Index(self.query("DESCRIBE patients")['column_name'])
+
+    @functools.cached_property
+    def n_patients(self):
+        return int(self.query("SELECT count(*) AS n FROM patients")['n'].iloc[0])
+
+    @functools.cached_property
+    def filter_values(self):
+        values = {}
+        for dim, col in FILTER_COLUMNS.items():
+            if col not in self.columns:
+                continue
+            order = _q(col) if dim in RANGE_DIMS else "min(rowid)"
+            found = self.query(f"SELECT {_q(col)} FROM patients WHERE {_q(col)} IS NOT NULL "
+                               f"GROUP BY {_q(col)} ORDER BY {order}")[col].tolist()
+            if found:
+                values[dim] = found
+        return values
+
+    @functools.cached_property
+    def sweep(self):
+        return SQLScoreSweep(self)
+
+    def cohort(self, age_range=None, genders=None, wards=None, where=None):
+        return SQLCohort(self, age_range, genders, wards, where)
+
+
+class SQLScoreSweep(ScoreGrid):
+    """Score 0 / Score 3 outcomes at any cut-offs, counted by one GROUP BY over all patients."""
+
+    def __init__(self, data, rules=BIOMARKER_RULES):
+        super().__init__(data.columns, rules)
+        self.data = data
+
+    def query(self, thresholds=None):
+        cutoffs = list(self.thresholds(thresholds).values())
+        # Missing values compare NULL and count as normal, as in the pandas index
+        abnormal = " + ".join(f"coalesce({_q(r.column)} {r.op} ?, false)::INTEGER" for r in self.rules) or "0"
+        sums = "".join(f", sum({_q(o)})::BIGINT AS {_q(o)}" for o in self.outcomes)
+        stats = self.data.query(f"SELECT {abnormal} AS abnormal, count(*) AS patients{sums} "
+                                f"FROM patients GROUP BY ALL", cutoffs).set_index('abnormal')
+        stats = stats.reindex([0, len(self.rules)], fill_value=0)
+        return self._score_frame({'Score 0': stats.iloc[0].tolist(), 'Score 3': stats.iloc[1].tolist()})
+
+    def roc_table(self):
+        """The full-grid export, via an in-memory ThresholdIndex over the score columns only."""
+        columns = [r.column for r in self.rules] + self.outcomes
+        patients = self.data.query(f"SELECT {', '.join(_q(c) for c in columns)} FROM patients")
+        return ThresholdIndex(patients, self.rules).roc_table()
+
+
+class SQLCohort(Cohort):
+    """One sidebar selection as a WHERE clause over the patients table.
+
+    Same methods and results as Cohort; each aggregate is one query returning
+    only the aggregated rows.
+    """
+
+    def __init__(self, data, age_range=None, genders=None, wards=None, where=None):
+        self.data = data
+        self.age_range = age_range
+        self.genders = list(genders or [])
+        self.wards = list(wards or [])
+        self.where = {col: list(values) for col, values in (where or {}).items() if len(values)}
+        self.sig = cohort_signature(backend='sql', age=age_range, gender=self.genders, ward=self.wards,
+                                    **({'where': self.where} if self.where else {}),
+                                    **({'data': data.version} if data.version else {}))
+
+        clauses, self.params = [], []
+        if age_range is not None and 'age' in data.filter_values:
+            clauses.append(f"{_q(FILTER_COLUMNS['age'])} BETWEEN ? AND ?")
+            self.params += list(age_range)
+        selected = {FILTER_COLUMNS[dim]: values for dim, values in (('gender', self.genders), ('ward', self.wards))
+                    if values and dim in data.filter_values}
+        for col, values in [*selected.items(), *self.where.items()]:
+            clauses.append(f"{_q(col)} IN ({_placeholders(values)})")
+            self.params += [v.item() if hasattr(v, 'item') else v for v in values]
+        self.clause = " AND ".join(clauses)
+
+    def _where(self, *extra):
+        clauses = [c for c in (self.clause, *extra) if c]
+        return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    def _query(self, sql, params=()):
+        """Run sql with the cohort's parameters first (its WHERE clause comes first)."""
+        return self.data.query(sql, self.params + list(params))
+
+    def _cohort_sql(self, columns="*"):
+        return f"SELECT {columns} FROM patients {self._where()}"
+
+    @functools.cached_property
+    def n(self):
+        return int(self._query(f"SELECT count(*) AS n FROM patients {self._where()}")['n'].iloc[0])
+
+    def __len__(self):
+        return self.n
+
+    @functools.cached_property
+    def ids(self):
+        return self._query(f"{self._cohort_sql('inpatient_number')} ORDER BY rowid")['inpatient_number'].to_numpy()
+
+    @functools.cached_property
+    def patients(self):
+        """Rows of the patients table in the cohort (transfers every column)."""
+        return self._query(f"{self._cohort_sql()} ORDER BY rowid").set_index('inpatient_number')
+
+    def take(self, sheet, columns=None):
+        cols = ", ".join(_q(c) for c in columns) if columns else "*"
+        with span(f"take:{sheet}") as s:
+            rows = self._query(f"SELECT {cols} FROM {_q(sheet)} WHERE inpatient_number IN "
+                               f"({self._cohort_sql('inpatient_number')}) ORDER BY rowid")
+            s.set(rows=len(rows))
+        return rows
+
+    @functools.cached_property
+    def cells(self):
+        dims = [_q(d) for d in CUBE_DIMS if d in self.data.columns]
+        flags = [f for f in OUTCOME_FLAGS if f in self.data.columns]
+        sums = "".join(f", sum({_q(f)})::BIGINT AS {_q(f)}" for f in flags)
+        return self._query(f"SELECT {', '.join(dims)}, count(*) AS patients{sums} "
+                           f"FROM patients {self._where()} GROUP BY ALL")
+
+    def select(self, columns):
+        return self._query(f"{self._cohort_sql(', '.join(_q(c) for c in columns))} ORDER BY rowid")
+
+    # AGGREGATIONS
+
+    def share(self, col, values):
+        n = len(self)
+        values = [v.item() if hasattr(v, 'item') else v for v in values]
+        count = int(self._query(f"SELECT count(*) AS n FROM patients "
+                                f"{self._where(f'{_q(col)} IN ({_placeholders(values)})')}", values)['n'].iloc[0])
+        return count, (count / n * 100 if n else 0)
+
+    def flag_share(self, name):
+        n = len(self)
+        bit = f"({_q(FLAGS_COLUMN)} >> {rule_bit(name)}) & 1 = 1"
+        count = int(self._query(f"SELECT count(*) AS n FROM patients {self._where(bit)}")['n'].iloc[0])
+        return count, (count / n * 100 if n else 0)
+
+    def median(self, col):
+        value = self._query(f"SELECT median({_q(col)}) AS m FROM patients {self._where()}")['m'].iloc[0]
+        return np.nan if value is None or pd.isna(value) else value
+
+    def value_counts(self, col, sort='count'):
+        order = f"count DESC, {_q(col)}" if sort == 'count' else _q(col)
+        counts = self._query(f"SELECT {_q(col)}, count(*) AS count FROM patients "
+                             f"{self._where(f'{_q(col)} IS NOT NULL')} GROUP BY ALL ORDER BY {order}")
+        return counts.set_index(col)['count']
+
+    def binned_counts(self, col, bins, labels):
+        cases = " ".join(f"WHEN {_q(col)} > {float(lo)!r} AND {_q(col)} <= {float(hi)!r} THEN {i}"
+                         for i, (lo, hi) in enumerate(zip(bins[:-1], bins[1:])))
+        counts = self._query(f"SELECT CASE {cases} END AS bin, count(*) AS count FROM patients "
+                             f"{self._where()} GROUP BY ALL").dropna()
+        counts = counts.set_index('bin')['count'].reindex(range(len(labels)), fill_value=0)
+        counts.index = pd.Index(labels, name=col)
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def crosstab(self, index, columns, normalize=None):
+        pairs = self._query(f"SELECT {_q(index)}, {_q(columns)}, count(*) AS n FROM patients "
+                            f"{self._where(f'{_q(index)} IS NOT NULL', f'{_q(columns)} IS NOT NULL')} GROUP BY ALL")
+        table = pairs.set_index([index, columns])['n'].unstack(fill_value=0)
+        table = table.sort_index().sort_index(axis=1)
+        if normalize == 'columns':
+            table = table / table.sum(axis=0)
+        return table
+
+    def group_counts(self, columns):
+        cols = ", ".join(_q(c) for c in columns)
+        return self._query(f"SELECT {cols}, count(*) AS count FROM patients "
+                           f"{self._where(*(f'{_q(c)} IS NOT NULL' for c in columns))} "
+                           f"GROUP BY ALL ORDER BY {cols}")
+
+    def outcome_rates(self, by, outcomes=OUTCOME_FLAGS):
+        if by in self.cells.columns:
+            return super().outcome_rates(by, outcomes)
+        outcomes = [o for o in outcomes if o in self.data.columns]
+        sums = "".join(f", sum({_q(o)})::BIGINT AS {_q(o)}" for o in outcomes)
+        groups = self._query(f"SELECT {_q(by)}, count(*) AS patients{sums} FROM patients "
+                             f"{self._where(f'{_q(by)} IS NOT NULL')} GROUP BY ALL")
+        return grouped_rates(groups, by, outcomes, weight='patients')
+
+    # SCORES
+
+    def biomarker_rates(self, rules=BIOMARKER_RULES):
+        columns = self.data.columns
+        died = (f"{_q('outcome_during_hospitalization')} = 'Dead'"
+                if 'outcome_during_hospitalization' in columns else "false")
+        groups = {'Deaths': died, 'Cardiology': "admission_ward = 'Cardiology'", 'ICU': "admission_ward = 'ICU'"}
+        select = []
+        for g, (group, cond) in enumerate(groups.items()):
+            select.append(f"count(*) FILTER (WHERE {cond}) AS n{g}")
+            select += [f"count(*) FILTER (WHERE {cond} AND ({_q(FLAGS_COLUMN)} >> {i}) & 1 = 1) AS g{g}_{i}"
+                       for i in range(len(rules))]
+        row = self._query(f"SELECT {', '.join(select)} FROM patients {self._where()}").iloc[0]
+        data = {}
+        for g, group in enumerate(groups):
+            n = row[f"n{g}"]
+            abnormal = np.array([row[f"g{g}_{i}"] for i in range(len(rules))])
+            data[group] = abnormal / n * 100 if n > 0 else np.zeros(len(rules))
+        rates = pd.DataFrame(data, index=pd.Index([r.label for r in rules], name='Biomarker'))
+        return rates[[r.column in columns for r in rules]]
+
+    # PRESCRIPTIONS
+
+    def _prescriptions_sql(self, columns, *extra):
+        """SELECT over prescription rows of cohort patients joined to their patient row p."""
+        clauses = ["r.Drug_name IS NOT NULL", *extra]
+        return (f"SELECT {columns} FROM {_q(PRESCRIPTIONS)} r JOIN ({self._cohort_sql()}) p "
+                f"ON r.inpatient_number = p.inpatient_number WHERE {' AND '.join(clauses)}")
+
+    def prescription_count(self):
+        return int(self._query(self._prescriptions_sql("count(*) AS n"))['n'].iloc[0])
+
+    def top_drugs(self, n=10):
+        top = self._query(f"{self._prescriptions_sql('r.Drug_name, count(DISTINCT r.inpatient_number) AS patients')} "
+                          f"GROUP BY ALL ORDER BY patients DESC, r.Drug_name LIMIT {int(n)}")
+        return top.set_index('Drug_name')['patients']
+
+    def drug_counts(self, by, drugs=None):
+        extra = [f"p.{_q(by)} IS NOT NULL"]
+        params = []
+        if drugs is not None:
+            extra.append(f"r.Drug_name IN ({_placeholders(drugs)})" if len(drugs) else "false")
+            params = list(drugs)
+        counts = self._query(f"{self._prescriptions_sql(f'r.Drug_name, p.{_q(by)}, count(*) AS n', *extra)} "
+                             f"GROUP BY ALL", params)
+        table = counts.set_index(['Drug_name', by])['n'].unstack(fill_value=0)
+        return table.sort_index().sort_index(axis=1)
+
+    def co_prescriptions(self, min_patients=1):
+        pairs = self._query(f"""
+            WITH b AS ({self._prescriptions_sql('DISTINCT r.inpatient_number AS id, r.Drug_name AS drug')}),
+                 per_drug AS (SELECT drug, count(*) AS k FROM b GROUP BY drug)
+            SELECT x.drug AS drug_a, y.drug AS drug_b, count(*) AS patients,
+                   any_value(ka.k) AS n_a, any_value(kb.k) AS n_b, (SELECT count(DISTINCT id) FROM b) AS n
+            FROM b x JOIN b y ON x.id = y.id AND x.drug < y.drug
+            JOIN per_drug ka ON ka.drug = x.drug JOIN per_drug kb ON kb.drug = y.drug
+            GROUP BY x.drug, y.drug HAVING count(*) >= ? ORDER BY drug_a, drug_b""", [min_patients])
+        both, n = pairs['patients'].to_numpy(), int(pairs['n'].iloc[0]) if len(pairs) else 0
+        n_i, n_j = pairs['n_a'].to_numpy(), pairs['n_b'].to_numpy()
+        return pd.DataFrame({
+            'drug_a': pairs['drug_a'],
+            'drug_b': pairs['drug_b'],
+            'patients': both,
+            'support': both / n * 100 if n else np.nan,
+            'lift': both * n / (n_i * n_j),
+            'jaccard': both / (n_i + n_j - both),
+        })
+
+    def polypharmacy(self, outcomes=('re_admission_within_28_days', 're_admission_within_6_months')):
+        outcomes = list(outcomes)
+        bins, labels = POLYPHARMACY_BANDS
+        cases = " ".join(f"WHEN k > {float(lo)!r} AND k <= {float(hi)!r} THEN {i}"
+                         for i, (lo, hi) in enumerate(zip(bins[:-1], bins[1:])) if np.isfinite(hi))
+        sums = "".join(f", sum(p.{_q(o)})::BIGINT AS {_q(o)}" for o in outcomes)
+        bands = self._query(f"""
+            WITH k AS (SELECT inpatient_number, count(DISTINCT Drug_name) AS k
+                       FROM {_q(PRESCRIPTIONS)} GROUP BY inpatient_number)
+            SELECT CASE {cases} ELSE {len(labels) - 1} END AS band, count(*) AS patients{sums}
+            FROM (SELECT p.*, coalesce(k.k, 0) AS k FROM ({self._cohort_sql()}) p
+                  LEFT JOIN k ON k.inpatient_number = p.inpatient_number) p
+            GROUP BY ALL""")
+        bands['drugs'] = pd.Categorical.from_codes(bands['band'].to_numpy(), categories=labels)
+        return grouped_rates(bands, 'drugs', outcomes, weight='patients')
+
+    # TRENDS
+
+    def trends(self, freq='month', by=None):
+        from hf_analytics.timeseries import DATE_COLUMN, DailyCounts
+        columns = self.data.columns
+        sums = "".join(f", sum({_q(f)})::BIGINT AS {_q(f)}" for f in OUTCOME_FLAGS if f in columns)
+        if 'admission_way' in columns:
+            sums += ", count(*) FILTER (WHERE admission_way = 'Emergency') AS emergency"
+        if 'hf_top3_score' in columns:
+            sums += ", count(*) FILTER (WHERE hf_top3_score = 3) AS score3"
+        keys = f"{_q(by)}, " if by else ""
+        # One row per day (and `by` value); the windows are taken over these
+        daily = self._query(f"SELECT {keys}CAST({_q(DATE_COLUMN)} AS DATE) AS {_q(DATE_COLUMN)}, "
+                            f"count(*) AS patients{sums} FROM patients "
+                            f"{self._where(f'{_q(DATE_COLUMN)} IS NOT NULL')} GROUP BY ALL")
+        with span("trends", freq=freq):
+            return DailyCounts(daily, [by] if by else [], weight='patients').series(freq, by=by)
+
+    # SURVIVAL
+
+    def survival(self, endpoint, by=None):
+        from hf_analytics.survival import ENDPOINTS, km_curves
+        keys = [] if by is None else [by] if isinstance(by, str) else list(by)
+        columns = ", ".join(_q(c) for c in keys + [c for c in ENDPOINTS[endpoint] if c is not None])
+        # One row per stratum, time and flag; the curves are estimated from the counts
+        rows = self._query(f"SELECT {columns}, count(*) AS patients FROM patients {self._where()} GROUP BY ALL")
+        with span("survival", rows=len(rows)):
+            return km_curves(rows, endpoint, by, weight='patients')
+
+    # FLOWS
+
+    def flow(self, stages, min_count=0):
+        from hf_analytics.flows import build_flow
+        cols = ", ".join(_q(c) for c in stages)
+        # One row per stage path, in order of each path's first patient, so node
+        # order matches the row-level flow
+        paths = self._query(f"SELECT {cols}, count(*) AS patients FROM patients {self._where()} "
+                            f"GROUP BY ALL ORDER BY min(rowid)")
+        return build_flow(paths, stages, min_count=min_count, weight='patients')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the DuckDB database and compare it with the pandas backend")
+    parser.add_argument("--source", default=DATA_PATH, help="workbook to load")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    from hf_analytics.analytics import Analytics
+
+    start = time.perf_counter()
+    key = build_database(args.source, args.db)
+    print(f"Built {args.db} from cache entry {key} in {time.perf_counter() - start:.2f} s")
+
+    sql, pandas_data = SQLAnalytics.load(args.source, args.db), Analytics.load(args.source)
+    rows = []
+    for name, kwargs in [("all", {}), ("female ICU", {"genders": ["Female"], "wards": ["ICU"]}),
+                         ("emergency", {"where": {"admission_way": ["Emergency"]}})]:
+        a, b = pandas_data.cohort(**kwargs), sql.cohort(**kwargs)
+        ka, kb = a.kpis(), b.kpis()
+        rows.append({"cohort": name, "patients": kb["patients"],
+                     "kpis_match": all(np.isclose(ka[k], kb[k]) for k in ka),
+                     "top_drugs_match": a.top_drugs(10).equals(b.top_drugs(10))})
+    print(pd.DataFrame(rows).to_string(index=False))
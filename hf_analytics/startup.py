@@ -0,0 +1,110 @@
+"""
+Startup budget
+
+Imports each target in a fresh interpreter with `python -X importtime`, parses
+the per-module timings and checks the target's cumulative import time against
+its budget. Targets also list modules they must not pull in: the dashboard
+never needs matplotlib/seaborn, and the headless analytics module must stay
+free of Streamlit and Plotly.
+
+    python -m hf_analytics.startup                 # all targets; exit 1 if over budget
+    python -m hf_analytics.startup app --top 15
+
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+import pandas as pd
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time allowed per target (seconds), and modules it must not import
+STARTUP_BUDGETS = {
+    "app": {"seconds": 2.0, "forbidden": ["matplotlib", "seaborn"]},
+    "hf_analytics.analytics": {"seconds": 1.0, "forbidden": ["streamlit", "plotly", "matplotlib", "seaborn", "scipy"]},
+}
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports(target, cwd=ROOT):
+    """Per-module import times for `import target` in a fresh interpreter.
+
+    Returns a frame with module, depth (0 = imported by the target's importer),
+    self_s and cumulative_s, in the order the interpreter reported them.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {target} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            self_us, cum_us, indent, module = m.groups()
+            rows.append({
+                "module": module,
+                "depth": (len(indent) - 1) // 2,
+                "self_s": int(self_us) / 1e6,
+                "cumulative_s": int(cum_us) / 1e6,
+            })
+    return pd.DataFrame(rows)
+
+
+def check_startup(budgets=STARTUP_BUDGETS, runs=3):
+    """Best-of-`runs` import time per target against its budget.
+
+    Returns (report, timings): report has one row per target with seconds,
+    budget_s, forbidden modules that were imported and ok; timings maps each
+    target to the module frame of its fastest run.
+    """
+    rows, timings = [], {}
+    for target, budget in budgets.items():
+        best = None
+        for _ in range(runs):
+            frame = measure_imports(target)
+            seconds = frame.loc[frame["module"] == target, "cumulative_s"].max()
+            if best is None or seconds < best[0]:
+                best = (seconds, frame)
+        seconds, frame = best
+        roots = set(frame["module"].str.split(".").str[0])
+        imported = [m for m in budget.get("forbidden", []) if m in roots]
+        rows.append({
+            "target": target,
+            "seconds": round(seconds, 3),
+            "budget_s": budget["seconds"],
+            "forbidden_imported": ", ".join(imported),
+            "ok": seconds <= budget["seconds"] and not imported,
+        })
+        timings[target] = frame
+    return pd.DataFrame(rows), timings
+
+
+def slowest(frame, top=10):
+    """Modules imported directly by the target, by cumulative import time."""
+    direct = frame[frame["depth"] == 1]
+    return direct.sort_values("cumulative_s", ascending=False).head(top)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check import-time budgets")
+    parser.add_argument("targets", nargs="*", help="targets to check (default: all in STARTUP_BUDGETS)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    budgets = {t: STARTUP_BUDGETS.get(t, {"seconds": float("inf")}) for t in args.targets} or STARTUP_BUDGETS
+    report, timings = check_startup(budgets, runs=args.runs)
+    for target, frame in timings.items():
+        print(f"\n{target}: slowest imports")
+        print(slowest(frame, args.top)[["module", "self_s", "cumulative_s"]].to_string(index=False))
+    print()
+    print(report.to_string(index=False))
+    sys.exit(0 if report["ok"].all() else 1)
@@ -0,0 +1,137 @@
+"""
+Kaplan-Meier survival and time-to-event curves per stratum
+
+Death, readmission and emergency-return times (days from admission) become
+(duration, event) pairs over the 6 months the outcome flags cover: a patient
+without the event is censored at HORIZON. kaplan_meier() estimates every
+stratum in one pass: rows are sorted once by (stratum, time), events and
+exits are summed per distinct (stratum, time), the number at risk comes from
+a cumulative sum restarted at each stratum, and survival is a grouped
+cumulative product (a cumulative sum of log factors minus its value at the
+stratum's start). There is no loop over strata, so 20+ strata cost the same
+sort as one.
+
+    from hf_analytics.survival import km_curves
+    km_curves(patients, 'readmission', by=['NYHA_cardiac_function_classification', 'Killip_grade'])
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Endpoint: (time column in days from admission, flag marking the event within 6 months).
+# Without a flag, a recorded time within the horizon is the event
+ENDPOINTS = {
+    'death': ('time_of_death__days_from_admission', 'death_within_6_months'),
+    'readmission': ('readmission_time_days_from_admission', 're_admission_within_6_months'),
+    'emergency': ('time_to_emergency_department_within_6_months', None),
+}
+
+# Follow-up the 6-month flags vouch for; patients without the event are censored here
+HORIZON = 183
+
+# Stratification columns offered by the dashboard
+SURVIVAL_STRATA = ['NYHA_cardiac_function_classification', 'Killip_grade', 'GCS_category', 'hf_top3_score',
+                   'admission_ward']
+
+
+def durations(frame, endpoint, horizon=HORIZON):
+    """(time, event, usable) arrays for one endpoint.
+
+    Events are flagged rows with a recorded time (capped at the horizon);
+    unflagged rows are censored at the horizon. Flagged rows without a time
+    cannot be placed on the curve and are not usable.
+    """
+    time_col, flag_col = ENDPOINTS[endpoint]
+    time = frame[time_col].to_numpy(dtype=float, na_value=np.nan)
+    recorded = ~np.isnan(time)
+    if flag_col is None:
+        flag = recorded & (time <= horizon)
+    else:
+        flag = frame[flag_col].to_numpy(dtype=float, na_value=0) > 0
+    event = flag & recorded
+    time = np.where(event, np.minimum(time, horizon), horizon)
+    return time, event, ~flag | recorded
+
+
+def kaplan_meier(codes, time, event, n_groups, weights=None):
+    """Kaplan-Meier estimate per group, one row per distinct (group, time).
+
+    codes holds each row's group (-1 leaves the row out); weights optionally
+    counts patients per row (pre-aggregated input). Returns a dict of arrays:
+    group, time, at_risk, events, censored, survival (a proportion).
+    """
+    codes, time, event = np.asarray(codes), np.asarray(time, dtype=float), np.asarray(event, dtype=bool)
+    weights = np.ones(len(codes)) if weights is None else np.asarray(weights, dtype=float)
+    keep = codes >= 0
+    codes, time, event, weights = codes[keep], time[keep], event[keep], weights[keep]
+    if not len(codes):
+        return {k: np.zeros(0) for k in ('group', 'time', 'at_risk', 'events', 'censored', 'survival')}
+
+    order = np.lexsort((time, codes))
+    codes, time, event, weights = codes[order], time[order], event[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (time[1:] != time[:-1])])
+    group, t = codes[starts], time[starts]
+    events = np.add.reduceat(weights * event, starts)
+    leaving = np.add.reduceat(weights, starts)
+
+    # Position of each row's group start, for restarting cumulative sums per group
+    first = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    group_start = first[np.cumsum(np.r_[True, group[1:] != group[:-1]]) - 1]
+    left_before = np.cumsum(leaving) - leaving
+    at_risk = np.bincount(codes, weights=weights, minlength=n_groups)[group] - (left_before - left_before[group_start])
+
+    # Grouped cumulative product of (1 - d/n); factors of 0 are counted apart from the logs
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factor = 1 - events / at_risk
+    zero = factor <= 0
+    log_factor = np.log(np.where(zero, 1, factor))
+    log_sum, zero_sum = np.cumsum(log_factor), np.cumsum(zero)
+    log_sum -= log_sum[group_start] - log_factor[group_start]
+    zero_sum -= zero_sum[group_start] - zero[group_start]
+    survival = np.where(zero_sum > 0, 0.0, np.exp(log_sum))
+    return {'group': group, 'time': t, 'at_risk': at_risk, 'events': events,
+            'censored': leaving - events, 'survival': survival}
+
+
+def km_curves(frame, endpoint, by=None, weight=None, horizon=HORIZON):
+    """Step curves for one endpoint, per value (combination) of by.
+
+    frame is patient rows, or rows pre-aggregated by (by, time, flag) with the
+    patient count in the `weight` column. Columns: [*by], time, at_risk,
+    events, censored, survival and incidence (1 - survival), both in %. Each
+    stratum starts with a time-0 row at 100% survival; strata with missing
+    keys are dropped.
+    """
+    keys = [] if by is None else [by] if isinstance(by, str) else list(by)
+    time, event, usable = durations(frame, endpoint, horizon)
+    weights = None if weight is None else frame[weight].to_numpy(dtype=float)
+    if keys:
+        grouped = frame[keys].groupby(keys, observed=True, sort=True)
+        codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.intp)
+        strata = grouped.size().reset_index()[keys]
+    else:
+        codes = np.zeros(len(frame), dtype=np.intp)
+        strata = pd.DataFrame(index=range(1))
+    codes = np.where(usable, codes, -1)
+    km = kaplan_meier(codes, time, event, len(strata), weights)
+
+    # Time-0 row per stratum present: everyone at risk, survival 100%
+    group = km['group'].astype(np.intp)
+    first = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(group) else np.zeros(0, np.intp)
+    curves = pd.DataFrame({
+        'group': np.r_[group[first], group],
+        'time': np.r_[np.zeros(len(first)), km['time']],
+        'at_risk': np.r_[km['at_risk'][first], km['at_risk']],
+        'events': np.r_[np.zeros(len(first)), km['events']],
+        'censored': np.r_[np.zeros(len(first)), km['censored']],
+        'survival': np.r_[np.ones(len(first)), km['survival']] * 100,
+    })
+    curves = curves.sort_values(['group', 'time'], kind='stable', ignore_index=True)
+    curves['incidence'] = 100 - curves['survival']
+    for col in ('at_risk', 'events', 'censored'):
+        curves[col] = curves[col].round().astype(np.int64)
+    for i, key in enumerate(keys):
+        curves.insert(i, key, strata[key].array.take(curves['group'].to_numpy()))
+    return curves.drop(columns='group')
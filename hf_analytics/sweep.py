@@ -0,0 +1,179 @@
+"""
+Threshold sweep index for the HF Top3 score
+
+Each score marker's values are binned once against a fixed grid of candidate
+cut-offs (searchsorted), and patients plus outcome sums are histogrammed over
+the joint bins with bincount. Cumulative sums along every marker axis turn the
+histogram into a summed-area table, so the Score 0 / Score 3 population for any
+slider position is a handful of corner lookups instead of rebuilding
+hf_top3_score over the patient frame. The same lookups broadcast over the whole
+grid for the ROC-style export.
+
+"""
+
+import copy
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.biomarkers import BIOMARKER_RULES
+from hf_analytics.cube import OUTCOME_FLAGS
+
+
+# Candidate cut-offs per score rule; the registry thresholds sit on the grid
+SWEEP_GRIDS = {
+    'high_lactate': np.round(np.arange(0.5, 6.0001, 0.1), 1),
+    'low_sodium': np.arange(120.0, 151.0),
+    'high_troponin': np.round(np.arange(0.0, 0.5001, 0.01), 2),
+}
+
+# searchsorted side giving, per operator, a bin that is abnormal exactly on one side of a grid index
+_SIDES = {'>=': 'right', '>': 'left', '<': 'right', '<=': 'left'}
+
+
+def _is_high(rule):
+    return rule.op in ('>', '>=')
+
+
+class ScoreGrid:
+    """Score rules present in `columns` with their cut-off grids and the outcomes to report.
+
+    Shared by every score sweep: grid snapping, default thresholds and the
+    Score 0 / Score 3 result layout.
+    """
+
+    def __init__(self, columns, rules=BIOMARKER_RULES, grids=SWEEP_GRIDS, outcomes=OUTCOME_FLAGS):
+        self.rules = [r for r in rules if r.in_score and r.column in columns and r.name in grids]
+        self.grids = [np.asarray(grids[r.name], dtype=float) for r in self.rules]
+        self.outcomes = [o for o in outcomes if o in columns]
+
+    def grid_index(self, name, threshold):
+        """Index of the grid cut-off nearest to threshold for rule `name`."""
+        grid = self.grids[[r.name for r in self.rules].index(name)]
+        k = int(np.clip(np.searchsorted(grid, threshold), 1, len(grid) - 1))
+        return k - 1 if threshold - grid[k - 1] <= grid[k] - threshold else k
+
+    def thresholds(self, overrides=None):
+        """Grid-snapped cut-offs by rule name: registry defaults with overrides applied."""
+        overrides = overrides or {}
+        out = {}
+        for r, g in zip(self.rules, self.grids):
+            out[r.name] = float(g[self.grid_index(r.name, overrides.get(r.name, r.threshold))])
+        return out
+
+    def _score_frame(self, rows):
+        """{label: [patients, *outcome sums]} -> frame of patients and outcome rates (%)."""
+        data = {}
+        for label, stats in rows.items():
+            n = stats[0]
+            data[label] = [n] + [stats[i + 1] / n * 100 if n else np.nan for i in range(len(self.outcomes))]
+        return pd.DataFrame.from_dict(data, orient='index', columns=['patients'] + self.outcomes)
+
+
+class ThresholdIndex(ScoreGrid):
+    """Summed-area table of patients and outcome sums over the score-marker bins.
+
+    Per rule with grid g of length G, values fall in bins so that both the
+    abnormal and the normal side of any cut-off g[k] are contiguous ranges,
+    with missing values on the normal side (they never count as abnormal):
+    high rules use bin 0 for missing and 1..G+1 for values, low rules use
+    0..G for values and G+1 for missing.
+    """
+
+    def __init__(self, patients, rules=BIOMARKER_RULES, grids=SWEEP_GRIDS, outcomes=OUTCOME_FLAGS):
+        super().__init__(patients.columns, rules, grids, outcomes)
+
+        shape = tuple(len(g) + 2 for g in self.grids)
+        coords = [self._bins(patients[r.column].to_numpy(dtype=float, na_value=np.nan), r, g)
+                  for r, g in zip(self.rules, self.grids)]
+        flat = np.ravel_multi_index(coords, shape) if coords else np.zeros(len(patients), dtype=np.intp)
+        size = int(np.prod(shape))
+
+        stats = [np.bincount(flat, minlength=size)]
+        for col in self.outcomes:
+            stats.append(np.bincount(flat, weights=patients[col].to_numpy(dtype=float, na_value=0), minlength=size))
+        hist = np.stack(stats).round().astype(np.int64).reshape((len(stats),) + shape)
+
+        # Zero pad in front of every marker axis, then cumulative sums along each
+        sat = np.pad(hist, [(0, 0)] + [(1, 0)] * len(shape))
+        for axis in range(1, sat.ndim):
+            np.cumsum(sat, axis=axis, out=sat)
+        self.sat = sat
+
+    def append(self, patients):
+        """Index over this index's patients plus `patients`. Summed-area tables
+        are linear in the histogram, so the new patients' table is simply added."""
+        other = ThresholdIndex(patients, self.rules, {r.name: g for r, g in zip(self.rules, self.grids)},
+                               self.outcomes)
+        if [r.name for r in other.rules] != [r.name for r in self.rules] or other.outcomes != self.outcomes:
+            raise ValueError("New patients do not have the indexed score and outcome columns")
+        merged = copy.copy(self)
+        merged.sat = self.sat + other.sat
+        return merged
+
+    @staticmethod
+    def _bins(values, rule, grid):
+        b = np.searchsorted(grid, values, side=_SIDES[rule.op])
+        missing = np.isnan(values)
+        if _is_high(rule):
+            return np.where(missing, 0, b + 1)
+        return np.where(missing, len(grid) + 1, b)
+
+    def _ranges(self, axis, k, abnormal):
+        """Half-open padded-SAT range [lo, hi) of bins on one side of grid index k."""
+        G = len(self.grids[axis])
+        if _is_high(self.rules[axis]):
+            return (k + 2, G + 2) if abnormal else (0, k + 2)
+        return (0, k + 1) if abnormal else (k + 1, G + 2)
+
+    def _box_sum(self, lo, hi):
+        """Stats summed over the box [lo, hi) per axis; lo/hi entries may be arrays."""
+        d = len(lo)
+        shape = np.broadcast_shapes(*(np.shape(x) for x in lo + hi))
+        total = 0
+        for corner in itertools.product((0, 1), repeat=d):
+            idx = tuple(np.broadcast_to(hi[a] if c else lo[a], shape) for a, c in enumerate(corner))
+            sign = -1 if (d - sum(corner)) % 2 else 1
+            total = total + sign * self.sat[(slice(None),) + idx]
+        return total
+
+    def _score_box(self, ks, abnormal):
+        lo, hi = zip(*(self._ranges(a, k, abnormal) for a, k in enumerate(ks)))
+        return self._box_sum(lo, hi)
+
+    def query(self, thresholds=None):
+        """Score 0 and Score 3 populations at the given cut-offs.
+
+        Returns a frame indexed ['Score 0', 'Score 3'] with 'patients' and each
+        outcome as a percentage of patients (NaN for an empty group).
+        """
+        ks = [self.grid_index(r.name, t) for r, t in zip(self.rules, self.thresholds(thresholds).values())]
+        return self._score_frame({'Score 0': self._score_box(ks, abnormal=False),
+                                  'Score 3': self._score_box(ks, abnormal=True)})
+
+    def roc_table(self):
+        """Score 3 as a classifier of each outcome over the full threshold grid.
+
+        One row per grid combination with the cut-offs, Score 3 patients and,
+        per outcome, events, sensitivity, specificity and PPV (%). All
+        combinations are evaluated in one broadcast pass over the table.
+        """
+        d = len(self.rules)
+        ks = np.meshgrid(*[np.arange(len(g)) for g in self.grids], indexing='ij')
+        stats = self._score_box(ks, abnormal=True).reshape(len(self.outcomes) + 1, -1)
+        totals = self.sat[(slice(None),) + (-1,) * d]
+
+        table = {r.name: g[k.ravel()] for r, g, k in zip(self.rules, self.grids, ks)}
+        n = stats[0]
+        table['patients'] = n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for i, col in enumerate(self.outcomes, start=1):
+                events = stats[i]
+                total_events = totals[i]
+                total_non = totals[0] - total_events
+                table[f'{col}_events'] = events
+                table[f'{col}_sensitivity'] = events / total_events * 100 if total_events else np.nan
+                table[f'{col}_specificity'] = (total_non - (n - events)) / total_non * 100 if total_non else np.nan
+                table[f'{col}_ppv'] = np.where(n > 0, events / n * 100, np.nan)
+        return pd.DataFrame(table)
@@ -0,0 +1,196 @@
+"""
+Scalable synthetic cohorts with the workbook's schema
+
+fit_model() reads the real tables and records, per sheet and column, the
+dtype, missing rate and either the observed values with their frequencies
+(strings, dates, flags and other low-cardinality columns) or quantiles to
+sample from (lab values and other continuous columns). For prescriptions it
+records how many distinct drugs a patient takes and how often each drug is
+prescribed. generate() samples any number of patients from that model, one row
+per patient in the six patient sheets and a variable number of drug rows in
+Patient_Precriptions. Columns are sampled independently, so marginal
+distributions match the source but cross-column correlations do not.
+
+write_synthetic() streams chunks to one Parquet file per sheet, in the same
+layout as a cache entry (derived columns included), so 10M patients never
+have to fit in memory at once.
+
+    python -m hf_analytics.synthetic 200800 data/.synthetic/100x
+
+"""
+
+import argparse
+import os
+import shutil
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.loader import DATA_PATH, DERIVED_COLUMNS, SHEETS, add_derived_columns, load_tables
+
+# Numeric columns with at most this many distinct values are sampled as categories
+DISCRETE_MAX = 30
+QUANTILES = 201
+CHUNK_PATIENTS = 250_000
+
+# kind: "discrete" (values/weights), "continuous" (quantile values) or "empty" (all missing)
+ColumnSpec = namedtuple("ColumnSpec", ["kind", "values", "weights", "missing", "dtype", "decimals"])
+PrescriptionSpec = namedtuple("PrescriptionSpec", ["counts", "count_weights", "drugs", "drug_weights"])
+
+
+def _decimals(values, max_decimals=4):
+    for d in range(max_decimals + 1):
+        if np.allclose(np.round(values, d), values):
+            return d
+    return None
+
+
+def fit_column(s):
+    """ColumnSpec for one source column."""
+    present = s.dropna()
+    missing = 1 - len(present) / len(s) if len(s) else 0.0
+    if present.empty:
+        return ColumnSpec("empty", None, None, 1.0, s.dtype, None)
+    numeric = s.dtype.kind in "iuf"
+    if not numeric or present.nunique() <= DISCRETE_MAX:
+        freq = present.value_counts(normalize=True, sort=False)
+        return ColumnSpec("discrete", freq.index.to_numpy(), freq.to_numpy(), missing, s.dtype, None)
+    values = present.to_numpy(dtype=np.float64)
+    quantiles = np.quantile(values, np.linspace(0, 1, QUANTILES))
+    return ColumnSpec("continuous", quantiles, None, missing, s.dtype, _decimals(values))
+
+
+def fit_prescriptions(prescriptions, patient_ids):
+    """Drugs-per-patient distribution (zeros included) and drug frequencies."""
+    per_patient = prescriptions.groupby("inpatient_number").size()
+    per_patient = per_patient.reindex(patient_ids, fill_value=0)
+    counts = per_patient.value_counts(normalize=True, sort=False)
+    drugs = prescriptions["Drug_name"].value_counts(normalize=True)
+    return PrescriptionSpec(counts.index.to_numpy(), counts.to_numpy(),
+                            drugs.index.to_numpy(dtype=object), drugs.to_numpy())
+
+
+def fit_model(tables):
+    """{sheet: {column: ColumnSpec}} for the patient sheets (None for inpatient_number,
+    in source column order) plus the PrescriptionSpec. Derived columns are fitted
+    too, for when generate() cannot compute them from the sampled inputs."""
+    model = {}
+    for name in SHEETS:
+        if name == "Patient_Precriptions":
+            continue
+        model[name] = {col: None if col == "inpatient_number" else fit_column(tables[name][col])
+                       for col in tables[name].columns}
+    model["Patient_Precriptions"] = fit_prescriptions(tables["Patient_Precriptions"],
+                                                      tables["Demography"]["inpatient_number"])
+    return model
+
+
+# SAMPLING
+def sample_column(spec, n, rng):
+    if spec.kind == "empty":
+        return pd.Series(np.full(n, np.nan), dtype=spec.dtype if spec.dtype.kind == "f" else "float64")
+    if spec.kind == "discrete":
+        values = spec.values[rng.choice(len(spec.values), size=n, p=spec.weights)]
+    else:
+        values = np.interp(rng.random(n), np.linspace(0, 1, len(spec.values)), spec.values)
+        if spec.dtype.kind in "iu":
+            values = np.rint(values)
+        elif spec.decimals is not None:
+            values = np.round(values, spec.decimals)
+    s = pd.Series(values)
+    if spec.missing > 0:
+        s = s.where(rng.random(n) >= spec.missing)
+    if spec.missing == 0 or spec.dtype.kind not in "iub":
+        s = s.astype(spec.dtype)
+    return s
+
+
+def sample_prescriptions(spec, patient_ids, rng):
+    """Long prescriptions table: a drug count per patient, then that many distinct
+    drugs drawn by frequency (Gumbel top-k, i.e. weighted draws without replacement)."""
+    n = len(patient_ids)
+    counts = spec.counts[rng.choice(len(spec.counts), size=n, p=spec.count_weights)]
+    counts = np.minimum(counts, len(spec.drugs))
+    keys = np.log(spec.drug_weights) + rng.gumbel(size=(n, len(spec.drugs)))
+    ranked = np.argsort(-keys, axis=1)
+    take = np.arange(len(spec.drugs)) < counts[:, None]
+    return pd.DataFrame({
+        "inpatient_number": np.repeat(np.asarray(patient_ids), counts),
+        "Drug_name": pd.array(spec.drugs[ranked[take]], dtype="str"),
+    })
+
+
+def generate(model, n_patients, seed=0, first_id=1):
+    """{sheet: DataFrame} for n_patients synthetic patients with ids from first_id.
+
+    Derived columns (loader.DERIVED_COLUMNS) are computed from the sampled
+    values so scores and flags stay consistent, so the tables look like a
+    loaded cache entry. Derived columns whose inputs the source lacks (ageCat
+    without age) are sampled instead.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(first_id, first_id + n_patients, dtype=np.int64)
+    tables = {}
+    for name in SHEETS:
+        if name == "Patient_Precriptions":
+            tables[name] = sample_prescriptions(model[name], ids, rng)
+            continue
+        columns = {"inpatient_number": ids}
+        for col, spec in model[name].items():
+            if spec is not None and col not in DERIVED_COLUMNS.get(name, ()):
+                columns[col] = sample_column(spec, n_patients, rng)
+        tables[name] = pd.DataFrame(columns)
+    tables = add_derived_columns(tables)
+    for name, specs in model.items():
+        if isinstance(specs, dict):
+            for col in DERIVED_COLUMNS.get(name, ()):
+                if col not in tables[name].columns and specs.get(col) is not None:
+                    tables[name][col] = sample_column(specs[col], n_patients, rng)
+            tables[name] = tables[name][[c for c in specs if c in tables[name].columns]]
+    return tables
+
+
+def write_synthetic(model, n_patients, out_dir, seed=0, chunk_patients=CHUNK_PATIENTS):
+    """Generate n_patients in chunks and stream them to out_dir/<sheet>.parquet.
+
+    Each chunk has its own seed (derived from seed), so the output does not
+    depend on memory but does depend on chunk_patients. Returns rows per sheet.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    writers, rows = {}, dict.fromkeys(SHEETS, 0)
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_patients // chunk_patients))
+    try:
+        for i, chunk_seed in enumerate(seeds):
+            start = i * chunk_patients
+            size = min(chunk_patients, n_patients - start)
+            tables = generate(model, size, seed=chunk_seed, first_id=start + 1)
+            for name, df in tables.items():
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if name not in writers:
+                    writers[name] = pq.ParquetWriter(os.path.join(tmp_dir, f"{name}.parquet"), table.schema)
+                writers[name].write_table(table.cast(writers[name].schema))
+                rows[name] += len(df)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic cohort as per-sheet Parquet files")
+    parser.add_argument("patients", type=int)
+    parser.add_argument("out_dir")
+    parser.add_argument("--source", default=DATA_PATH, help="workbook the model is fitted on")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = write_synthetic(fit_model(load_tables(args.source)), args.patients, args.out_dir, seed=args.seed)
+    print(pd.Series(rows, name="rows").to_string())
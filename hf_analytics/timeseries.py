@@ -0,0 +1,214 @@
+"""
+Admission-date trends from daily count arrays
+
+DailyCounts holds, for every stratum (admission ward x admission way x
+gender) and every calendar day from the first to the last Admission_date,
+the cumulative sums of admissions and of each trend measure (outcome flags,
+Emergency admissions, Score 3 patients). Any weekly, monthly or rolling
+28/90-day total is then the difference of two cumulative values, so a trend
+chart costs O(days x selected strata) whatever the number of patients, and
+the sidebar's ward/gender selection picks strata instead of rows.
+append() adds new patients by accumulating only their days: the cumulative
+sums change from the earliest new date onwards, which for new admissions is
+the last few days.
+
+    from hf_analytics.analytics import Analytics
+    Analytics.load().cohort(wards=['ICU']).trends('28d', by='admission_way')
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from hf_analytics.cube import OUTCOME_FLAGS
+
+
+DATE_COLUMN = 'Admission_date'
+
+# Strata of the daily arrays; selections on these never touch patient rows
+TREND_DIMS = ['admission_ward', 'admission_way', 'gender']
+
+# Summed per day next to the admission count; reported as % of admissions
+TREND_MEASURES = OUTCOME_FLAGS + ['emergency', 'score3']
+
+# Calendar periods (pandas period codes) and rolling windows (days)
+FREQUENCIES = {'week': 'W', 'month': 'M', '28d': 28, '90d': 90}
+
+
+def trend_measures(patients):
+    """Per-patient values of the trend measures present in patients (0/1 floats)."""
+    out = {}
+    for flag in OUTCOME_FLAGS:
+        if flag in patients.columns:
+            out[flag] = patients[flag].to_numpy(dtype=float, na_value=0)
+    if 'admission_way' in patients.columns:
+        out['emergency'] = (patients['admission_way'] == 'Emergency').to_numpy(dtype=float)
+    if 'hf_top3_score' in patients.columns:
+        out['score3'] = (patients['hf_top3_score'] == 3).to_numpy(dtype=float)
+    return pd.DataFrame(out, index=patients.index)
+
+
+def _key(values):
+    return tuple(None if pd.isna(v) else v for v in values)
+
+
+class DailyCounts:
+    """Cumulative daily admissions and measure sums per stratum.
+
+    frame is either patient rows, or pre-aggregated rows (one per stratum and
+    day) with the admission count in the `weight` column and measure sums in
+    TREND_MEASURES columns, as the SQL backend returns them. Rows without an
+    admission date are left out.
+    """
+
+    def __init__(self, frame, dims=TREND_DIMS, weight=None, date_col=DATE_COLUMN):
+        self.dims = [d for d in dims if d in frame.columns]
+        self.date_col = date_col
+        dates = pd.to_datetime(frame[date_col]).dt.normalize()
+        known = dates.notna().to_numpy()
+        frame, dates = frame[known], dates[known]
+        if weight is None:
+            measures = trend_measures(frame)
+            counts = np.ones(len(frame))
+        else:
+            measures = frame[[m for m in TREND_MEASURES if m in frame.columns]].astype(float).fillna(0)
+            counts = frame[weight].to_numpy(dtype=float)
+        self.measures = ['patients'] + list(measures.columns)
+        values = np.column_stack([counts, measures.to_numpy(dtype=float)])
+
+        if self.dims:
+            grouped = frame[self.dims].groupby(self.dims, dropna=False, observed=True, sort=False)
+            codes = grouped.ngroup().to_numpy()
+            self.strata = grouped.size().reset_index()[self.dims]
+        else:
+            codes = np.zeros(len(frame), dtype=np.intp)
+            self.strata = pd.DataFrame(index=range(1 if len(frame) else 0))
+        self.start = dates.min() if len(dates) else pd.NaT
+        day = (dates - self.start).dt.days.to_numpy() if len(dates) else np.zeros(0, dtype=np.intp)
+        n_days = int(day.max()) + 1 if len(day) else 0
+
+        # Daily sums per stratum (one bincount per measure), then cumulative sums
+        # with a leading zero day so any range total is cum[end] - cum[start]
+        n_strata, n_measures = len(self.strata), len(self.measures)
+        flat = codes * n_days + day
+        daily = np.stack([np.bincount(flat, weights=values[:, m], minlength=n_strata * n_days)
+                          for m in range(n_measures)], axis=-1).reshape(n_strata, n_days, n_measures)
+        self.cum = np.zeros((n_strata, n_days + 1, n_measures))
+        np.cumsum(daily, axis=1, out=self.cum[:, 1:])
+
+    @property
+    def days(self):
+        """Calendar days covered, one per position of the daily arrays."""
+        if pd.isna(self.start):
+            return pd.DatetimeIndex([])
+        return pd.date_range(self.start, periods=self.cum.shape[1] - 1, freq='D')
+
+    def append(self, frame, weight=None):
+        """Counts over this object's rows plus frame's (same layout as the constructor).
+
+        Only frame's rows are accumulated; the existing cumulative sums are
+        extended to new days and strata and shifted from frame's earliest date on.
+        """
+        other = DailyCounts(frame, self.dims, weight, self.date_col)
+        if other.measures != self.measures:
+            raise ValueError("Appended rows do not have the same trend measures")
+        if not len(other.strata):
+            return self
+        merged = DailyCounts.__new__(DailyCounts)
+        merged.dims, merged.date_col, merged.measures = self.dims, self.date_col, self.measures
+
+        # Strata: existing ones keep their position, new ones are added at the end
+        index = {_key(row): i for i, row in enumerate(self.strata.itertuples(index=False))}
+        strata = [self.strata]
+        other_pos = []
+        for row in other.strata.itertuples(index=False):
+            key = _key(row)
+            if key not in index:
+                index[key] = len(index)
+                strata.append(pd.DataFrame([row], columns=self.dims))
+            other_pos.append(index[key])
+        merged.strata = pd.concat(strata, ignore_index=True) if len(strata) > 1 else self.strata
+
+        # Calendar: union of both ranges
+        if pd.isna(self.start):
+            merged.start, cum = other.start, np.zeros((0, 1, len(self.measures)))
+        else:
+            merged.start, cum = min(self.start, other.start), self.cum
+        front = (self.start - merged.start).days if not pd.isna(self.start) else 0
+        n_days = max(cum.shape[1] - 1 + front, (other.start - merged.start).days + other.cum.shape[1] - 1)
+        back = n_days - front - (cum.shape[1] - 1)
+        # Days before the old start add nothing; days after it carry the last total
+        cum = np.concatenate([np.zeros((cum.shape[0], front, cum.shape[2])), cum,
+                              np.repeat(cum[:, -1:], back, axis=1)], axis=1)
+        cum = np.concatenate([cum, np.zeros((len(merged.strata) - cum.shape[0],) + cum.shape[1:])])
+
+        # other's cumulative sums from its first day on, and its total after its last day
+        offset = (other.start - merged.start).days
+        span = other.cum.shape[1] - 1
+        rows = np.asarray(other_pos)
+        cum[rows, offset + 1:offset + span + 1] += other.cum[:, 1:]
+        cum[rows, offset + span + 1:] += other.cum[:, -1:]
+        merged.cum = cum
+        return merged
+
+    # QUERIES
+
+    def _select(self, where=None):
+        """Strata matching {dim: values} (empty selections do not filter)."""
+        keep = np.ones(len(self.strata), dtype=bool)
+        for dim, values in (where or {}).items():
+            if values is not None and len(values):
+                keep &= self.strata[dim].isin(values).to_numpy()
+        return keep
+
+    def _windows(self, freq, first, last):
+        """(labels, start positions, end positions) of the periods or rolling
+        windows within days first..last."""
+        step = FREQUENCIES[freq]
+        days = self.days[first:last + 1]
+        if isinstance(step, int):
+            ends = np.arange(first + step, last + 2)
+            return self.days[ends - 1], ends - step, ends
+        if not len(days):
+            return days, np.zeros(0, np.intp), np.zeros(0, np.intp)
+        periods = days.to_period(step)
+        edges = first + np.concatenate([[0], np.flatnonzero(np.diff(periods.asi8)) + 1, [len(days)]])
+        return periods[edges[:-1] - first].start_time, edges[:-1], edges[1:]
+
+    def series(self, freq='month', where=None, by=None):
+        """Admissions and measure rates (%) per period or rolling window.
+
+        freq is 'week' or 'month' (calendar periods, labelled by their first day)
+        or '28d' / '90d' (trailing windows, labelled by their last day), over the
+        days from the selection's first to its last admission. With by, one row
+        per window and value of that dimension. Columns: date, [by], patients,
+        then each measure as % of the window's admissions.
+        """
+        keep = self._select(where)
+        cum = self.cum[keep]
+        # First and last day with admissions in the selection
+        total = cum[..., 0].sum(axis=0)
+        first = int(np.searchsorted(total, 0, side='right')) - 1
+        last = int(np.searchsorted(total, total[-1] if len(total) else 0, side='left')) - 1
+        if by is None:
+            groups, cum = [None], cum.sum(axis=0)[None]
+        else:
+            codes, groups = pd.factorize(self.strata.loc[keep, by], sort=True)
+            summed = np.zeros((len(groups),) + cum.shape[1:])
+            # Strata with a missing `by` value (code -1) are left out
+            np.add.at(summed, codes[codes >= 0], cum[codes >= 0])
+            cum = summed
+        labels, starts, ends = self._windows(freq, first, last)
+        sums = cum[:, ends] - cum[:, starts]
+        frames = []
+        for g, value in enumerate(groups):
+            n = sums[g, :, 0]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rates = sums[g, :, 1:] / n[:, None] * 100
+            frame = pd.DataFrame(rates, columns=self.measures[1:])
+            frame.insert(0, 'patients', n.round().astype(np.int64))
+            frame.insert(0, 'date', labels)
+            if by is not None:
+                frame.insert(1, by, value)
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['date', 'patients'])
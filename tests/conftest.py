@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import pytest
+
+from hf_analytics.loader import DATA_PATH, load_tables
+from hf_analytics.synthetic import fit_model, generate
+
+
+WORKBOOK = Path(__file__).resolve().parent.parent / DATA_PATH
+
+
+@pytest.fixture(scope="session")
+def workbook():
+    return WORKBOOK
+
+
+@pytest.fixture(scope="session")
+def cache_dir(tmp_path_factory):
+    """Parquet cache of the workbook, built once for the session."""
+    directory = tmp_path_factory.mktemp("cache")
+    load_tables(WORKBOOK, cache_dir=directory)
+    return directory
+
+
+@pytest.fixture(scope="session")
+def model(cache_dir):
+    return fit_model(load_tables(WORKBOOK, cache_dir=cache_dir))
+
+
+@pytest.fixture(scope="session")
+def tables(model):
+    """A small synthetic cohort with the workbook's sheets and derived columns."""
+    return generate(model, 400, seed=1)
+
+
+@pytest.fixture(scope="session")
+def batch(model):
+    """New patients following `tables`, as a delta batch would add them."""
+    return generate(model, 100, seed=2, first_id=401)
@@ -0,0 +1,51 @@
+import asyncio
+
+from hf_analytics.alerts import AlertEngine, discard_alerts, parse_event, tail_file
+
+
+def test_bad_events_are_skipped_and_counted():
+    lines = ['{"inpatient_number": 1, "GCS": 10}', '{"GCS": 3}', '{"inpatient_number": 2, "sodium": "abc"}',
+             'not json {', '{"inpatient_number": 3, "lactate": [1]}', '']
+    events = [e for e in map(parse_event, lines) if e is not None]
+    engine = AlertEngine(sink=discard_alerts)
+    alerts = engine.process(events)
+    assert [a['inpatient_number'] for a in alerts] == [1]
+    report = engine.report()
+    assert report['events'] == 1
+    assert report['skipped'] == 4
+
+
+def test_batch_of_bad_events_only():
+    engine = AlertEngine(sink=discard_alerts)
+    assert engine.process([{}, {'inpatient_number': None}], received=[0.0, 0.0]) == []
+    assert engine.report()['skipped'] == 2
+
+
+def test_line_written_in_two_parts_is_one_event(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_text('{"inpatient_number": 5, "GCS": 1')
+
+    async def follow():
+        events = tail_file(path, poll=0.01)
+        first = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.05)
+        with open(path, "a") as f:
+            f.write('0}\n{"inpatient_number": 6, "GCS": 15}\n')
+        received = [await asyncio.wait_for(first, 1), await asyncio.wait_for(events.__anext__(), 1)]
+        await events.aclose()
+        return received
+
+    engine = AlertEngine(sink=discard_alerts)
+    alerts = engine.process(asyncio.run(follow()))
+    assert [(a['alert'], a['inpatient_number']) for a in alerts] == [('gcs_high_risk', 5)]
+    assert engine.report()['skipped'] == 0
+
+
+def test_last_line_without_newline_is_read_at_end_of_file(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_text('{"inpatient_number": 1}\n{"inpatient_number": 2, "GCS": 9}')
+
+    async def read():
+        return [e async for e in tail_file(path, follow=False)]
+
+    assert asyncio.run(read()) == [{'inpatient_number': 1}, {'inpatient_number': 2, 'GCS': 9}]
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hf_analytics.analytics import Analytics
+from hf_analytics.cube import CUBE_DIMS, OUTCOME_FLAGS, build_outcome_cube, merge_cubes
+from hf_analytics.patients import build_patient_table
+
+
+SELECTIONS = [
+    {},
+    {"genders": ["Female"]},
+    {"wards": ["ICU", "Cardiology"]},
+    {"genders": ["Male"], "where": {"admission_way": ["Emergency"]}},
+]
+
+
+def _rows(patients, genders=None, wards=None, where=None):
+    keep = pd.Series(True, index=patients.index)
+    if genders:
+        keep &= patients['gender'].isin(genders)
+    if wards:
+        keep &= patients['admission_ward'].isin(wards)
+    for col, values in (where or {}).items():
+        keep &= patients[col].isin(values)
+    return patients[keep]
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+def test_kpis_match_patient_rows(tables, selection):
+    data = Analytics(tables)
+    kpis = data.cohort(**selection).kpis()
+    rows = _rows(data.patients, **selection)
+    assert kpis['patients'] == len(rows)
+    for flag in OUTCOME_FLAGS:
+        assert np.isclose(kpis[flag], rows[flag].fillna(False).sum() / len(rows) * 100)
+    assert kpis['score3_patients'] == (rows['hf_top3_score'] == 3).sum()
+    assert np.isclose(kpis['score3_pct'], (rows['hf_top3_score'] == 3).mean() * 100)
+
+
+@pytest.mark.parametrize("by", ['admission_way', 'NYHA_cardiac_function_classification', 'hf_top3_score'])
+def test_outcome_rates_match_groupby(tables, by):
+    data = Analytics(tables)
+    rates = data.cohort(wards=["Cardiology", "GeneralWard"]).outcome_rates(by).set_index(by)
+    rows = _rows(data.patients, wards=["Cardiology", "GeneralWard"])
+    grouped = rows.groupby(by)
+    np.testing.assert_array_equal(rates['patients'], grouped.size())
+    expected = grouped[OUTCOME_FLAGS].sum() / grouped.size().to_numpy()[:, None] * 100
+    np.testing.assert_allclose(rates[OUTCOME_FLAGS].to_numpy(dtype=float), expected.to_numpy(dtype=float))
+
+
+def _sorted(cube):
+    dims = [d for d in CUBE_DIMS if d in cube.columns]
+    keys = cube[dims].astype(str)
+    return cube.loc[keys.sort_values(dims).index].reset_index(drop=True)
+
+
+def test_merge_cubes_matches_full_build(tables, batch):
+    old, new = build_patient_table(tables), build_patient_table(batch)
+    merged = merge_cubes(build_outcome_cube(old), build_outcome_cube(new))
+    full = build_outcome_cube(pd.concat([old, new]))
+    assert merged['patients'].sum() == len(old) + len(new)
+    pd.testing.assert_frame_equal(_sorted(merged), _sorted(full), check_dtype=False)
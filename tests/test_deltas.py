@@ -0,0 +1,83 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hf_analytics.analytics import Analytics
+from hf_analytics.deltas import LiveData
+from hf_analytics.loader import DERIVED_COLUMNS
+from hf_analytics.synthetic import generate
+from hf_analytics.timeseries import DailyCounts
+
+
+SELECTIONS = [
+    {},
+    {"genders": ["Female"], "wards": ["ICU"]},
+    {"wards": ["Cardiology"], "where": {"admission_way": ["Emergency"]}},
+]
+
+
+def _built(data):
+    """data with every appendable structure built, as a running app has them."""
+    data.patients, data.filters, data.cube, data.sweep, data.drugs, data.daily
+    return data
+
+
+def _assert_same(a, b):
+    for selection in SELECTIONS:
+        x, y = a.cohort(**selection), b.cohort(**selection)
+        kx, ky = x.kpis(), y.kpis()
+        assert kx.keys() == ky.keys()
+        assert all(np.isclose(kx[k], ky[k], equal_nan=True) for k in kx)
+        pd.testing.assert_series_equal(x.top_drugs(10), y.top_drugs(10))
+
+
+def test_append_matches_full_reload(tables, batch):
+    appended = _built(Analytics(tables)).append(batch)
+    full = Analytics({name: pd.concat([df, batch[name]], ignore_index=True) for name, df in tables.items()})
+    assert appended.version == 1
+    _assert_same(appended, full)
+    cohort, expected = appended.cohort(wards=["ICU", "Cardiology"]), full.cohort(wards=["ICU", "Cardiology"])
+    pd.testing.assert_frame_equal(cohort.score_outcomes(), expected.score_outcomes())
+    pd.testing.assert_frame_equal(cohort.trends('month'), expected.trends('month'))
+
+
+def test_append_rejects_loaded_patients(tables):
+    data = _built(Analytics(tables))
+    with pytest.raises(ValueError, match="must be new"):
+        data.append({name: df.head(5) for name, df in tables.items()})
+
+
+@pytest.mark.parametrize("freq", ['week', 'month', '28d'])
+def test_daily_counts_append_matches_full_build(tables, batch, freq):
+    old, new = Analytics(tables).patients, Analytics(batch).patients
+    appended = DailyCounts(old).append(new)
+    full = DailyCounts(pd.concat([old, new]))
+    for where, by in [(None, None), ({'gender': ['Male']}, 'admission_way')]:
+        pd.testing.assert_frame_equal(appended.series(freq, where, by), full.series(freq, where, by))
+
+
+def test_live_data_picks_up_a_batch(workbook, model, cache_dir, tmp_path):
+    cache, deltas = tmp_path / "cache", tmp_path / "deltas"
+    shutil.copytree(cache_dir, cache)
+
+    def load():
+        return _built(Analytics.load(workbook, cache_dir=cache))
+
+    live = LiveData(load, workbook, cache, deltas)
+    first_id = int(live.data.patients.index.max()) + 1
+    before = live.current()
+
+    # A batch as it would arrive: source columns only, derived ones computed on ingest
+    batch_dir = deltas / "2024-06-01"
+    batch_dir.mkdir(parents=True)
+    for name, df in generate(model, 60, seed=3, first_id=first_id).items():
+        df.drop(columns=DERIVED_COLUMNS.get(name, [])).to_parquet(batch_dir / f"{name}.parquet", index=False)
+
+    data = live.current()
+    assert data is not before
+    assert live.batches == ["2024-06-01"]
+    assert data.n_patients == before.n_patients + 60
+    assert live.current() is data
+    _assert_same(data, Analytics.load(workbook, cache_dir=cache))
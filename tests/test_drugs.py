@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hf_analytics.drugs import DrugMatrix
+from hf_analytics.patients import build_patient_table
+
+
+MASKS = {
+    "all": lambda patients: np.ones(len(patients), dtype=bool),
+    "female": lambda patients: (patients['gender'] == 'Female').to_numpy(),
+    "icu": lambda patients: (patients['admission_ward'] == 'ICU').to_numpy(),
+}
+
+
+@pytest.fixture(scope="module")
+def cohort(tables):
+    patients = build_patient_table(tables)
+    return patients, tables['Patient_Precriptions'], DrugMatrix(tables['Patient_Precriptions'], patients.index)
+
+
+def _rows(prescriptions, patients, mask):
+    return prescriptions[prescriptions['inpatient_number'].isin(patients.index[mask])]
+
+
+@pytest.mark.parametrize("name", MASKS)
+def test_counts_match_groupby(cohort, name):
+    patients, prescriptions, matrix = cohort
+    mask = MASKS[name](patients)
+    rows = _rows(prescriptions, patients, mask)
+    assert matrix.prescriptions(mask) == len(rows)
+
+    per_drug = rows.groupby('Drug_name')['inpatient_number'].nunique().rename('patients')
+    pd.testing.assert_series_equal(matrix.patients_per_drug(mask), per_drug, check_dtype=False,
+                                   check_index_type=False)
+    pd.testing.assert_series_equal(matrix.top_drugs(10, mask),
+                                   per_drug.sort_values(ascending=False, kind='stable').head(10),
+                                   check_dtype=False, check_index_type=False)
+
+    per_patient = (rows.groupby('inpatient_number')['Drug_name'].nunique()
+                   .reindex(patients.index[mask], fill_value=0).rename('drug_count'))
+    pd.testing.assert_series_equal(matrix.drugs_per_patient(mask), per_patient, check_dtype=False,
+                                   check_index_type=False)
+
+
+@pytest.mark.parametrize("name", MASKS)
+def test_group_counts_match_crosstab(cohort, name):
+    patients, prescriptions, matrix = cohort
+    mask = MASKS[name](patients)
+    rows = _rows(prescriptions, patients, mask).join(patients['admission_way'], on='inpatient_number')
+    expected = pd.crosstab(rows['Drug_name'], rows['admission_way'])
+    pd.testing.assert_frame_equal(matrix.group_counts(patients['admission_way'], mask), expected,
+                                  check_dtype=False, check_index_type=False, check_column_type=False)
+
+
+@pytest.mark.parametrize("name", MASKS)
+def test_co_prescriptions_match_self_join(cohort, name):
+    patients, prescriptions, matrix = cohort
+    mask = MASKS[name](patients)
+    rows = _rows(prescriptions, patients, mask)[['inpatient_number', 'Drug_name']].drop_duplicates()
+    pairs = rows.merge(rows, on='inpatient_number', suffixes=('_a', '_b'))
+    pairs = pairs[pairs['Drug_name_a'] < pairs['Drug_name_b']]
+    both = pairs.groupby(['Drug_name_a', 'Drug_name_b']).size()
+    per_drug = rows['Drug_name'].value_counts()
+    n_a = per_drug[both.index.get_level_values(0)].to_numpy()
+    n_b = per_drug[both.index.get_level_values(1)].to_numpy()
+    n = rows['inpatient_number'].nunique()
+
+    result = matrix.co_prescriptions(mask)
+    assert list(zip(result['drug_a'], result['drug_b'])) == list(both.index)
+    np.testing.assert_array_equal(result['patients'], both)
+    np.testing.assert_allclose(result['support'], both / n * 100)
+    np.testing.assert_allclose(result['lift'], both * n / (n_a * n_b))
+    np.testing.assert_allclose(result['jaccard'], both / (n_a + n_b - both))
+
+
+def test_append_matches_full_build(tables, batch):
+    old, new = tables['Patient_Precriptions'], batch['Patient_Precriptions']
+    # A drug only the new patients take joins the vocabulary mid-way
+    old = old[old['Drug_name'] != new['Drug_name'].iloc[0]]
+    old_ids, new_ids = build_patient_table(tables).index, build_patient_table(batch).index
+    appended = DrugMatrix(old, old_ids).append(new, new_ids)
+    full = DrugMatrix(pd.concat([old, new], ignore_index=True), old_ids.append(new_ids))
+    assert appended.drugs.equals(full.drugs)
+    assert len(appended.drugs) > len(DrugMatrix(old, old_ids).drugs)
+    np.testing.assert_array_equal(appended.ids, full.ids)
+    assert (appended.X != full.X).nnz == 0
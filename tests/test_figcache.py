@@ -0,0 +1,25 @@
+import plotly.graph_objects as go
+
+from hf_analytics.figcache import FigureCache
+
+
+def _figure(label):
+    return go.Figure(go.Bar(x=[label], y=[1]))
+
+
+def test_budget_counts_encoded_bytes():
+    cache = FigureCache()
+    fig = cache.get_or_build("bar", "sig", lambda: _figure("Ödem ü"))
+    assert cache.stats()["bytes"] == len(fig.to_json().encode())
+    assert cache.stats()["bytes"] > len(fig.to_json())
+
+
+def test_evicts_least_recently_used_over_budget():
+    size = len(_figure("a").to_json().encode())
+    cache = FigureCache(max_bytes=2 * size)
+    for label in "abc":
+        cache.get_or_build("bar", label, lambda: _figure(label))
+    assert cache.stats()["figures"] == 2
+    assert cache.stats()["bytes"] <= 2 * size
+    cache.get_or_build("bar", "a", lambda: _figure("a"))
+    assert cache.stats()["misses"] == 4
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hf_analytics.filters import FilterEngine
+from hf_analytics.patients import build_patient_table
+
+
+SELECTIONS = [
+    {},
+    {"genders": ["Female"]},
+    {"wards": ["ICU", "Cardiology"]},
+    {"genders": ["Male"], "wards": ["GeneralWard"]},
+    {"genders": ["Female", "Male"], "wards": ["Nowhere"]},
+]
+
+
+def _expected(patients, genders=None, wards=None, age_range=None):
+    keep = pd.Series(True, index=patients.index)
+    if genders:
+        keep &= patients['gender'].isin(genders)
+    if wards:
+        keep &= patients['admission_ward'].isin(wards)
+    if age_range is not None:
+        keep &= patients['age'].between(*age_range)
+    return keep.to_numpy()
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+def test_mask_and_take_match_isin(tables, selection):
+    patients = build_patient_table(tables)
+    engine = FilterEngine(patients, tables)
+    mask = engine.mask(**selection)
+    np.testing.assert_array_equal(mask, _expected(patients, **selection))
+    ids = engine.patients(mask)
+    np.testing.assert_array_equal(ids, patients.index[mask])
+    for name, df in tables.items():
+        pd.testing.assert_frame_equal(engine.take(name, df, mask), df[df['inpatient_number'].isin(ids)])
+
+
+def test_age_range_drops_missing_ages(tables):
+    patients = build_patient_table(tables)
+    ages = np.random.default_rng(0).integers(20, 100, len(patients)).astype(float)
+    ages[::7] = np.nan
+    patients = patients.assign(age=ages)
+    engine = FilterEngine(patients, tables)
+    for age_range in [(20, 99), (40, 60), (101, 120)]:
+        np.testing.assert_array_equal(engine.mask(age_range=age_range, genders=["Male"]),
+                                      _expected(patients, genders=["Male"], age_range=age_range))
+
+
+def test_append_matches_full_build(tables, batch):
+    full_tables = {name: pd.concat([df, batch[name]], ignore_index=True) for name, df in tables.items()}
+    full = FilterEngine(build_patient_table(full_tables), full_tables)
+    appended = FilterEngine(build_patient_table(tables), tables).append(build_patient_table(batch), batch)
+    np.testing.assert_array_equal(appended.ids, full.ids)
+    for selection in SELECTIONS:
+        mask = appended.mask(**selection)
+        np.testing.assert_array_equal(mask, full.mask(**selection))
+        for name, df in full_tables.items():
+            pd.testing.assert_frame_equal(appended.take(name, df, mask), full.take(name, df, mask))
@@ -0,0 +1,66 @@
+import pytest
+
+from hf_analytics.flows import OTHER_LABEL, build_flow
+
+
+STAGES = ['admission_way', 'admission_ward', 'outcome_during_hospitalization', 'DestinationDischarge']
+
+
+def _frame(tables):
+    """Discharge rows with some stage values knocked out, so hops get skipped."""
+    frame = tables['Hospitalization_Discharge'][STAGES].astype(object)
+    frame.loc[::9, 'outcome_during_hospitalization'] = None
+    frame.loc[::13, 'DestinationDischarge'] = None
+    return frame
+
+
+def _links(flow):
+    """{(source stage, source label, target stage, target label): patients}"""
+    return {(flow.stages[s], flow.labels[s], flow.stages[t], flow.labels[t]): int(v)
+            for s, t, v in zip(flow.source, flow.target, flow.value)}
+
+
+def _expected(frame, stages):
+    """The same links from one groupby per pair of consecutive stages."""
+    links = {}
+    for a, b in zip(stages, stages[1:]):
+        for (va, vb), n in frame.groupby([a, b], observed=True).size().items():
+            if n:
+                links[(a, str(va), b, str(vb))] = int(n)
+    return links
+
+
+def _collapsed(frame, stages, min_count):
+    """Targets of links under min_count patients replaced by OTHER_LABEL, hop by hop."""
+    frame = frame[stages].astype(object)
+    for a, b in zip(stages, stages[1:]):
+        both = frame[a].notna() & frame[b].notna()
+        size = frame.groupby([a, b])[a].transform('size')
+        frame[b] = frame[b].where(~both | (size >= min_count), OTHER_LABEL)
+    return frame
+
+
+def test_links_match_groupby(tables):
+    frame = _frame(tables)
+    assert _links(build_flow(frame, STAGES)) == _expected(frame, STAGES)
+
+
+def test_missing_label_keeps_rows(tables):
+    frame = _frame(tables)
+    flow = build_flow(frame, STAGES, missing='Missing')
+    assert _links(flow) == _expected(frame.fillna('Missing'), STAGES)
+
+
+@pytest.mark.parametrize("min_count", [5, 20])
+def test_small_links_collapse_into_other(tables, min_count):
+    frame = _frame(tables)
+    flow = build_flow(frame, STAGES, min_count=min_count)
+    assert _links(flow) == _expected(_collapsed(frame, STAGES, min_count), STAGES)
+
+
+@pytest.mark.parametrize("min_count", [0, 20])
+def test_weighted_rows_match_patient_rows(tables, min_count):
+    frame = _frame(tables)
+    grouped = frame.groupby(STAGES, dropna=False, observed=True).size().reset_index(name='patients')
+    weighted = build_flow(grouped, STAGES, min_count=min_count, weight='patients')
+    assert _links(weighted) == _links(build_flow(frame, STAGES, min_count=min_count))
@@ -0,0 +1,16 @@
+import numpy as np
+from scipy.stats import chi2_contingency
+
+from hf_analytics.intervals import two_proportion_p
+
+
+def test_two_proportion_p_matches_uncorrected_chi_square():
+    for events1, n1, events0, n0 in [(6, 99, 1, 650), (3, 10, 2, 12), (40, 100, 35, 100)]:
+        table = [[events1, n1 - events1], [events0, n0 - events0]]
+        expected = chi2_contingency(table, correction=False)[1]
+        assert np.isclose(two_proportion_p(events1, n1, events0, n0), expected)
+
+
+def test_two_proportion_p_undefined_without_variation():
+    assert np.isnan(two_proportion_p(0, 5, 0, 5))
+    assert np.isnan(two_proportion_p(1, 0, 1, 3))
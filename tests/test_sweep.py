@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from hf_analytics.cube import OUTCOME_FLAGS
+from hf_analytics.sweep import ThresholdIndex
+
+
+def _patients(outcome):
+    frame = pd.DataFrame({
+        'lactate': [3.0, 1.0, 2.5, np.nan],
+        'sodium': [130.0, 140.0, 132.0, 138.0],
+        'high_sensitivity_troponin': [0.1, 0.01, 0.2, 0.02],
+    })
+    for col in OUTCOME_FLAGS:
+        frame[col] = pd.array(outcome, dtype="boolean")
+    return frame
+
+
+def test_missing_outcome_counts_as_no_event():
+    index = ThresholdIndex(_patients([True, pd.NA, pd.NA, False]))
+    result = index.query()
+    assert result.loc['Score 3', 'patients'] == 2
+    assert result.loc['Score 3', 'death_within_6_months'] == 50
+    assert result.loc['Score 0', 'patients'] == 2
+    assert result.loc['Score 0', 'death_within_6_months'] == 0
+
+
+def test_append_with_missing_outcome_matches_full_build():
+    old = _patients([True, False, True, False])
+    new = _patients([pd.NA, True, pd.NA, pd.NA])
+    appended = ThresholdIndex(old).append(new)
+    full = ThresholdIndex(pd.concat([old, new], ignore_index=True))
+    np.testing.assert_array_equal(appended.sat, full.sat)